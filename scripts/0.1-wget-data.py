@@ -5,7 +5,7 @@ from majorvocal.config import config
 
 # Wytham Great Tit song metadata - download and unzip
 folder_url = "https://files.de-1.osf.io/v1/resources/n8ac9/providers/osfstorage/64898c4bc861160288251fd1/?zip"
-save_path = config.PROJECT_STRUCTURE["metadata"] / "metadata.zip"
+save_path = config.output(config.PROJECT_STRUCTURE["metadata"] / "metadata.zip")
 
 subprocess.run(["wget", "--show-progress", "--progress=bar:force 2>&1", "-O", str(save_path), folder_url])
 subprocess.run(["unzip", str(save_path), "-d", str(save_path.parent)])
@@ -1,14 +1,16 @@
-import json
 from pathlib import Path
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+import polars as pl
 from scipy.spatial import distance
 from sklearn.manifold import MDS
 
 from majorvocal.config import config
+from majorvocal.detections import convert_json, read_detections
 
+detections_dir = Path(config.PROJECT_PATH, "data", "derived", "detections")
 detections_file = Path(config.PROJECT_PATH, "data", "derived", "detections.json")
 
 
@@ -39,16 +41,24 @@ textsize = 15
 
 # ──── DATA INGEST ────────────────────────────────────────────────────────────
 
-# Read the detections from the json file and convert to a pandas DataFrame
-with open(detections_file, encoding="utf-8") as file:
-    detections = json.load(file)
-
-df = pd.DataFrame(detections, columns=["file_name", "site", "detections"])
-df = df.explode("detections").dropna(subset=["detections"])
-df = pd.concat([df, df["detections"].apply(pd.Series)], axis=1)
-df["start_time"] = pd.to_datetime(df["file_name"], format="%Y%m%d_%H%M%S") + pd.to_timedelta(df["start_time"], unit="s")
-df["end_time"] = pd.to_datetime(df["file_name"], format="%Y%m%d_%H%M%S") + pd.to_timedelta(df["end_time"], unit="s")
-df = df.sort_values(["file_name", "start_time"])
+# Read all detections from the Parquet dataset (converted from the json file
+# of older runs if needed) and convert to a pandas DataFrame
+if not detections_dir.exists():
+    convert_json(detections_file, detections_dir)
+columns = ["timestamp", "pnum", "start_time", "end_time", "confidence"]
+detections = pl.from_arrow(read_detections(detections_dir, columns=columns)).drop_nulls("start_time")
+recorded = pl.col("timestamp").str.strptime(pl.Datetime, "%Y%m%d_%H%M%S")
+df = (
+    detections.select(
+        pl.col("timestamp").alias("file_name"),
+        pl.col("pnum").alias("site"),
+        (recorded + pl.duration(microseconds=(pl.col("start_time") * 1e6).cast(pl.Int64))).alias("start_time"),
+        (recorded + pl.duration(microseconds=(pl.col("end_time") * 1e6).cast(pl.Int64))).alias("end_time"),
+        "confidence",
+    )
+    .sort("file_name", "start_time")
+    .to_pandas()
+)
 df["time_bin"] = df["start_time"].dt.floor("30min")
 
 
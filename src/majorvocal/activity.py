@@ -0,0 +1,265 @@
+"""
+Detection counts by pnum, day and time of day, as a dense array.
+
+Questions about when birds sing (activity by time of day at one site in 2021,
+the dawn histogram of a season) become sums over slices of an array indexed
+by pnum, date and time-of-day bin, instead of group-bys over every detection.
+There is one array per year, ``<year>.npy``, in numpy's format so that it is
+memory-mapped and a query only reads the rows it touches; ``axes.json`` holds
+the labels of its axes. A nestbox-year spans a few weeks of recordings, so
+the arrays are small and mostly dense: a thousand pnums over a hundred days
+in 30-minute bins take 19 MB.
+
+ActivityCube.update counts the per-pnum detections of DerivedTables (see
+majorvocal.aggregate) and only recounts the pnums whose detections changed
+since the last update. An array is rewritten when its axes grow; otherwise
+the changed rows are overwritten in place.
+"""
+import json
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+import polars as pl
+
+from majorvocal.aggregate import DerivedTables
+
+BIN_MINUTES = 30
+
+
+def bin_counts(detections: pl.DataFrame, bin_minutes: int = BIN_MINUTES) -> pl.DataFrame:
+    """
+    Counts detections per pnum, date and time-of-day bin of their start.
+
+    Args:
+        detections (pl.DataFrame): Output of majorvocal.utils.extract_parus_major
+            or load_parus_major. Recordings without detections (rows with a
+            null confidence) count as zero in the bin they start in, so their
+            days are kept.
+        bin_minutes (int): Width of the time-of-day bins.
+
+    Returns:
+        pl.DataFrame: Columns pnum, date, bin (index of the bin since
+        midnight) and count, sorted by pnum, date and bin.
+    """
+    recorded = pl.col("timestamp").str.strptime(pl.Datetime("ms"), "%Y%m%d_%H%M%S")
+    offset = pl.duration(milliseconds=(pl.col("start_time") * 1000).cast(pl.Int64))
+    start = (recorded + offset).fill_null(recorded)
+    minutes = start.dt.hour().cast(pl.Int32) * 60 + start.dt.minute().cast(pl.Int32)
+    return (
+        detections.lazy()
+        .group_by("pnum", start.dt.date().alias("date"), (minutes // bin_minutes).alias("bin"))
+        .agg(pl.col("confidence").is_not_null().sum().cast(pl.Int32).alias("count"))
+        .sort("pnum", "date", "bin")
+        .collect()
+    )
+
+
+def _open(path: Path, mode: str, shape: Optional[tuple] = None) -> np.ndarray:
+    return np.lib.format.open_memmap(path, mode=mode, dtype=np.int32, shape=shape)
+
+
+class ActivityCube:
+    """
+    Detection counts of one species by pnum, date and time-of-day bin,
+    stored in ``root`` (see the module docstring).
+
+    Args:
+        root (Path): Directory of the arrays; created if needed.
+        bin_minutes (int): Width of the time-of-day bins; a divisor of a
+            day. Arrays built with another width are rebuilt on update.
+
+    Raises:
+        ValueError: If ``bin_minutes`` does not divide a day.
+    """
+
+    def __init__(self, root: Path, bin_minutes: int = BIN_MINUTES):
+        if (24 * 60) % bin_minutes:
+            raise ValueError(f"{bin_minutes} minutes does not divide a day")
+        self.root = Path(root)
+        self.bin_minutes = bin_minutes
+        self.n_bins = 24 * 60 // bin_minutes
+        self._axes_path = self.root / "axes.json"
+        self.axes = self._load()
+
+    def _load(self) -> dict:
+        empty = {"bin_minutes": self.bin_minutes, "years": {}, "sources": {}}
+        if not self._axes_path.exists():
+            return empty
+        axes = json.loads(self._axes_path.read_text())
+        if axes["bin_minutes"] != self.bin_minutes:
+            return empty
+        for year, labels in axes["years"].items():
+            # An update interrupted between writing an array and its labels
+            path = self._path(int(year))
+            if not path.exists() or _open(path, "r").shape != (len(labels["pnums"]), labels["days"], self.n_bins):
+                return empty
+        return axes
+
+    def _path(self, year: int) -> Path:
+        return self.root / f"{year}.npy"
+
+    @property
+    def years(self) -> list[int]:
+        return sorted(int(year) for year in self.axes["years"])
+
+    def pnums(self, year: int) -> list[str]:
+        """
+        Returns the labels of the first axis of the array of ``year``.
+        """
+        return self.axes["years"][str(year)]["pnums"]
+
+    def dates(self, year: int) -> list[date]:
+        """
+        Returns the labels of the second axis of the array of ``year``.
+        """
+        labels = self.axes["years"][str(year)]
+        start = date.fromisoformat(labels["start"])
+        return [start + timedelta(days=i) for i in range(labels["days"])]
+
+    def bins(self) -> np.ndarray:
+        """
+        Returns the start of each time-of-day bin, in minutes since midnight.
+        """
+        return np.arange(self.n_bins) * self.bin_minutes
+
+    def counts(self, year: int) -> np.ndarray:
+        """
+        Returns the array of ``year``, memory-mapped read-only.
+        """
+        return _open(self._path(year), "r")
+
+    def select(
+        self,
+        year: int,
+        pnums: Optional[Iterable[str]] = None,
+        locations: Optional[Iterable[str]] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+    ) -> tuple[np.ndarray, list[str], list[date]]:
+        """
+        Returns the counts of one year for some pnums and dates; only the
+        selected rows are read.
+
+        Args:
+            year (int): Year of the array.
+            pnums (Iterable[str], optional): Only these nestbox-years.
+            locations (Iterable[str], optional): Only these nestboxes (the
+                pnum without its first five characters, e.g. ``EX26``).
+            start_date (date, optional): First date, inclusive.
+            end_date (date, optional): Last date, inclusive.
+
+        Returns:
+            tuple: The counts (pnums × dates × bins) and the labels of the
+            first two axes.
+        """
+        if str(year) not in self.axes["years"]:
+            return np.zeros((0, 0, self.n_bins), dtype=np.int32), [], []
+        labels, days = self.pnums(year), self.dates(year)
+        keep = np.ones(len(labels), dtype=bool)
+        if pnums is not None:
+            keep &= np.isin(labels, list(pnums))
+        if locations is not None:
+            keep &= np.isin([pnum[5:] for pnum in labels], list(locations))
+        first = 0 if start_date is None else max(0, (start_date - days[0]).days)
+        last = len(days) if end_date is None else max(0, (end_date - days[0]).days + 1)
+        rows = np.flatnonzero(keep)
+        return self.counts(year)[rows, first:last], [labels[i] for i in rows], days[first:last]
+
+    def time_of_day(
+        self,
+        years: Optional[Iterable[int]] = None,
+        pnums: Optional[Iterable[str]] = None,
+        locations: Optional[Iterable[str]] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+    ) -> np.ndarray:
+        """
+        Returns the number of detections in each time-of-day bin (see bins),
+        summed over the selected years, pnums and dates (see select).
+        """
+        total = np.zeros(self.n_bins, dtype=np.int64)
+        for year in self.years if years is None else years:
+            counts, _, _ = self.select(year, pnums, locations, start_date, end_date)
+            total += counts.sum(axis=(0, 1), dtype=np.int64)
+        return total
+
+    def update(self, tables: DerivedTables) -> dict[str, int]:
+        """
+        Recounts the pnums whose detections in ``tables`` changed since the
+        last update, and clears those no longer in them.
+
+        Returns:
+            dict[str, int]: Number of pnums recounted and removed, and of
+            arrays rewritten.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        if not self.axes["years"]:  # nothing built yet, or built with other bins
+            for path in self.root.glob("*.npy"):
+                path.unlink()
+        files = tables.files()
+        sources = {pnum: [path.stat().st_size, path.stat().st_mtime_ns] for pnum, path in files.items()}
+        folded = self.axes["sources"]
+        changed = sorted(pnum for pnum, source in sources.items() if folded.get(pnum) != source)
+        removed = sorted(pnum for pnum in folded if pnum not in sources)
+
+        counts = bin_counts(tables.detections(changed), self.bin_minutes) if changed else None
+        by_year = {}
+        if counts is not None:
+            counts = counts.with_columns(pl.col("date").min().over("pnum").dt.year().alias("year"))
+            by_year = {year: rows for (year,), rows in counts.partition_by("year", as_dict=True).items()}
+        for year in {int(y) for y in self.axes["years"]} - set(by_year):
+            by_year[year] = None
+
+        rewritten = 0
+        for year, rows in sorted(by_year.items()):
+            rewritten += self._update_year(year, rows, removed)
+
+        self.axes["sources"] = sources
+        tmp = self._axes_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.axes))
+        tmp.replace(self._axes_path)
+        return {"pnums": len(changed), "removed": len(removed), "rewritten": rewritten}
+
+    def _update_year(self, year: int, rows: Optional[pl.DataFrame], removed: list[str]) -> bool:
+        """
+        Writes the recounted ``rows`` of one year into its array, growing its
+        axes if needed. Returns whether the array was rewritten.
+        """
+        labels = self.axes["years"].get(str(year))
+        old_pnums = labels["pnums"] if labels else []
+        old_start = date.fromisoformat(labels["start"]) if labels else None
+        old_days = labels["days"] if labels else 0
+        pnums, start, days = old_pnums, old_start, old_days
+        if rows is not None:
+            pnums = sorted(set(old_pnums) | set(rows["pnum"].unique().to_list()))
+            start = min([rows["date"].min()] + ([old_start] if labels else []))
+            end = max([rows["date"].max()] + ([old_start + timedelta(days=old_days - 1)] if labels else []))
+            days = (end - start).days + 1
+
+        path = self._path(year)
+        grown = (pnums, start, days) != (old_pnums, old_start, old_days)
+        if grown:
+            tmp = path.with_name(f"{year}.tmp.npy")
+            array = _open(tmp, "w+", (len(pnums), days, self.n_bins))
+            if labels:
+                offset = (old_start - start).days
+                array[np.searchsorted(pnums, old_pnums), offset : offset + old_days] = _open(path, "r")
+        else:
+            array = _open(path, "r+")
+        index = {pnum: i for i, pnum in enumerate(pnums)}
+        for pnum in removed:
+            if pnum in index:
+                array[index[pnum]] = 0
+        if rows is not None:
+            pnum_index = np.array([index[pnum] for pnum in rows["pnum"].to_list()])
+            day_index = (rows["date"].to_numpy() - np.datetime64(start, "D")).astype(np.int64)
+            array[np.unique(pnum_index)] = 0
+            array[pnum_index, day_index, rows["bin"].to_numpy()] = rows["count"].to_numpy()
+        array.flush()
+        del array
+        if grown:
+            tmp.replace(path)
+        self.axes["years"][str(year)] = {"pnums": pnums, "start": start.isoformat(), "days": days}
+        return grown
@@ -0,0 +1,265 @@
+"""
+Daily song counts per breeding attempt and their timing relative to laying.
+
+Every function is a single vectorised pass over polars frames: per-pnum
+statistics are window expressions or group aggregations, never per-group
+Python callbacks. DerivedTables keeps their results up to date as new
+detections arrive, recomputing only the pnums that received new data.
+"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, Optional
+
+import polars as pl
+import pyarrow.dataset as ds
+
+from majorvocal.detections import PARTITIONING, SCHEMA
+from majorvocal.utils import PMAJOR_SCHEMA, select_species
+
+# Only these columns of the detections are needed
+DETECTION_COLUMNS = ["timestamp", "pnum", "confidence"]
+
+
+def daily_counts(detections: pl.DataFrame, brood_data: pl.DataFrame) -> pl.DataFrame:
+    """
+    Counts detections per pnum and day, and adds the brood data, the number
+    of days from the lay date and the first and last recorded day of each
+    pnum.
+
+    Args:
+        detections (pl.DataFrame): Output of majorvocal.utils.extract_parus_major
+            or load_parus_major. Rows with a null confidence (recordings
+            without detections) count as zero, so days without detections
+            are kept.
+        brood_data (pl.DataFrame): One row per pnum, with a lay_date column
+            (a date, or a string in ISO format). Pnums missing from it are
+            dropped.
+
+    Returns:
+        pl.DataFrame: Columns pnum, date and count, then the brood data,
+        then days_from_lay, date_first and date_last; sorted by pnum and date.
+    """
+    counts = (
+        detections.lazy()
+        .select(DETECTION_COLUMNS)
+        .group_by(pl.col("pnum"), pl.col("timestamp").str.slice(0, 8).str.to_date("%Y%m%d").alias("date"))
+        .agg(pl.col("confidence").is_not_null().sum().cast(pl.Int64).alias("count"))
+    )
+    lay_date = pl.col("lay_date")
+    if brood_data.schema["lay_date"] == pl.String:
+        lay_date = lay_date.str.to_date()
+    brood = brood_data.lazy().with_columns(lay_date.cast(pl.Date).alias("lay_date"))
+    return (
+        counts.join(brood, on="pnum", how="inner")
+        .with_columns(
+            (pl.col("date") - pl.col("lay_date")).dt.total_days().alias("days_from_lay"),
+            pl.col("date").min().over("pnum").alias("date_first"),
+            pl.col("date").max().over("pnum").alias("date_last"),
+        )
+        .sort("pnum", "date")
+        .collect()
+    )
+
+
+def date_bounds(daily: pl.DataFrame) -> pl.DataFrame:
+    """
+    Returns the first and last day, and their distance from the lay date, of
+    each pnum in the output of daily_counts.
+    """
+    return (
+        daily.group_by("pnum")
+        .agg(
+            pl.col("date").min().alias("date_first"),
+            pl.col("date").max().alias("date_last"),
+            pl.col("days_from_lay").min().alias("first_from_lay"),
+            pl.col("days_from_lay").max().alias("last_from_lay"),
+        )
+        .sort("pnum")
+    )
+
+
+def peak_days(daily: pl.DataFrame) -> pl.DataFrame:
+    """
+    Returns, for each pnum, the row of daily_counts with the most detections
+    (the earliest such day in case of ties).
+    """
+    return (
+        daily.sort("pnum", "date")
+        .group_by("pnum", maintain_order=True)
+        .agg(pl.all().get(pl.col("count").arg_max()))
+        .select(daily.columns)
+    )
+
+
+def subset_pnums(
+    daily: pl.DataFrame,
+    first: tuple[int, int] = (-10, -3),
+    last: tuple[int, int] = (1, 10),
+) -> pl.DataFrame:
+    """
+    Keeps the pnums recorded from shortly before to shortly after laying:
+    their first day is ``first[0]`` to ``first[1]`` days from the lay date,
+    and their last day ``last[0]`` to ``last[1]`` days from it (inclusive).
+
+    Args:
+        daily (pl.DataFrame): Output of daily_counts.
+        first (tuple[int, int]): Range of the first day, in days from lay.
+        last (tuple[int, int]): Range of the last day, in days from lay.
+
+    Returns:
+        pl.DataFrame: The rows of ``daily`` of the selected pnums.
+    """
+    first_day = pl.col("days_from_lay").min().over("pnum")
+    last_day = pl.col("days_from_lay").max().over("pnum")
+    return daily.filter(first_day.is_between(*first) & last_day.is_between(*last))
+
+
+def scaled_counts(daily: pl.DataFrame) -> pl.DataFrame:
+    """
+    Adds ``scaled_count``, the daily count divided by the maximum of its pnum.
+    """
+    return daily.with_columns((pl.col("count") / pl.col("count").max().over("pnum")).alias("scaled_count"))
+
+
+def _write_parquet(df: pl.DataFrame, path: Path) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    df.write_parquet(tmp)
+    tmp.replace(path)
+
+
+class DerivedTables:
+    """
+    Derived tables of one species, updated incrementally from the detections
+    dataset (see majorvocal.detections).
+
+    The tables live in ``root``: ``detections/pnum=<pnum>.parquet`` holds
+    the detections of each pnum as returned by load_parus_major,
+    ``daily_counts.parquet`` the output of daily_counts and
+    ``peak_days.parquet`` that of peak_days. ``watermark.json`` lists the
+    dataset files already folded in. Files in the detections dataset are
+    never rewritten once written, so an update only reads the new ones and
+    recomputes the pnums they contain. The tables are rebuilt from scratch
+    if a folded file has disappeared (e.g. the dataset was regenerated) or
+    the species changes. Changed brood data triggers a recomputation of the
+    daily counts of every pnum, without reading the dataset again.
+
+    Args:
+        root (Path): Directory of the derived tables; created if needed.
+        species (str): Scientific name of the species counted.
+    """
+
+    def __init__(self, root: Path, species: str = "Parus major"):
+        self.root = Path(root)
+        self.species = species
+        self._detections_dir = self.root / "detections"
+        self._daily_path = self.root / "daily_counts.parquet"
+        self._peaks_path = self.root / "peak_days.parquet"
+        self._watermark_path = self.root / "watermark.json"
+        self.daily = pl.read_parquet(self._daily_path) if self._daily_path.exists() else None
+        self.peaks = pl.read_parquet(self._peaks_path) if self._peaks_path.exists() else None
+
+    def _pnum_path(self, pnum: str) -> Path:
+        return self._detections_dir / f"pnum={pnum}.parquet"
+
+    def _watermark(self) -> dict:
+        if not self._watermark_path.exists():
+            return {}
+        return json.loads(self._watermark_path.read_text())
+
+    def files(self) -> dict[str, Path]:
+        """
+        Returns the detections file of each stored pnum.
+        """
+        return {path.stem.split("=", 1)[1]: path for path in sorted(self._detections_dir.glob("pnum=*.parquet"))}
+
+    def detections(self, pnums: Optional[Iterable[str]] = None) -> pl.DataFrame:
+        """
+        Returns the stored detections, of all pnums or only of ``pnums``.
+        """
+        if pnums is None:
+            paths = list(self.files().values())
+        else:
+            paths = [self._pnum_path(pnum) for pnum in sorted(pnums)]
+        frames = [pl.read_parquet(path) for path in paths if path.exists()]
+        if not frames:
+            return pl.DataFrame(schema=PMAJOR_SCHEMA)
+        return pl.concat(frames)
+
+    def update(self, detections_root: Path, brood_data: pl.DataFrame) -> dict[str, int]:
+        """
+        Folds the files added to the detections dataset since the last update
+        into the derived tables.
+
+        Args:
+            detections_root (Path): Root of the detections dataset.
+            brood_data (pl.DataFrame): Brood data, as taken by daily_counts.
+
+        Returns:
+            dict[str, int]: Number of dataset files read and of pnums
+            recomputed.
+        """
+        detections_root = Path(detections_root)
+        dataset = ds.dataset(detections_root, format="parquet", partitioning=PARTITIONING, schema=SCHEMA)
+        files = {os.path.relpath(f, detections_root): os.path.getsize(f) for f in dataset.files}
+        watermark = self._watermark()
+        folded = watermark.get("files", {})
+        if watermark.get("species") != self.species or any(f not in files for f in folded):
+            shutil.rmtree(self._detections_dir, ignore_errors=True)
+            folded, self.daily, self.peaks = {}, None, None
+        self._detections_dir.mkdir(parents=True, exist_ok=True)
+
+        new = sorted(f for f in files if f not in folded)
+        affected = set()
+        if new:
+            # A recording can arrive in several new files (e.g. a dataset
+            # converted from JSON, then synced from the manifest): only the
+            # rows of the most recently written one are kept.
+            new_files = ds.dataset(
+                [str(detections_root / f) for f in new],
+                format="parquet",
+                partitioning=PARTITIONING,
+                partition_base_dir=str(detections_root),
+                schema=SCHEMA,
+            )
+            columns = ["timestamp", "pnum", "scientific_name", "start_time", "end_time", "confidence"]
+            fragments = sorted(new_files.get_fragments(), key=lambda f: (os.path.getmtime(f.path), f.path))
+            table = pl.concat(
+                [
+                    pl.from_arrow(fragment.to_table(schema=new_files.schema, columns=columns)).with_columns(
+                        _file=pl.lit(i)
+                    )
+                    for i, fragment in enumerate(fragments)
+                ],
+                how="vertical_relaxed",
+            )
+            latest = pl.col("_file") == pl.col("_file").max().over("pnum", "timestamp")
+            fresh = select_species(table.filter(latest).drop("_file"), self.species)
+            for (pnum,), rows in fresh.partition_by("pnum", as_dict=True).items():
+                path = self._pnum_path(pnum)
+                if path.exists():  # recordings seen again replace their old rows
+                    old = pl.read_parquet(path).join(rows.select("timestamp").unique(), on="timestamp", how="anti")
+                    rows = pl.concat([old, rows]).sort("pnum", "timestamp", "start_time", nulls_last=True)
+                _write_parquet(rows, path)
+                affected.add(pnum)
+
+        brood_key = hashlib.sha1(brood_data.write_csv().encode(), usedforsecurity=False).hexdigest()
+        if brood_key != watermark.get("brood") or self.daily is None:
+            affected = set(self.files())
+        if affected:
+            daily = daily_counts(self.detections(affected), brood_data)
+            peaks = peak_days(daily)
+            if self.daily is not None:
+                unaffected = ~pl.col("pnum").is_in(list(affected))
+                daily = pl.concat([self.daily.filter(unaffected), daily], how="vertical_relaxed").sort("pnum", "date")
+                peaks = pl.concat([self.peaks.filter(unaffected), peaks], how="vertical_relaxed").sort("pnum")
+            self.daily, self.peaks = daily, peaks
+            _write_parquet(self.daily, self._daily_path)
+            _write_parquet(self.peaks, self._peaks_path)
+
+        tmp = self._watermark_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"species": self.species, "brood": brood_key, "files": files}))
+        tmp.replace(self._watermark_path)
+        return {"files": len(new), "pnums": len(affected)}
@@ -0,0 +1,288 @@
+"""
+Packed archive of per-recording detections.
+
+Earlier runs wrote the detections of each recording to a small JSON file of
+its own in derived/json. A season is hundreds of thousands of them, which
+makes directory listings, ``exists()`` checks and backups slow. The archive
+keeps the same records in a few large append-only segment files instead:
+
+- ``<segment>.seg`` holds the records one after the other, each a 4-byte
+  length followed by ``[timestamp, pnum, detections]`` as JSON;
+- ``<segment>.idx`` has one line per record with its pnum, timestamp, offset
+  and length, appended once the record itself is written.
+
+Each writing process appends to a segment of its own, so workers never
+contend, and starts a new one once it reaches ``segment_bytes``; a writer
+that was closed appends to the same segment again. The segment names sort
+by creation time. DetectionArchive merges the segment
+indexes into one index sorted by (pnum, timestamp), in which the latest record
+of a recording wins. Looking a recording up is then a binary search and a
+single read, and a bulk scan reads each segment front to back. A record
+whose index line was never written (e.g. the process was killed) is ignored.
+
+pack_json_dir converts a directory of per-recording JSON files in place, and
+majorvocal.inference appends to the archive once a directory is converted.
+"""
+import io
+import json
+import os
+import struct
+import time
+import uuid
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+import polars as pl
+
+# Present in a directory converted to an archive
+MARKER = "_archive"
+SEGMENT_BYTES = 256 * 2**20
+
+_LENGTH = struct.Struct("<I")
+_INDEX_SCHEMA = {"pnum": pl.String, "timestamp": pl.String, "offset": pl.Int64, "length": pl.Int64}
+
+
+def is_archive(root: Path) -> bool:
+    """
+    Whether ``root`` holds an archive; a single stat, however many loose
+    JSON files the directory still has.
+    """
+    return Path(root, MARKER).exists()
+
+
+class ArchiveWriter:
+    """
+    Appends ``[timestamp, pnum, detections]`` records to a new segment of
+    the archive at ``root``. Records become visible to readers when the
+    writer is flushed or closed. Use as a context manager, or call close();
+    adding to a closed writer reopens its segment.
+
+    Args:
+        root (Path): Archive directory; created if needed.
+        segment_bytes (int): Size after which a new segment is started.
+    """
+
+    def __init__(self, root: Path, segment_bytes: int = SEGMENT_BYTES):
+        self.root = Path(root)
+        self.segment_bytes = segment_bytes
+        self._data = self._index = self._name = None
+        self._lines = []
+
+    def _open(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        Path(self.root, MARKER).touch()
+        if self._name is None:
+            self._name = f"{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._data = open(self.root / f"{self._name}.seg", "ab")
+        self._data.seek(0, os.SEEK_END)
+        self._index = open(self.root / f"{self._name}.idx", "a", encoding="utf-8")
+
+    def add(self, record: list) -> None:
+        """
+        Appends the detections of one recording.
+        """
+        timestamp, pnum, detections = record
+        if self._data is None:
+            self._open()
+        payload = json.dumps([timestamp, pnum, detections], separators=(",", ":")).encode()
+        offset = self._data.tell() + _LENGTH.size
+        self._data.write(_LENGTH.pack(len(payload)))
+        self._data.write(payload)
+        self._lines.append(f"{pnum}\t{timestamp}\t{offset}\t{len(payload)}\n")
+        if offset + len(payload) >= self.segment_bytes:
+            self.close()
+            self._name = None
+
+    def flush(self) -> None:
+        """
+        Writes the buffered records, then the index lines that point to them.
+        """
+        if self._data is None:
+            return
+        self._data.flush()
+        self._index.write("".join(self._lines))
+        self._index.flush()
+        self._lines = []
+
+    def close(self) -> None:
+        self.flush()
+        if self._data is not None:
+            self._data.close()
+            self._index.close()
+        self._data = self._index = None
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class DetectionArchive:
+    """
+    Read access to the archive at ``root``, as it was when opened or last
+    refreshed.
+
+    Args:
+        root (Path): Archive directory. A directory without segments is an
+            empty archive.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._consumed = {}  # bytes of each segment index read so far
+        self._index = pl.DataFrame(schema={**_INDEX_SCHEMA, "segment": pl.String, "key": pl.String})
+        self._set_index(self._index)
+        self.refresh()
+
+    def refresh(self) -> int:
+        """
+        Reads the index lines appended since the archive was opened or last
+        refreshed, e.g. by other processes; only a few stats if there are
+        none.
+
+        Returns:
+            int: Number of index lines read.
+        """
+        frames = []
+        for path in sorted(self.root.glob("*.idx")):
+            start = self._consumed.get(path.stem, 0)
+            if path.stat().st_size <= start:
+                continue
+            with open(path, "rb") as f:
+                f.seek(start)
+                lines = f.read()
+            lines = lines[: lines.rfind(b"\n") + 1]  # a line cut short by a crash, or still being written
+            if lines:
+                frame = pl.read_csv(
+                    io.BytesIO(lines), separator="\t", has_header=False, schema=_INDEX_SCHEMA, quote_char=None
+                )
+                frames.append(frame.with_columns(segment=pl.lit(path.stem)))
+                self._consumed[path.stem] = start + len(lines)
+        if not frames:
+            return 0
+        new = pl.concat(frames).with_columns(key=pl.concat_str("pnum", "timestamp", separator="\0"))
+        self._set_index(
+            pl.concat([self._index, new])
+            .sort("key", "segment", "offset")
+            .unique("key", keep="last", maintain_order=True)
+        )
+        return new.height
+
+    def _set_index(self, index: pl.DataFrame) -> None:
+        self._index = index
+        self._keys = index["key"].to_numpy().astype(str)
+        self._segments, self._segment_of = np.unique(index["segment"].to_numpy().astype(str), return_inverse=True)
+        self._offsets = index["offset"].to_numpy()
+        self._lengths = index["length"].to_numpy()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _find(self, pnum: str, timestamp: str) -> Optional[int]:
+        key = f"{pnum}\0{timestamp}"
+        i = int(np.searchsorted(self._keys, key))
+        return i if i < len(self._keys) and self._keys[i] == key else None
+
+    def __contains__(self, key: tuple[str, str]) -> bool:
+        return self._find(*key) is not None
+
+    def keys(self) -> list[tuple[str, str]]:
+        """
+        Returns ``(pnum, timestamp)`` of every recording, in sorted order.
+        """
+        return [tuple(key.split("\0", 1)) for key in self._keys]
+
+    def _segment_path(self, i: int) -> Path:
+        return self.root / f"{self._segments[self._segment_of[i]]}.seg"
+
+    def _read(self, f, i: int) -> list:
+        f.seek(self._offsets[i])
+        return json.loads(f.read(self._lengths[i]))
+
+    def get(self, pnum: str, timestamp: str) -> Optional[list[dict]]:
+        """
+        Returns the detections of one recording, or None if it is not in the
+        archive.
+        """
+        i = self._find(pnum, timestamp)
+        if i is None:
+            return None
+        with open(self._segment_path(i), "rb") as f:
+            return self._read(f, i)[2]
+
+    def iter_records(self, skip: Optional[set[tuple[str, str]]] = None) -> Iterator[list]:
+        """
+        Yields ``[timestamp, pnum, detections]`` for every recording, reading
+        each segment front to back.
+
+        Args:
+            skip (set[tuple[str, str]], optional): ``(pnum, timestamp)`` of
+                recordings not to read.
+        """
+        f, segment = None, None
+        try:
+            for i in np.lexsort((self._offsets, self._segment_of)):
+                if skip and tuple(self._keys[i].split("\0", 1)) in skip:
+                    continue
+                if self._segment_of[i] != segment:
+                    if f is not None:
+                        f.close()
+                    segment = self._segment_of[i]
+                    f = open(self._segment_path(i), "rb")
+                yield self._read(f, i)
+        finally:
+            if f is not None:
+                f.close()
+
+
+def iter_json_records(json_dir: Path, skip: Optional[set[tuple[str, str]]] = None) -> Iterator[list]:
+    """
+    Yields ``[timestamp, pnum, detections]`` for the recordings in a
+    directory of per-recording ``<pnum>_<timestamp>.json`` files, packed or
+    not; a packed recording wins over a loose file of the same recording.
+
+    Args:
+        json_dir (Path): The directory.
+        skip (set[tuple[str, str]], optional): ``(pnum, timestamp)`` of
+            recordings not to read.
+    """
+    skip = set(skip or ())
+    if is_archive(json_dir):
+        archive = DetectionArchive(json_dir)
+        yield from archive.iter_records(skip)
+        skip.update(archive.keys())
+    for json_file in sorted(Path(json_dir).glob("*.json")):
+        pnum, timestamp = json_file.stem.split("_", 1)
+        if (pnum, timestamp) in skip:
+            continue
+        with open(json_file) as f:
+            yield [timestamp, pnum, json.load(f)]
+
+
+def pack_json_dir(json_dir: Path, segment_bytes: int = SEGMENT_BYTES, remove: bool = True) -> int:
+    """
+    Packs the per-recording JSON files of ``json_dir`` into an archive in the
+    same directory. The files are only removed once the archive is written,
+    so an interrupted conversion can be run again.
+
+    Args:
+        json_dir (Path): Directory of ``<pnum>_<timestamp>.json`` files.
+        segment_bytes (int): Size after which a new segment is started.
+        remove (bool): Delete the JSON files once packed.
+
+    Returns:
+        int: Number of recordings packed.
+    """
+    json_files = sorted(Path(json_dir).glob("*.json"))
+    with ArchiveWriter(json_dir, segment_bytes) as writer:
+        Path(json_dir, MARKER).touch()
+        for json_file in json_files:
+            pnum, timestamp = json_file.stem.split("_", 1)
+            with open(json_file) as f:
+                writer.add([timestamp, pnum, json.load(f)])
+    if remove:
+        for json_file in json_files:
+            json_file.unlink()
+    return len(json_files)
@@ -0,0 +1,101 @@
+"""
+Audio decoding and chunking, matching what birdnetlib's ``Recording`` feeds to
+the BirdNET model: 48 kHz mono float32 signals split into 3-second chunks.
+"""
+import io
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+
+import numpy as np
+
+from majorvocal.metrics import Stopwatch
+
+SAMPLE_RATE = 48000
+CHUNK_SECONDS = 3.0
+MIN_CHUNK_SECONDS = 1.5
+CHUNK_SAMPLES = int(SAMPLE_RATE * CHUNK_SECONDS)
+
+
+def load_audio(
+    file_path: Union[Path, BinaryIO], sr: int = SAMPLE_RATE, stopwatch: Optional[Stopwatch] = None
+) -> np.ndarray:
+    """
+    Decodes a recording to a mono signal resampled to ``sr``. The two steps
+    are those of ``librosa.load``, run separately so they can be timed.
+
+    Args:
+        file_path (Path | BinaryIO): Path to the audio file, or an open
+            file-like object.
+        sr (int): Target sample rate.
+        stopwatch (Stopwatch, optional): Receives the "decode" and
+            "resample" times.
+
+    Returns:
+        np.ndarray: The float32 signal.
+    """
+    import librosa
+
+    stopwatch = stopwatch or Stopwatch()
+    if isinstance(file_path, Path):
+        file_path = str(file_path)
+    with stopwatch("decode"):
+        signal, native_sr = librosa.load(file_path, sr=None, mono=True)
+    with stopwatch("resample"):
+        return librosa.resample(signal, orig_sr=native_sr, target_sr=sr, res_type="kaiser_fast")
+
+
+def split_chunks(signal: np.ndarray, sr: int = SAMPLE_RATE, overlap: float = 0.0) -> np.ndarray:
+    """
+    Splits a signal into fixed-length chunks the way birdnetlib does: a
+    trailing chunk shorter than 1.5 s is dropped and a longer one is
+    zero-padded to the full 3 s.
+
+    Args:
+        signal (np.ndarray): Mono signal.
+        sr (int): Sample rate of the signal.
+        overlap (float): Overlap between consecutive chunks, in seconds.
+
+    Returns:
+        np.ndarray: Array of shape (n_chunks, sr * 3).
+    """
+    chunk_len = int(sr * CHUNK_SECONDS)
+    step = int((CHUNK_SECONDS - overlap) * sr)
+    min_len = int(MIN_CHUNK_SECONDS * sr)
+    starts = np.arange(0, len(signal), step)
+    starts = starts[len(signal) - starts >= min_len]
+
+    chunks = np.zeros((len(starts), chunk_len), dtype=np.float32)
+    for i, start in enumerate(starts):
+        split = signal[start : start + chunk_len]
+        chunks[i, : len(split)] = split
+    return chunks
+
+
+def load_chunks(file_path: Path, overlap: float = 0.0, stopwatch: Optional[Stopwatch] = None) -> np.ndarray:
+    """
+    Decodes a recording and splits it into model-sized chunks.
+
+    Args:
+        file_path (Path): Path to the audio file.
+        overlap (float): Overlap between consecutive chunks, in seconds.
+        stopwatch (Stopwatch, optional): Receives the decoding times.
+
+    Returns:
+        np.ndarray: Array of shape (n_chunks, 144000).
+    """
+    return split_chunks(load_audio(file_path, stopwatch=stopwatch), overlap=overlap)
+
+
+def decode_chunks(data: bytes, overlap: float = 0.0) -> np.ndarray:
+    """
+    Decodes the raw bytes of a recording that has already been read from disk
+    and splits it into model-sized chunks.
+
+    Args:
+        data (bytes): Contents of the audio file.
+        overlap (float): Overlap between consecutive chunks, in seconds.
+
+    Returns:
+        np.ndarray: Array of shape (n_chunks, 144000).
+    """
+    return split_chunks(load_audio(io.BytesIO(data)), overlap=overlap)
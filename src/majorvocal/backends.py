@@ -0,0 +1,287 @@
+"""
+Interchangeable implementations of the BirdNET classifier.
+
+``birdnetlib`` is birdnetlib's own analyzer, the reference. ``tflite`` runs a
+BirdNET ``.tflite`` model (the float32 model shipped with birdnetlib by
+default, or a float16 or int8 one made with ``quantize``) through the TFLite
+interpreter, with the XNNPACK CPU delegate and a configurable number of
+threads. ``tf`` runs the TensorFlow SavedModel of BirdNET-Analyzer. All three
+keep birdnetlib's labels and location filter, and return the same sigmoid
+scores, so the rest of the pipeline does not depend on which one is used.
+
+``evaluate`` measures the throughput of each backend on a fixed sample of
+recordings, and how closely its detections agree with the reference, so the
+cheapest backend that is accurate enough can be picked for a run.
+"""
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from majorvocal.audio import CHUNK_SAMPLES, CHUNK_SECONDS
+from majorvocal.inference import MODEL_VERSION, load_analyzer, predict_files
+
+BACKENDS = ("birdnetlib", "tflite", "tf")
+PRECISIONS = ("float16", "int8")
+
+
+def flat_sigmoid(x: np.ndarray, sensitivity: float = 1.0) -> np.ndarray:
+    """
+    BirdNET's score function, as in birdnetlib.
+    """
+    return 1 / (1.0 + np.exp(-sensitivity * np.clip(x, -15, 15)))
+
+
+def _quantize(x: np.ndarray, details: dict) -> np.ndarray:
+    if np.issubdtype(details["dtype"], np.floating):
+        return x.astype(details["dtype"], copy=False)
+    scale, zero_point = details["quantization"]
+    limits = np.iinfo(details["dtype"])
+    return np.clip(np.round(x / scale + zero_point), limits.min, limits.max).astype(details["dtype"])
+
+
+def _dequantize(x: np.ndarray, details: dict) -> np.ndarray:
+    if np.issubdtype(details["dtype"], np.floating):
+        return x.astype(np.float32, copy=False)
+    scale, zero_point = details["quantization"]
+    return (x.astype(np.float32) - zero_point) * scale
+
+
+class _Backend:
+    """
+    Shares birdnetlib's labels and species list model, which are small and
+    the same for every backend.
+    """
+
+    def __init__(self, version: str):
+        from birdnetlib.analyzer import Analyzer
+
+        self._analyzer = Analyzer(version=version)
+        self.labels = self._analyzer.labels
+
+    def return_predicted_species_list(self, **kwargs) -> list[str]:
+        return self._analyzer.return_predicted_species_list(**kwargs)
+
+
+class TFLiteBackend(_Backend):
+    """
+    BirdNET through the TFLite interpreter.
+
+    Args:
+        model_path (Path, optional): ``.tflite`` model; birdnetlib's float32
+            model by default. Quantized inputs and outputs are converted.
+        n_threads (int): Interpreter threads.
+        xnnpack (bool): Use the XNNPACK delegate (TFLite's default for float
+            models); False runs the reference kernels.
+        version (str): birdnetlib model version, for the labels.
+    """
+
+    def __init__(
+        self, model_path: Optional[Path] = None, n_threads: int = 1, xnnpack: bool = True, version: str = MODEL_VERSION
+    ):
+        from birdnetlib.analyzer import tflite
+
+        super().__init__(version)
+        self.model_path = Path(model_path or self._analyzer.model_path)
+        kwargs = {}
+        if not xnnpack:
+            resolver = getattr(tflite, "OpResolverType", None) or tflite.experimental.OpResolverType
+            kwargs["experimental_op_resolver_type"] = resolver.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        self.interpreter = tflite.Interpreter(model_path=str(self.model_path), num_threads=n_threads, **kwargs)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._shape = None
+
+    def predict_batch(self, batch: np.ndarray) -> np.ndarray:
+        # Tensors are only reallocated when the batch shape changes
+        if batch.shape != self._shape:
+            self.interpreter.resize_tensor_input(self._input["index"], list(batch.shape))
+            self.interpreter.allocate_tensors()
+            self._shape = batch.shape
+        self.interpreter.set_tensor(self._input["index"], _quantize(batch, self._input))
+        self.interpreter.invoke()
+        return flat_sigmoid(_dequantize(self.interpreter.get_tensor(self._output["index"]), self._output))
+
+
+class TFBackend(_Backend):
+    """
+    BirdNET through TensorFlow, from BirdNET-Analyzer's SavedModel.
+
+    Args:
+        model_path (Path): SavedModel directory.
+        n_threads (int): Intra-op threads.
+        version (str): birdnetlib model version, for the labels.
+    """
+
+    def __init__(self, model_path: Path, n_threads: int = 1, version: str = MODEL_VERSION):
+        import tensorflow as tf
+
+        super().__init__(version)
+        tf.config.threading.set_intra_op_parallelism_threads(n_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+        self.model = tf.saved_model.load(str(model_path))
+
+    def predict_batch(self, batch: np.ndarray) -> np.ndarray:
+        return flat_sigmoid(np.asarray(self.model.basic(batch)["scores"]))
+
+
+def load_backend(
+    backend: str = "birdnetlib",
+    version: str = MODEL_VERSION,
+    n_threads: int = 1,
+    model_path: Optional[Path] = None,
+    xnnpack: bool = True,
+):
+    """
+    Loads a backend. Use with functools.partial as the ``analyzer_factory``
+    of majorvocal.inference, e.g.
+    ``partial(load_backend, "tflite", model_path=...)``.
+
+    Args:
+        backend (str): One of BACKENDS.
+        version (str): birdnetlib model version.
+        n_threads (int): Threads used by the model.
+        model_path (Path, optional): Model file (tflite) or directory (tf).
+        xnnpack (bool): See TFLiteBackend.
+
+    Returns:
+        An analyzer for majorvocal.inference.
+
+    Raises:
+        ValueError: If ``backend`` is unknown, or the tf backend is not given
+            a model.
+    """
+    if backend == "birdnetlib":
+        return load_analyzer(version=version, n_threads=n_threads)
+    if backend == "tflite":
+        return TFLiteBackend(model_path, n_threads, xnnpack, version)
+    if backend == "tf":
+        if model_path is None:
+            raise ValueError("The tf backend needs the path of BirdNET's SavedModel")
+        return TFBackend(model_path, n_threads, version)
+    raise ValueError(f"Unknown backend {backend!r}; expected one of {BACKENDS}")
+
+
+def quantize(
+    saved_model: Path, out_path: Path, precision: str, representative: Optional[Iterable[np.ndarray]] = None
+) -> Path:
+    """
+    Converts BirdNET's SavedModel to a smaller TFLite model for the tflite
+    backend.
+
+    Args:
+        saved_model (Path): SavedModel directory.
+        out_path (Path): Output ``.tflite`` file.
+        precision (str): "float16" (weights in float16) or "int8" (int8
+            weights and, given ``representative`` chunks, int8 activations
+            with float inputs and outputs).
+        representative (Iterable[np.ndarray], optional): Chunks of real
+            recordings used to calibrate int8 activations; a few hundred are
+            enough.
+
+    Returns:
+        Path: ``out_path``.
+
+    Raises:
+        ValueError: If ``precision`` is unknown.
+    """
+    import tensorflow as tf
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; expected one of {PRECISIONS}")
+    converter = tf.lite.TFLiteConverter.from_saved_model(str(saved_model))
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if precision == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif representative is not None:
+        chunks = [np.asarray(c, dtype=np.float32).reshape(1, CHUNK_SAMPLES) for c in representative]
+        converter.representative_dataset = lambda: ([c] for c in chunks)
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_suffix(".tmp")
+    tmp.write_bytes(converter.convert())
+    tmp.replace(out_path)
+    return out_path
+
+
+# ──── EVALUATION ─────────────────────────────────────────────────────────────
+
+
+def agreement(reference: dict, detections: dict) -> dict:
+    """
+    Detection-level agreement with the reference: a detection matches if the
+    reference has the same label in the same chunk of the same recording.
+
+    Args:
+        reference (dict): Reference detections, by file.
+        detections (dict): Detections of the backend, by file.
+
+    Returns:
+        dict: ``precision`` (matched / detections), ``recall`` (matched /
+        reference detections) and the number of detections.
+    """
+
+    def keys(by_file: dict) -> set:
+        return {(str(f), d["start_time"], d["label"]) for f, ds in by_file.items() for d in ds}
+
+    expected, found = keys(reference), keys(detections)
+    matched = len(expected & found)
+    return {
+        "detections": len(found),
+        "precision": matched / len(found) if found else 1.0,
+        "recall": matched / len(expected) if expected else 1.0,
+    }
+
+
+def evaluate(
+    factories: dict[str, Callable],
+    items: list[tuple],
+    reference: str = "birdnetlib",
+    min_conf: float = 0.8,
+    batch_size: int = 64,
+) -> dict[str, dict]:
+    """
+    Times each backend on the same recordings and compares its detections
+    with those of the reference backend.
+
+    Args:
+        factories (dict[str, Callable]): Functions that load each backend, by
+            name; must include ``reference``.
+        items (list[tuple]): ``(file_path, chunks)`` pairs, decoded once and
+            shared by every backend.
+        reference (str): Name of the reference backend.
+        min_conf (float): Minimum confidence for a detection to be kept.
+        batch_size (int): Number of chunks per model call.
+
+    Returns:
+        dict[str, dict]: For each backend, the seconds spent, chunks per
+        second, audio seconds per second, speedup over the reference, and
+        agreement with it (see agreement).
+
+    Raises:
+        ValueError: If ``reference`` is not one of the backends.
+    """
+    if reference not in factories:
+        raise ValueError(f"The reference backend {reference!r} is not evaluated")
+    n_chunks = sum(len(chunks) for _, chunks in items)
+    runs = {}
+    for name, factory in factories.items():
+        analyzer = factory()
+        # Untimed warm-up, so the first call's tensor allocation is not counted
+        list(predict_files(analyzer, [(Path("warmup", "20200101_000000"), np.zeros((1, CHUNK_SAMPLES)))], batch_size))
+        start = time.perf_counter()
+        detections = dict(predict_files(analyzer, items, batch_size, min_conf))
+        runs[name] = (time.perf_counter() - start, detections)
+
+    results = {}
+    for name, (seconds, detections) in runs.items():
+        results[name] = {
+            "seconds": seconds,
+            "chunks_per_second": n_chunks / seconds,
+            "realtime_factor": n_chunks * CHUNK_SECONDS / seconds,
+            "speedup": runs[reference][0] / seconds,
+            **agreement(runs[reference][1], detections),
+        }
+    return results
@@ -0,0 +1,422 @@
+"""
+Throughput benchmarks of the pipeline on synthetic data.
+
+The benchmark writes synthetic WAV recordings in the layout of the data drive
+and a synthetic combined detections file, then times each stage of the
+pipeline on them:
+
+    discovery    indexing the recordings (majorvocal.index)
+    decoding     decoding and chunking the recordings (majorvocal.audio)
+    streaming    reading windows lazily from memory-mapped recordings (majorvocal.wav)
+    inference    batched inference over the chunks, with a stub analyzer
+    extraction   converting the detections to Parquet and reading them back
+    aggregation  daily counts per pnum (majorvocal.aggregate)
+
+The stub analyzer scores chunks deterministically from their contents, so no
+model or network is needed and the results only reflect the code around the
+model. Each stage runs in a fresh process so its peak RSS is its own. Results
+are appended to a JSONL file, one line per run with the commit it was run on,
+and compared with the last run with the same settings on the same machine.
+"""
+import concurrent.futures
+import json
+import math
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from majorvocal.audio import CHUNK_SECONDS, SAMPLE_RATE
+
+STAGES = ["discovery", "decoding", "streaming", "inference", "extraction", "aggregation"]
+LABELS = [
+    "Parus major_Great Tit",
+    "Cyanistes caeruleus_Eurasian Blue Tit",
+    "Erithacus rubecula_European Robin",
+    "Fringilla coelebs_Common Chaffinch",
+    "Troglodytes troglodytes_Eurasian Wren",
+]
+FIRST_DAY = date(2020, 4, 1)
+DETECTIONS_PER_RECORDING = 20
+
+
+class StubAnalyzer:
+    """
+    Stand-in for the BirdNET analyzer with deterministic scores: the score of
+    label ``i`` is the peak amplitude of the ``i``-th segment of the chunk.
+    No location filter is applied.
+
+    Args:
+        labels (list[str]): Model labels.
+    """
+
+    def __init__(self, labels: list[str] = LABELS):
+        self.labels = list(labels)
+
+    def predict_batch(self, batch: np.ndarray) -> np.ndarray:
+        segments = batch[:, : batch.shape[1] // len(self.labels) * len(self.labels)]
+        return np.abs(segments.reshape(len(batch), len(self.labels), -1)).max(axis=2)
+
+    def return_predicted_species_list(self, lon, lat, week_48, filter_threshold) -> list:
+        return []
+
+
+def stub_analyzer(version: str = "", n_threads: int = 1) -> StubAnalyzer:
+    """
+    analyzer_factory for majorvocal.inference that returns a StubAnalyzer.
+    """
+    return StubAnalyzer()
+
+
+# ──── SYNTHETIC DATA ─────────────────────────────────────────────────────────
+
+
+def _pnums(n: int) -> list[str]:
+    return [f"20201SY{i:02d}" for i in range(n)]
+
+
+def make_recordings(
+    data_path: Path, n_recordings: int, seconds: float = 60.0, n_pnums: int = 4, seed: int = 0
+) -> list[Path]:
+    """
+    Writes 16-bit mono WAV recordings of noise with loud 1 s bursts, as
+    ``data_path/GRETI_2020/<pnum>/<YYYYMMDD_HHMMSS>.WAV``.
+
+    Returns:
+        list[Path]: The recordings written.
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = int(seconds * SAMPLE_RATE)
+    pnums = _pnums(n_pnums)
+    paths = []
+    for i in range(n_recordings):
+        day = FIRST_DAY + timedelta(days=i // (n_pnums * 6))
+        start = datetime(day.year, day.month, day.day, 4) + timedelta(minutes=10 * (i // n_pnums % 6))
+        path = Path(data_path, "GRETI_2020", pnums[i % n_pnums], f"{start:%Y%m%d_%H%M%S}.WAV")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        signal = rng.normal(0, 0.05, n_samples)
+        for burst in rng.choice(max(1, int(seconds // CHUNK_SECONDS)), size=3):
+            start_sample = int(burst * CHUNK_SECONDS * SAMPLE_RATE)
+            signal[start_sample : start_sample + SAMPLE_RATE] *= 18
+        with wave.open(str(path), "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes((np.clip(signal, -1, 1) * 32767).astype("<i2").tobytes())
+        paths.append(path)
+    return paths
+
+
+def make_detections(path: Path, n_detections: int, n_pnums: int = 50, n_days: int = 40, seed: int = 0) -> int:
+    """
+    Writes a combined detections file (``[timestamp, pnum, detections]``
+    records, as NDJSON) with about ``n_detections`` detections, a tenth of
+    them of other species, and some recordings without detections. Records
+    are written as they are generated, so any size fits in memory.
+
+    Returns:
+        int: Number of recordings written.
+    """
+    rng = np.random.default_rng(seed)
+    pnums = _pnums(n_pnums)
+    n_recordings = max(1, math.ceil(n_detections / DETECTIONS_PER_RECORDING))
+    remaining = n_detections
+    with open(path, "w") as f:
+        for i in range(n_recordings):
+            day = FIRST_DAY + timedelta(days=int(i // n_pnums % n_days))
+            timestamp = f"{day:%Y%m%d}_{4 + i // (n_pnums * n_days) % 3:02d}{i % 60:02d}00"
+            n = min(remaining, int(rng.integers(0, 2 * DETECTIONS_PER_RECORDING + 1)))
+            if i == n_recordings - 1:
+                n = remaining
+            remaining -= n
+            detections = []
+            for start, label in zip(rng.integers(0, 200, n) * CHUNK_SECONDS, rng.random(n) < 0.9):
+                label = LABELS[0] if label else LABELS[1 + int(start) % (len(LABELS) - 1)]
+                scientific_name, common_name = label.split("_")
+                detections.append(
+                    {
+                        "common_name": common_name,
+                        "scientific_name": scientific_name,
+                        "start_time": float(start),
+                        "end_time": float(start + CHUNK_SECONDS),
+                        "confidence": round(float(rng.uniform(0.8, 1.0)), 4),
+                        "label": label,
+                    }
+                )
+            f.write(json.dumps([timestamp, pnums[i % n_pnums], detections]) + "\n")
+    return n_recordings
+
+
+def make_brood_data(n_pnums: int = 50):
+    """
+    Returns brood data for the synthetic pnums, with lay dates spread over
+    the recorded days.
+    """
+    import polars as pl
+
+    return pl.DataFrame(
+        {
+            "pnum": _pnums(n_pnums),
+            "year": [2020] * n_pnums,
+            "lay_date": [FIRST_DAY + timedelta(days=10 + i % 20) for i in range(n_pnums)],
+        }
+    )
+
+
+# ──── STAGES ─────────────────────────────────────────────────────────────────
+
+
+def _discovery(workdir: Path, settings: dict) -> dict:
+    from majorvocal.index import RecordingIndex
+
+    start = time.perf_counter()
+    n = RecordingIndex(workdir / "index").refresh(workdir / "raw")["recordings"]
+    return {"seconds": time.perf_counter() - start, "items": n, "unit": "files"}
+
+
+def _decode_all(workdir: Path) -> list[tuple[Path, np.ndarray]]:
+    from majorvocal.audio import load_chunks
+
+    return [(path, load_chunks(path)) for path in sorted((workdir / "raw").glob("*/*/*.WAV"))]
+
+
+def _decoding(workdir: Path, settings: dict) -> dict:
+    from majorvocal.audio import load_chunks
+
+    # librosa imports its backends and compiles its resamplers on first use
+    load_chunks(next((workdir / "raw").glob("*/*/*.WAV")))
+    start = time.perf_counter()
+    items = _decode_all(workdir)
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "items": len(items), "unit": "files", "audio_seconds": _audio_seconds(items)}
+
+
+def _streaming(workdir: Path, settings: dict) -> dict:
+    from majorvocal.wav import WavChunks
+
+    # The windows of memory-mapped recordings, one at a time, as inference reads them
+    paths = sorted((workdir / "raw").glob("*/*/*.WAV"))
+    start = time.perf_counter()
+    n_chunks = sum(1 for path in paths for _ in WavChunks(path))
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "items": len(paths), "unit": "files", "audio_seconds": n_chunks * CHUNK_SECONDS}
+
+
+def _inference(workdir: Path, settings: dict) -> dict:
+    from majorvocal.inference import predict_files
+
+    items = _decode_all(workdir)
+    start = time.perf_counter()
+    n = sum(len(detections) for _, detections in predict_files(StubAnalyzer(), items, settings["batch_size"]))
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": seconds,
+        "items": len(items),
+        "unit": "files",
+        "audio_seconds": _audio_seconds(items),
+        "detections": n,
+    }
+
+
+def _extraction(workdir: Path, settings: dict) -> dict:
+    from majorvocal.detections import convert_json
+    from majorvocal.utils import load_parus_major
+
+    start = time.perf_counter()
+    convert_json(workdir / "detections.json", workdir / "detections")
+    n = len(load_parus_major(workdir / "detections"))
+    return {"seconds": time.perf_counter() - start, "items": settings["detections"], "unit": "detections", "rows": n}
+
+
+def _aggregation(workdir: Path, settings: dict) -> dict:
+    from majorvocal.aggregate import daily_counts
+    from majorvocal.utils import load_parus_major
+
+    detections = load_parus_major(workdir / "detections")
+    brood = make_brood_data(settings["pnums"])
+    start = time.perf_counter()
+    n = len(daily_counts(detections, brood))
+    return {"seconds": time.perf_counter() - start, "items": len(detections), "unit": "rows", "days": n}
+
+
+def _audio_seconds(items: list[tuple[Path, np.ndarray]]) -> float:
+    return sum(len(chunks) for _, chunks in items) * CHUNK_SECONDS
+
+
+_STAGE_FUNCTIONS = {
+    "discovery": _discovery,
+    "decoding": _decoding,
+    "streaming": _streaming,
+    "inference": _inference,
+    "extraction": _extraction,
+    "aggregation": _aggregation,
+}
+
+
+def _run_stage(name: str, workdir: Path, settings: dict) -> dict:
+    metrics = _STAGE_FUNCTIONS[name](workdir, settings)
+    metrics["rate"] = metrics["items"] / max(metrics["seconds"], 1e-9)
+    if "audio_seconds" in metrics:
+        metrics["realtime_factor"] = metrics["audio_seconds"] / max(metrics["seconds"], 1e-9)
+    # Kilobytes on Linux, bytes on macOS
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    metrics["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    return metrics
+
+
+# ──── RUNS AND RESULTS ───────────────────────────────────────────────────────
+
+
+def run_benchmark(
+    recordings: int = 20,
+    seconds: float = 60.0,
+    detections: int = 100_000,
+    batch_size: int = 64,
+    stages: Optional[list[str]] = None,
+    isolate: bool = True,
+    workdir: Optional[Path] = None,
+) -> dict:
+    """
+    Generates the synthetic data and times each stage on it.
+
+    Args:
+        recordings (int): Number of synthetic recordings.
+        seconds (float): Length of each recording.
+        detections (int): Number of detections in the synthetic detections
+            file (e.g. 1_000 to 1_000_000).
+        batch_size (int): Chunks per model call.
+        stages (list[str], optional): Stages to run; defaults to all.
+        isolate (bool): Run each stage in a new process, so peak RSS is
+            measured per stage. Otherwise it is the peak of this process so
+            far.
+        workdir (Path, optional): Where the synthetic data is written;
+            defaults to a temporary folder that is removed afterwards.
+
+    Returns:
+        dict: The settings, the commit and machine, and for each stage the
+        time, items processed, rate (items/s), realtime factor (seconds of
+        audio per second, where it applies) and peak RSS in MB.
+
+    Raises:
+        ValueError: If a stage is unknown.
+    """
+    unknown = set(stages or []) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}; expected some of {STAGES}")
+    settings = {
+        "recordings": recordings,
+        "seconds": seconds,
+        "detections": detections,
+        "batch_size": batch_size,
+        "pnums": 50,
+    }
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        tmp = Path(tmp)
+        make_recordings(tmp / "raw", recordings, seconds)
+        make_detections(tmp / "detections.json", detections, n_pnums=settings["pnums"])
+        results = {}
+        for name in stages or STAGES:
+            if isolate:
+                context = multiprocessing.get_context("spawn")
+                with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as executor:
+                    results[name] = executor.submit(_run_stage, name, tmp, settings).result()
+            else:
+                results[name] = _run_stage(name, tmp, settings)
+    return {
+        "commit": _commit(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "machine": {"node": platform.node(), "processor": platform.machine(), "python": platform.python_version()},
+        "settings": settings,
+        "stages": results,
+    }
+
+
+def _commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def load_results(path: Path) -> list[dict]:
+    """
+    Returns the runs stored in a results file, oldest first.
+    """
+    path = Path(path)
+    if not path.exists():
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_result(path: Path, result: dict) -> None:
+    """
+    Appends a run to a results file.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(result) + "\n")
+
+
+def compare(result: dict, history: list[dict], tolerance: float = 0.25) -> list[str]:
+    """
+    Compares a run with the last run in ``history`` with the same settings on
+    the same machine.
+
+    Args:
+        result (dict): From run_benchmark.
+        history (list[dict]): Earlier runs, oldest first.
+        tolerance (float): Relative slowdown (or RSS increase) allowed.
+
+    Returns:
+        list[str]: A description of each stage that regressed.
+    """
+    previous = [
+        r
+        for r in history
+        if r["settings"] == result["settings"] and r["machine"] == result["machine"] and r is not result
+    ]
+    if not previous:
+        return []
+    baseline = previous[-1]
+    regressions = []
+    for name, metrics in result["stages"].items():
+        before = baseline["stages"].get(name)
+        if before is None:
+            continue
+        for key, label in [("seconds", "time"), ("peak_rss_mb", "peak RSS")]:
+            if metrics[key] > before[key] * (1 + tolerance):
+                regressions.append(
+                    f"{name}: {label} {before[key]:.3g} -> {metrics[key]:.3g} "
+                    f"(+{metrics[key] / before[key] - 1:.0%} since {baseline['commit']})"
+                )
+    return regressions
+
+
+def format_result(result: dict) -> str:
+    """
+    Returns a table of the stages of a run.
+    """
+    lines = [f"{'stage':<12} {'seconds':>9} {'rate':>24} {'x realtime':>11} {'peak RSS':>10}"]
+    for name, m in result["stages"].items():
+        rate = f"{m['rate']:.0f} {m['unit']}/s"
+        realtime = f"{m['realtime_factor']:.1f}" if "realtime_factor" in m else ""
+        lines.append(f"{name:<12} {m['seconds']:>9.3f} {rate:>24} {realtime:>11} {m['peak_rss_mb']:>7.0f} MB")
+    return "\n".join(lines)
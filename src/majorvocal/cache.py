@@ -0,0 +1,143 @@
+"""
+Persistent on-disk cache of decoded, resampled audio chunks.
+
+Each recording's chunks are stored as a ``.npy`` file named after a hash of the
+recording's path, size and modification time, so an edited or replaced
+recording is decoded again. The reader that decoded them is part of the hash
+too: librosa and majorvocal.wav resample differently, and chunks decoded by
+one are never served to the other. Cached chunks are memory-mapped on read rather
+than loaded. The cache is shared safely by several processes: entries are
+written to a temporary file and renamed into place, and the least recently
+used entries are evicted once the cache grows past ``max_bytes``.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+
+from majorvocal.audio import load_chunks
+
+# Resampler of each reader of majorvocal.inference, which determines the samples
+RESAMPLERS = {"librosa": "kaiser_fast", "mmap": "resample_poly"}
+
+
+class ChunkCache:
+    """
+    Cache of decoded chunk arrays, keyed by recording path, size, mtime and
+    reader.
+
+    Args:
+        root (Path): Cache directory; created on first write.
+        max_bytes (int): Size cap. Least recently used entries are evicted
+            when a write takes the cache over it.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 100 * 2**30):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._size = None
+
+    def entry_path(self, file_path: Path, overlap: float = 0.0, reader: str = "librosa") -> Path:
+        """
+        Returns the cache file for the current version of ``file_path``,
+        decoded by ``reader`` ("librosa" or "mmap").
+        """
+        stat = file_path.stat()
+        key = f"{file_path.resolve()}\0{stat.st_size}\0{stat.st_mtime_ns}\0{overlap}\0{reader}\0{RESAMPLERS[reader]}"
+        digest = hashlib.sha1(key.encode(), usedforsecurity=False).hexdigest()
+        return self.root / digest[:2] / f"{digest}.npy"
+
+    def get(self, file_path: Path, overlap: float = 0.0, reader: str = "librosa") -> Optional[np.ndarray]:
+        """
+        Returns the chunks of ``file_path`` cached by ``reader`` as a
+        read-only memory map, or None if they are not cached.
+        """
+        entry = self.entry_path(file_path, overlap, reader)
+        try:
+            chunks = np.load(entry, mmap_mode="r")
+            os.utime(entry)  # mark as recently used
+        except (FileNotFoundError, ValueError):
+            return None
+        return chunks
+
+    def put(self, file_path: Path, chunks: np.ndarray, overlap: float = 0.0, reader: str = "librosa") -> np.ndarray:
+        """
+        Stores the chunks of ``file_path`` decoded by ``reader`` and evicts
+        old entries if needed.
+
+        Returns:
+            np.ndarray: The stored chunks, memory-mapped from the cache.
+        """
+        entry = self.entry_path(file_path, overlap, reader)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=entry.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            # A chunk at a time, so lazily read chunks (majorvocal.wav.WavChunks)
+            # are never decoded in full
+            header = {"descr": "<f4", "fortran_order": False, "shape": tuple(chunks.shape)}
+            np.lib.format.write_array_header_1_0(f, header)
+            for chunk in chunks:
+                f.write(np.asarray(chunk, dtype="<f4").tobytes())
+        os.replace(tmp, entry)
+
+        if self._size is not None:
+            self._size += entry.stat().st_size
+        if self.size() > self.max_bytes:
+            self.evict(keep=entry)
+        return np.load(entry, mmap_mode="r")
+
+    def get_or_load(
+        self,
+        file_path: Path,
+        overlap: float = 0.0,
+        load: Callable[..., np.ndarray] = load_chunks,
+        reader: str = "librosa",
+    ) -> np.ndarray:
+        """
+        Returns the cached chunks of ``file_path``, decoding and caching them
+        first if needed. ``reader`` names the reader behind ``load``.
+        """
+        chunks = self.get(file_path, overlap, reader)
+        if chunks is None:
+            chunks = self.put(file_path, load(file_path, overlap=overlap), overlap, reader)
+        return chunks
+
+    def _entries(self) -> list[tuple[Path, os.stat_result]]:
+        entries = []
+        for entry in self.root.glob("*/*.npy"):
+            try:
+                entries.append((entry, entry.stat()))
+            except FileNotFoundError:  # evicted by another process
+                continue
+        return entries
+
+    def size(self) -> int:
+        """
+        Returns the total size of the cache in bytes. The directory is only
+        scanned the first time; later writes by this process are added on.
+        """
+        if self._size is None:
+            self._size = sum(stat.st_size for _, stat in self._entries()) if self.root.exists() else 0
+        return self._size
+
+    def evict(self, keep: Optional[Path] = None) -> None:
+        """
+        Deletes the least recently used entries until the cache fits in
+        ``max_bytes``. The directory is rescanned, so entries written by other
+        processes are accounted for.
+
+        Args:
+            keep (Path, optional): An entry that must not be evicted.
+        """
+        entries = sorted(self._entries(), key=lambda item: item[1].st_mtime_ns)
+        self._size = sum(stat.st_size for _, stat in entries)
+        for entry, stat in entries:
+            if self._size <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            entry.unlink(missing_ok=True)
+            self._size -= stat.st_size
@@ -0,0 +1,721 @@
+"""
+``majorvocal`` command line interface.
+
+Each subcommand brings one stage of the pipeline up to date, after the stages
+it depends on::
+
+    index      list the recordings on the data drive (incremental)
+    features   compute per-chunk audio features of every recording (incremental)
+    infer      run BirdNET on new recordings and append their detections
+    extract    fold new detections into the per-pnum derived tables
+    aggregate  write daily_counts.csv and peak_days.csv
+    activity   count detections by pnum, date and time of day (see majorvocal.activity)
+    correlate  correlate the daily activity of neighbouring nestboxes (see majorvocal.spatial)
+    plot       write the sanity-check figures
+    run        all of the above except features and correlate, which are optional
+
+and ``enqueue``, ``work`` and ``merge`` spread inference over several machines.
+``benchmark`` times each stage on synthetic data and reports regressions.
+``--prefilter-db`` only runs the model on chunks with energy in the great tit
+band, read from the ``features`` index where it exists, and
+``check-prefilter`` measures what that costs in detections on a sample of
+recordings. ``--backend`` picks the implementation of the model (see
+majorvocal.backends); ``compare-backends`` reports their throughput and
+agreement on a sample, and ``quantize`` makes float16 and int8 models.
+``pack-json`` packs the per-recording JSON outputs of older runs into a few
+segment files with a sorted index (see majorvocal.archive).
+
+Inference writes per-file timings to logs/metrics.jsonl and running totals to
+a Prometheus textfile (see majorvocal.metrics); ``--profile`` profiles every
+worker into logs/profiles.
+
+Stages whose inputs and parameters have not changed since their last run are
+skipped (see majorvocal.stages), so rerunning the pipeline after a small
+change only redoes the affected stages. ``--only`` runs a stage without its
+dependencies, e.g. to replot without looking for new recordings.
+"""
+import argparse
+import json
+import sys
+from datetime import date, datetime
+from pathlib import Path
+from typing import Optional
+
+from majorvocal.config import config
+from majorvocal.stages import Pipeline, Stage
+
+# Recordings analysed, as HHMMSS (exclusive)
+TIME_WINDOW = ("033000", "063000")
+MIN_CONF = 0.8
+
+
+def _derived(*parts: str) -> Path:
+    return Path(config.PROJECT_STRUCTURE["derived_data"], *parts)
+
+
+def _brood_file() -> Path:
+    return config.PROJECT_STRUCTURE["metadata"] / "main.csv"
+
+
+def _nestboxes_file() -> Path:
+    return config.PROJECT_STRUCTURE["metadata"] / "nestboxes.csv"
+
+
+def _read_brood_data():
+    import pandas as pd
+    import polars as pl
+
+    return pl.from_pandas(pd.read_csv(_brood_file()))
+
+
+def _filter(df, params: dict):
+    """
+    Applies the pnum and date filters to a frame with pnum and date columns.
+    """
+    import polars as pl
+
+    if params.get("pnums"):
+        df = df.filter(pl.col("pnum").is_in(params["pnums"]))
+    if params.get("start_date"):
+        df = df.filter(pl.col("date") >= params["start_date"])
+    if params.get("end_date"):
+        df = df.filter(pl.col("date") <= params["end_date"])
+    return df
+
+
+# ──── STAGES ─────────────────────────────────────────────────────────────────
+
+
+def run_index(params: dict) -> dict:
+    from majorvocal.index import RecordingIndex
+
+    return RecordingIndex(_derived("index")).refresh(config.DATA_PATH, pattern="GRETI_20*")
+
+
+def _features_dir() -> Path:
+    return _derived("index", "features")
+
+
+def run_features(params: dict) -> dict:
+    from majorvocal.features import FeatureIndex
+    from majorvocal.index import RecordingIndex
+    from majorvocal.inference import MIN_FILE_SIZE
+
+    recordings = RecordingIndex(_derived("index")).select(time_window=TIME_WINDOW, min_size=MIN_FILE_SIZE)
+    return FeatureIndex(_features_dir()).refresh(recordings, n_workers=params["workers"])
+
+
+def _recordings(params: dict) -> list[Path]:
+    """
+    Returns the recordings to analyse, after the filters in ``params``.
+    """
+    from majorvocal.index import RecordingIndex
+
+    # Entries with manually segmented songs (see https://nilomr.github.io/great-tit-hits/)
+    brood_data = _read_brood_data()
+    pnums = brood_data.filter(brood_data["n_vocalisations"] > 0)["pnum"].to_list()
+    if params.get("pnums"):
+        pnums = [p for p in pnums if p in params["pnums"]]
+    file_paths = RecordingIndex(_derived("index")).paths(
+        pnums=pnums, start_date=params.get("start_date"), end_date=params.get("end_date"), time_window=TIME_WINDOW
+    )
+    if not file_paths:
+        raise ValueError("No recordings found matching the entries with recordings.")
+    return file_paths
+
+
+def _manifest():
+    from majorvocal.manifest import RunManifest
+
+    # The manifest records every finished file as soon as it completes, so an
+    # interrupted run resumes where it stopped. Per-file json outputs of older
+    # runs are adopted.
+    manifest = RunManifest(_derived("manifest.sqlite"))
+    if _derived("json").exists():
+        manifest.import_json_dir(_derived("json"))
+    return manifest
+
+
+def _logs(*parts: str) -> Path:
+    return Path(config.PROJECT_PATH, "logs", *parts)
+
+
+def _run_id(params: dict) -> str:
+    # Set once per command, so every file of a run shares it
+    return params.setdefault("run_id", datetime.now().strftime("%Y-%m-%d_%H%M%S"))
+
+
+def _log_file(params: dict) -> Path:
+    return config.output(_logs(f"{_run_id(params)}.log"))
+
+
+def _profiling(params: dict) -> dict:
+    return {"profile": params.get("profile"), "profile_dir": _logs("profiles", _run_id(params))}
+
+
+def _analyzer_factory(params: dict):
+    import functools
+
+    from majorvocal.backends import load_backend
+
+    # A partial of a module-level function, so it can be sent to spawned workers
+    return functools.partial(
+        load_backend, params["backend"], model_path=params.get("model_path"), xnnpack=not params.get("no_xnnpack")
+    )
+
+
+def _sample(params: dict) -> list[Path]:
+    import random
+
+    file_paths = _recordings(params)
+    return random.Random(params["seed"]).sample(file_paths, min(params["sample"], len(file_paths)))
+
+
+def _metrics(params: dict):
+    from majorvocal.metrics import MetricsSink
+
+    return MetricsSink(_logs("metrics.jsonl"), textfile=params.get("metrics_textfile") or _logs("majorvocal.prom"))
+
+
+def run_infer(params: dict) -> dict:
+    from tqdm import tqdm
+
+    from majorvocal.cache import ChunkCache
+    from majorvocal.detections import sync_detections
+    from majorvocal.inference import process_files, run_inference, run_streaming_inference, too_small
+    from majorvocal.manifest import file_record
+    from majorvocal.pipeline import Prefetcher
+
+    manifest = _manifest()
+    file_paths = manifest.pending(_recordings(params))
+    log_file = _log_file(params)
+    cache_dir = params.get("cache_dir")
+    scores_dir = None if params.get("no_scores") else _derived("scores")
+    if not file_paths:
+        sync_detections(manifest, _derived("detections"))
+        return manifest.summary()
+
+    if params["mode"] == "stream":
+        small = {f for f in file_paths if too_small(f)}
+        manifest.record(file_record(f, "skipped") for f in small)
+        prefetcher = Prefetcher(
+            [f for f in file_paths if f not in small],
+            n_readers=params["readers"],
+            n_decoders=params["decoders"],
+            depth=params["prefetch"],
+            cache=ChunkCache(cache_dir, params["cache_size"]) if cache_dir else None,
+            return_exceptions=True,
+        )
+        results = run_streaming_inference(
+            prefetcher,
+            batch_size=params["batch_size"],
+            min_conf=MIN_CONF,
+            n_threads=params["threads"],
+            analyzer_factory=_analyzer_factory(params),
+            log_file=log_file,
+            scores_dir=scores_dir,
+            prefilter_db=params.get("prefilter_db"),
+            features_dir=_features_dir() if _features_dir().exists() else None,
+            **_profiling(params),
+        )
+        with tqdm(total=len(prefetcher), desc="Processing files") as pbar, _metrics(params) as metrics:
+            for record in results:
+                manifest.record([record])
+                metrics.record([record])
+                depths = prefetcher.queue_depths()
+                for name, depth in depths.items():
+                    metrics.gauge("queue_depth", depth, queue=name)
+                pbar.set_postfix(depths)
+                pbar.update(1)
+            skip_ratio = metrics.skip_ratio()
+    else:
+        # Each worker loads BirdNET once and returns the records for its group
+        n = params["files_per_task"]
+        groups = [file_paths[i : i + n] for i in range(0, len(file_paths), n)]
+        results = run_inference(
+            groups,
+            task=process_files,
+            n_workers=params["workers"],
+            n_threads=params["threads"],
+            analyzer_factory=_analyzer_factory(params),
+            log_file=log_file,
+            batch_size=params["batch_size"],
+            min_conf=MIN_CONF,
+            cache_dir=cache_dir,
+            cache_bytes=params["cache_size"],
+            reader=params["wav_reader"],
+            scores_dir=scores_dir,
+            prefilter_db=params.get("prefilter_db"),
+            features_dir=_features_dir() if _features_dir().exists() else None,
+            **_profiling(params),
+        )
+        with _metrics(params) as metrics:
+            for i, records in enumerate(tqdm(results, total=len(groups), desc=f"Processing files ({n} per group)")):
+                manifest.record(records)
+                metrics.record(records)
+                metrics.gauge("queue_depth", len(groups) - i - 1, queue="groups")
+            skip_ratio = metrics.skip_ratio()
+
+    # Append the new results to the Parquet dataset partitioned by year and pnum
+    sync_detections(manifest, _derived("detections"))
+    for path, error in manifest.failures():
+        print(f"Failed: {path}: {error}", file=sys.stderr)
+    if params.get("prefilter_db") is None:
+        return manifest.summary()
+    return {**manifest.summary(), "skip_ratio": round(skip_ratio, 3)}
+
+
+def run_extract(params: dict) -> dict:
+    from majorvocal.aggregate import DerivedTables
+    from majorvocal.detections import convert_json
+
+    # Convert the detections of older runs to the Parquet dataset, once
+    if not _derived("detections").exists() and _derived("detections.json").exists():
+        convert_json(_derived("detections.json"), _derived("detections"))
+    return DerivedTables(_derived("tables")).update(_derived("detections"), _read_brood_data())
+
+
+def run_aggregate(params: dict) -> dict:
+    from majorvocal.aggregate import DerivedTables, peak_days
+
+    # Peaks of the filtered days, as in the figures of run_plot
+    daily = _filter(DerivedTables(_derived("tables")).daily, params)
+    peaks = peak_days(daily)
+    daily.to_pandas().to_csv(config.output(_derived("daily_counts.csv")), index=False)
+    peaks.to_pandas().to_csv(config.output(_derived("peak_days.csv")), index=False)
+    return {"pnums": peaks.height, "days": daily.height}
+
+
+def run_activity(params: dict) -> dict:
+    from majorvocal.activity import ActivityCube
+    from majorvocal.aggregate import DerivedTables
+
+    return ActivityCube(_derived("activity")).update(DerivedTables(_derived("tables")))
+
+
+def run_correlate(params: dict) -> dict:
+    from majorvocal.aggregate import DerivedTables
+    from majorvocal.spatial import NestboxIndex, neighbour_correlations
+
+    index = NestboxIndex.from_csv(_nestboxes_file())
+    daily = _filter(DerivedTables(_derived("tables")).daily, params)
+    pairs = neighbour_correlations(daily, index, params["radius"], params["min_days"], n_workers=params["workers"])
+    pairs.to_pandas().to_csv(config.output(_derived("neighbour_correlations.csv")), index=False)
+    return {"nestboxes": len(index), "pairs": pairs.height, "correlated": pairs["r"].is_not_null().sum()}
+
+
+def run_plot(params: dict) -> dict:
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import polars as pl
+
+    from majorvocal import aggregate, plots
+    from majorvocal.utils import to_df
+
+    tables = aggregate.DerivedTables(_derived("tables"))
+    daily = _filter(tables.daily, params)
+    pnums = daily["pnum"].unique().to_list()
+    detections = tables.detections(pnums)
+    date = pl.col("timestamp").str.slice(0, 8).str.to_date("%Y%m%d")
+    detections = _filter(detections.with_columns(date.alias("date")), params).drop("date")
+    subset = aggregate.scaled_counts(aggregate.subset_pnums(daily))
+    paths = plots.save_figures(
+        to_df(detections),
+        daily.to_pandas(),
+        aggregate.peak_days(daily).to_pandas(),
+        subset.to_pandas(),
+        aggregate.peak_days(subset).to_pandas(),
+        config.PROJECT_STRUCTURE["figures"],
+    )
+    return {"figures": len(paths)}
+
+
+FILTERS = ["pnums", "start_date", "end_date"]
+
+
+def make_pipeline() -> Pipeline:
+    """
+    Returns the pipeline of the project, with its state kept in the derived
+    data folder.
+    """
+    stages = [
+        Stage("index", run_index, outputs=lambda p: [_derived("index")], always=True),
+        Stage(
+            "features",
+            run_features,
+            inputs=lambda p: [_derived("index", "recordings.parquet")],
+            outputs=lambda p: [_features_dir()],
+            deps=["index"],
+        ),
+        Stage(
+            "infer",
+            run_infer,
+            inputs=lambda p: [_derived("index", "recordings.parquet"), _brood_file()],
+            outputs=lambda p: [_derived("detections")],
+            deps=["index"],
+            params=FILTERS + ["prefilter_db", "backend", "model_path", "wav_reader"],
+            # Retries failed recordings and those left pending by an interrupted
+            # run; the manifest makes a rerun with nothing to do cheap
+            always=True,
+        ),
+        Stage(
+            "extract",
+            run_extract,
+            inputs=lambda p: [_derived("detections"), _brood_file()],
+            outputs=lambda p: [_derived("tables", "daily_counts.parquet")],
+            deps=["infer"],
+        ),
+        Stage(
+            "aggregate",
+            run_aggregate,
+            inputs=lambda p: [_derived("tables", "daily_counts.parquet"), _derived("tables", "peak_days.parquet")],
+            outputs=lambda p: [_derived("daily_counts.csv"), _derived("peak_days.csv")],
+            deps=["extract"],
+            params=FILTERS,
+        ),
+        Stage(
+            "activity",
+            run_activity,
+            inputs=lambda p: [_derived("tables", "detections")],
+            outputs=lambda p: [_derived("activity")],
+            deps=["extract"],
+        ),
+        Stage(
+            "correlate",
+            run_correlate,
+            inputs=lambda p: [_derived("tables", "daily_counts.parquet"), _nestboxes_file()],
+            outputs=lambda p: [_derived("neighbour_correlations.csv")],
+            deps=["extract"],
+            params=FILTERS + ["radius", "min_days"],
+        ),
+        Stage(
+            "plot",
+            run_plot,
+            inputs=lambda p: [_derived("tables")],
+            outputs=lambda p: [config.PROJECT_STRUCTURE["figures"]],
+            deps=["extract"],
+            params=FILTERS,
+        ),
+    ]
+    return Pipeline(stages, _derived("pipeline_state.json"))
+
+
+# ──── SHARDED INFERENCE ──────────────────────────────────────────────────────
+#
+# For seasons too large for one machine: ``enqueue`` lists the pending
+# recordings as shards (one per pnum and day) in a queue on shared storage,
+# ``work`` is started on every node and processes shards until none are left,
+# and ``merge`` folds their results into the run manifest and the detections
+# dataset. Workers that die lose their lease and their shards are retried.
+# The per-shard manifests and the scores are written next to the queue, so
+# they are on the same shared storage whichever node processed the shard.
+# Run ``majorvocal index`` first so the index lists the new recordings.
+
+
+def _queue_path(params: dict) -> Path:
+    return params.get("queue") or _derived("queue.sqlite")
+
+
+def _shared(params: dict, name: str) -> Path:
+    return Path(_queue_path(params)).parent / name
+
+
+def _queue(params: dict):
+    from majorvocal.shards import ShardQueue
+
+    return ShardQueue(_queue_path(params), lease_seconds=params["lease"])
+
+
+def enqueue(params: dict) -> dict:
+    from majorvocal.shards import make_shards
+
+    with _manifest() as manifest, _queue(params) as queue:
+        added = queue.add(make_shards(manifest.pending(_recordings(params))))
+        return {"added": added, **queue.summary()}
+
+
+def work(params: dict) -> dict:
+    import functools
+    import itertools
+
+    from majorvocal import shards
+    from majorvocal.inference import process_files, worker_pool
+
+    n = params["files_per_task"]
+    task = functools.partial(
+        process_files,
+        batch_size=params["batch_size"],
+        min_conf=MIN_CONF,
+        cache_dir=params.get("cache_dir"),
+        cache_bytes=params["cache_size"],
+        reader=params["wav_reader"],
+        scores_dir=None if params.get("no_scores") else _shared(params, "scores"),
+        prefilter_db=params.get("prefilter_db"),
+        features_dir=_features_dir() if _features_dir().exists() else None,
+    )
+    pool = worker_pool(
+        params["workers"],
+        params["threads"],
+        analyzer_factory=_analyzer_factory(params),
+        log_file=_log_file(params),
+        **_profiling(params),
+    )
+    with pool as pool, _queue(params) as queue, _metrics(params) as metrics:
+
+        def process(file_paths: list[Path]) -> list[dict]:
+            groups = [file_paths[i : i + n] for i in range(0, len(file_paths), n)]
+            records = list(itertools.chain.from_iterable(pool.imap_unordered(task, groups)))
+            metrics.record(records)
+            metrics.gauge("queue_depth", queue.summary().get("pending", 0), queue="shards")
+            return records
+
+        processed = shards.work(queue, _shared(params, "shards"), process)
+        return {"processed": processed, **queue.summary()}
+
+
+def _quiet(factory, **kwargs):
+    import contextlib
+    import os
+
+    from majorvocal.inference import set_num_threads
+
+    # birdnetlib prints progress as it loads
+    set_num_threads(kwargs.get("n_threads", 1))
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return factory(**kwargs)
+
+
+def check_prefilter(params: dict) -> dict:
+    from majorvocal.audio import load_chunks
+    from majorvocal.prefilter import MARGIN_DB, validate
+
+    analyzer = _quiet(_analyzer_factory(params), n_threads=params["threads"])
+    margin_db = MARGIN_DB if params.get("prefilter_db") is None else params["prefilter_db"]
+    items = ((f, load_chunks(f)) for f in _sample(params))
+    result = validate(analyzer, items, margin_db, min_conf=MIN_CONF, batch_size=params["batch_size"])
+    return {**result, "margin_db": margin_db}
+
+
+def compare_backends(params: dict) -> dict:
+    import functools
+
+    from majorvocal.audio import load_chunks
+    from majorvocal.backends import evaluate, load_backend
+
+    factories = {}
+    for candidate in ["birdnetlib", *params["candidates"]]:
+        backend, _, model_path = candidate.partition("=")
+        factories[candidate] = functools.partial(
+            _quiet, load_backend, backend=backend, model_path=model_path or None, n_threads=params["threads"]
+        )
+    items = [(f, load_chunks(f)) for f in _sample(params)]
+    results = evaluate(factories, items, min_conf=MIN_CONF, batch_size=params["batch_size"])
+    for name, result in results.items():
+        print(
+            f"{name:<40} {result['realtime_factor']:8.1f}x realtime  {result['speedup']:5.2f}x  "
+            f"precision {result['precision']:.3f}  recall {result['recall']:.3f}",
+            file=sys.stderr,
+        )
+    return results
+
+
+def quantize(params: dict) -> dict:
+    import itertools
+
+    from majorvocal import backends
+    from majorvocal.audio import load_chunks
+
+    representative = None
+    if params["precision"] == "int8":
+        chunks = itertools.chain.from_iterable(load_chunks(f) for f in _sample(params))
+        representative = itertools.islice(chunks, params["calibration_chunks"])
+    out = params["out"] or Path(config.PROJECT_PATH, "models", f"BirdNET_V2.4_{params['precision']}.tflite")
+    return {"model": backends.quantize(params["saved_model"], out, params["precision"], representative)}
+
+
+def pack_json(params: dict) -> dict:
+    from majorvocal.archive import pack_json_dir
+
+    json_dir = params["json_dir"] or _derived("json")
+    return {"json_dir": json_dir, "packed": pack_json_dir(json_dir)}
+
+
+def merge(params: dict) -> dict:
+    import shutil
+
+    from majorvocal.detections import sync_detections
+    from majorvocal.shards import merge_shards
+
+    with _manifest() as manifest, _queue(params) as queue:
+        merged = merge_shards(_shared(params, "shards"), manifest)
+        sync_detections(manifest, _derived("detections"))
+        # Score files have unique names, so those of every node move as they are
+        scores = _shared(params, "scores")
+        moved = sorted(scores.rglob("*.parquet")) if scores != _derived("scores") else []
+        for path in moved:
+            target = _derived("scores") / path.relative_to(scores)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(path, target)
+        for shard_id, error in queue.failures():
+            print(f"Failed: {shard_id}: {error}", file=sys.stderr)
+        return {"merged": merged, "score_files": len(moved), **queue.summary()}
+
+
+def benchmark(params: dict) -> dict:
+    from majorvocal import benchmark
+
+    results_file = params["results"] or Path(config.PROJECT_PATH, "benchmarks", "results.jsonl")
+    result = benchmark.run_benchmark(
+        recordings=params["recordings"],
+        seconds=params["duration"],
+        detections=params["detections"],
+        batch_size=params["batch_size"],
+        stages=params["stages"],
+    )
+    regressions = benchmark.compare(result, benchmark.load_results(results_file), params["tolerance"])
+    benchmark.save_result(results_file, result)
+    print(benchmark.format_result(result))
+    for regression in regressions:
+        print(f"Regression: {regression}", file=sys.stderr)
+    return {"results": results_file, "regressions": len(regressions)}
+
+
+COMMANDS = {
+    "enqueue": enqueue,
+    "work": work,
+    "merge": merge,
+    "check-prefilter": check_prefilter,
+    "compare-backends": compare_backends,
+    "quantize": quantize,
+    "pack-json": pack_json,
+    "benchmark": benchmark,
+}
+
+
+# ──── COMMAND LINE ───────────────────────────────────────────────────────────
+
+
+def build_parser() -> argparse.ArgumentParser:
+    common = argparse.ArgumentParser(add_help=False)
+    group = common.add_argument_group("pipeline")
+    group.add_argument("--force", action="store_true", help="run the stages even if they are up to date")
+    group.add_argument("--only", action="store_true", help="do not run the stages this one depends on")
+    group = common.add_argument_group("filters")
+    group.add_argument("--pnum", dest="pnums", action="append", metavar="PNUM", help="only this pnum (repeatable)")
+    group.add_argument("--start-date", type=date.fromisoformat, metavar="YYYY-MM-DD", help="first date, inclusive")
+    group.add_argument("--end-date", type=date.fromisoformat, metavar="YYYY-MM-DD", help="last date, inclusive")
+    group = common.add_argument_group("inference")
+    group.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    group.add_argument("--backend", choices=["birdnetlib", "tflite", "tf"], default="birdnetlib", help="model backend")
+    group.add_argument("--model-path", type=Path, default=None, help="model of the tflite or tf backend")
+    group.add_argument("--no-xnnpack", action="store_true", help="tflite backend without the XNNPACK delegate")
+    group.add_argument("--threads", type=int, default=1, help="intra-op threads per model")
+    group.add_argument("--batch-size", type=int, default=64, help="chunks per model call")
+    group.add_argument("--files-per-task", type=int, default=16, help="recordings sent to a worker at a time")
+    group.add_argument(
+        "--mode", choices=["pool", "stream"], default="pool", help="one model per worker, or one fed by a prefetcher"
+    )
+    group.add_argument(
+        "--wav-reader",
+        choices=["librosa", "mmap"],
+        default="librosa",
+        help="decode recordings in full, or memory-map them and resample windows lazily (pool mode)",
+    )
+    group.add_argument("--readers", type=int, default=2, help="reader threads (stream mode)")
+    group.add_argument("--decoders", type=int, default=4, help="decoder processes (stream mode)")
+    group.add_argument("--prefetch", type=int, default=32, help="recordings read ahead (stream mode)")
+    group.add_argument("--cache-dir", type=Path, default=None, help="cache of decoded chunks")
+    group.add_argument("--cache-size", type=int, default=200 * 2**30, help="cache size in bytes")
+    group.add_argument("--no-scores", action="store_true", help="do not store the raw scores")
+    group.add_argument(
+        "--prefilter-db",
+        type=float,
+        default=None,
+        help="skip chunks whose 2-8 kHz energy peaks less than this far above the noise floor",
+    )
+    group.add_argument(
+        "--profile", choices=["cprofile", "sample"], default=None, help="profile each worker into logs/profiles"
+    )
+    group.add_argument(
+        "--metrics-textfile", type=Path, default=None, help="Prometheus textfile (default: logs/majorvocal.prom)"
+    )
+    group = common.add_argument_group("neighbours")
+    group.add_argument("--radius", type=float, default=100.0, help="distance between neighbouring nestboxes, in metres")
+    group.add_argument("--min-days", type=int, default=5, help="days recorded together needed to correlate two boxes")
+    group = common.add_argument_group("sharded inference")
+    group.add_argument(
+        "--queue",
+        type=Path,
+        default=None,
+        help="shard queue; shard outputs are written next to it (default: data/derived/queue.sqlite)",
+    )
+    group.add_argument("--lease", type=float, default=30 * 60, help="seconds before an unrenewed shard is retried")
+
+    parser = argparse.ArgumentParser(prog="majorvocal", description="Great tit vocal activity from PAM recordings.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help in [
+        ("index", "list the recordings on the data drive"),
+        ("features", "compute per-chunk audio features of the recordings"),
+        ("infer", "run BirdNET on new recordings"),
+        ("extract", "fold new detections into the derived tables"),
+        ("aggregate", "write daily_counts.csv and peak_days.csv"),
+        ("activity", "count detections by pnum, date and time of day"),
+        ("correlate", "correlate the daily activity of neighbouring nestboxes"),
+        ("plot", "write the sanity-check figures"),
+        ("run", "run every stage"),
+        ("enqueue", "list pending recordings as shards for several machines"),
+        ("work", "process shards until the queue is empty"),
+        ("merge", "merge the processed shards into the detections"),
+    ]:
+        subparsers.add_parser(name, parents=[common], help=help)
+
+    sample = argparse.ArgumentParser(add_help=False)
+    sample.add_argument("--sample", type=int, default=50, help="recordings sampled")
+    sample.add_argument("--seed", type=int, default=0, help="seed of the sample")
+    subparsers.add_parser("check-prefilter", parents=[common, sample], help="compare prefiltered and full inference")
+    compare = subparsers.add_parser(
+        "compare-backends", parents=[common, sample], help="throughput and agreement of model backends"
+    )
+    compare.add_argument("candidates", nargs="+", metavar="BACKEND[=MODEL]", help="e.g. tflite or tflite=int8.tflite")
+    quant = subparsers.add_parser("quantize", parents=[common, sample], help="make a smaller tflite model")
+    quant.add_argument("saved_model", type=Path, help="BirdNET-Analyzer's SavedModel directory")
+    quant.add_argument("--precision", choices=["float16", "int8"], default="float16", help="weight precision")
+    quant.add_argument("--calibration-chunks", type=int, default=500, help="chunks used to calibrate int8 activations")
+    quant.add_argument("--out", type=Path, default=None, help="output model (default: models/)")
+
+    pack = subparsers.add_parser("pack-json", help="pack per-recording JSON outputs into segment files, in place")
+    pack.add_argument(
+        "json_dir", type=Path, nargs="?", default=None, help="directory to pack (default: data/derived/json)"
+    )
+
+    bench = subparsers.add_parser("benchmark", help="time each stage on synthetic data")
+    bench.add_argument("--recordings", type=int, default=20, help="synthetic recordings")
+    bench.add_argument("--duration", type=float, default=60.0, help="seconds per recording")
+    bench.add_argument("--detections", type=int, default=100_000, help="synthetic detections (1k to 1M)")
+    bench.add_argument("--batch-size", type=int, default=64, help="chunks per model call")
+    bench.add_argument("--stages", nargs="+", default=None, help="stages to time (default: all)")
+    bench.add_argument("--results", type=Path, default=None, help="results file (default: benchmarks/results.jsonl)")
+    bench.add_argument("--tolerance", type=float, default=0.25, help="relative slowdown reported as a regression")
+    return parser
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    params = vars(args)
+    if args.command in COMMANDS:
+        result = COMMANDS[args.command](params)
+        print(json.dumps(result, default=str))
+        return 1 if result.get("regressions") else 0
+    targets = ["aggregate", "activity", "plot"] if args.command == "run" else [args.command]
+    report = make_pipeline().run(targets, params, with_deps=not args.only, force=args.force)
+    for name, outcome in report.items():
+        if outcome["ran"]:
+            print(f"{name}: {json.dumps(outcome['result'], default=str)} ({outcome['seconds']:.1f} s)")
+        else:
+            print(f"{name}: up to date")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
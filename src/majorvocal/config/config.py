@@ -1,16 +1,87 @@
+"""
+Project settings, resolved lazily.
+
+Nothing is computed or created when this module is imported: ``DATA_PATH``,
+``PROJECT_PATH`` and ``PROJECT_STRUCTURE`` are resolved the first time they are
+used, and folders are only created by code that writes to them (see
+``output``).
+
+``DATA_PATH`` is read, in order of precedence, from the ``MAJORVOCAL_DATA_PATH``
+environment variable, from ``data_path`` under ``[paths]`` in a TOML settings
+file (``MAJORVOCAL_SETTINGS``, or ``majorvocal.toml`` at the project root),
+or falls back to the drive used in the field seasons. ``PROJECT_PATH`` can be
+set with ``MAJORVOCAL_PROJECT_PATH``.
+"""
+import functools
+import os
 from pathlib import Path
+from typing import Union
+
+DEFAULT_DATA_PATH = Path("/media/nilomr/SONGDATA/wytham-great-tit/raw/")
+SETTINGS_FILE = "majorvocal.toml"
+
+
+class Settings:
+    """
+    Lazily resolved project paths. Each is computed on first access and then
+    cached.
+    """
+
+    @functools.cached_property
+    def project_path(self) -> Path:
+        if "MAJORVOCAL_PROJECT_PATH" in os.environ:
+            return Path(os.environ["MAJORVOCAL_PROJECT_PATH"])
+        return Path(__file__).resolve().parents[3]
+
+    @functools.cached_property
+    def settings_file(self) -> Path:
+        return Path(os.environ.get("MAJORVOCAL_SETTINGS", self.project_path / SETTINGS_FILE))
+
+    @functools.cached_property
+    def file_settings(self) -> dict:
+        if not self.settings_file.is_file():
+            return {}
+        try:
+            import tomllib
+        except ImportError:  # Python < 3.11
+            import tomli as tomllib
+        with open(self.settings_file, "rb") as f:
+            return tomllib.load(f)
+
+    @functools.cached_property
+    def data_path(self) -> Path:
+        if "MAJORVOCAL_DATA_PATH" in os.environ:
+            return Path(os.environ["MAJORVOCAL_DATA_PATH"])
+        if "data_path" in self.file_settings.get("paths", {}):
+            # Relative paths are relative to the settings file
+            return self.settings_file.parent / self.file_settings["paths"]["data_path"]
+        return DEFAULT_DATA_PATH
+
+    @functools.cached_property
+    def project_structure(self) -> dict[str, Path]:
+        return {
+            "metadata": self.project_path / "data" / "metadata",
+            "figures": self.project_path / "output" / "figures",
+            "derived_data": self.project_path / "data" / "derived",
+        }
+
+
+settings = Settings()
+
+_ATTRIBUTES = {"DATA_PATH": "data_path", "PROJECT_PATH": "project_path", "PROJECT_STRUCTURE": "project_structure"}
+
 
-# Paths
-DATA_PATH = Path("/media/nilomr/SONGDATA/wytham-great-tit/raw/")
-PROJECT_PATH = Path(__file__).resolve().parents[3]
+def __getattr__(name: str):
+    if name in _ATTRIBUTES:
+        return getattr(settings, _ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Project structure
-PROJECT_STRUCTURE = {
-    "metadata": PROJECT_PATH / "data" / "metadata",
-    "figures": PROJECT_PATH / "output" / "figures",
-    "derived_data": PROJECT_PATH / "data" / "derived",
-}
 
-# Create the project structure folders if they don't exist already:
-for folder in PROJECT_STRUCTURE.values():
-    folder.mkdir(parents=True, exist_ok=True)
+def output(path: Union[str, Path]) -> Path:
+    """
+    Creates the parent folder of an output file if needed, and returns the
+    path.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
@@ -0,0 +1,313 @@
+"""
+Storage of BirdNET detections.
+
+The canonical format is a Parquet dataset partitioned by year and pnum
+(``root/year=2020/pnum=20201EX26``) with one typed row per detection, and a
+row with null species, times and confidence for recordings without
+detections. A single nestbox or date range is read with predicate pushdown,
+touching only the matching partitions and row groups.
+
+The legacy ``detections.json`` holds one ``[timestamp, pnum, detections]``
+record per recording, either as a single JSON array or as newline-delimited
+JSON (NDJSON). Loading it with ``json.load`` builds every record before any
+filtering happens, so it is parsed incrementally and handed out in
+fixed-size batches of records instead; convert_json turns it (or a directory
+of per-recording JSON files) into the Parquet dataset once.
+"""
+import json
+import shutil
+import uuid
+from datetime import date
+from functools import reduce
+from itertools import islice
+from operator import and_
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from majorvocal.archive import iter_json_records
+from majorvocal.manifest import RunManifest
+
+_SEPARATORS = " \t\r\n,"
+
+SCHEMA = pa.schema(
+    [
+        ("timestamp", pa.string()),
+        ("date", pa.date32()),
+        ("start_time", pa.float32()),
+        ("end_time", pa.float32()),
+        ("scientific_name", pa.dictionary(pa.int32(), pa.string())),
+        ("common_name", pa.dictionary(pa.int32(), pa.string())),
+        ("confidence", pa.float32()),
+        ("year", pa.int16()),
+        ("pnum", pa.string()),
+    ]
+)
+PARTITIONING = ds.partitioning(pa.schema([("year", pa.int16()), ("pnum", pa.string())]), flavor="hive")
+
+
+def iter_records(path: Path, chunk_size: int = 2**20) -> Iterator[list]:
+    """
+    Yields the records of a detections file one at a time, reading it in
+    chunks of ``chunk_size`` characters. JSON arrays and NDJSON are both
+    accepted: a file is read as an array of records if it opens with ``[``
+    followed by another ``[`` (or is ``[]``).
+
+    Args:
+        path (Path): A JSON array of records, or one record per line.
+        chunk_size (int): Number of characters read at a time.
+
+    Raises:
+        json.JSONDecodeError: If the file is malformed or truncated.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buffer = ""
+        while not buffer.lstrip()[1:].strip():  # look past the opening bracket
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buffer += chunk
+        buffer = buffer.lstrip()
+        is_array = buffer.startswith("[") and buffer[1:].lstrip()[:1] in ("[", "]")
+        pos = 1 if is_array else 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in _SEPARATORS:
+                pos += 1
+            if pos < len(buffer) and is_array and buffer[pos] == "]":
+                return
+            try:
+                if pos == len(buffer):
+                    raise json.JSONDecodeError("Expecting value", buffer, pos)
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The next record straddles the end of the buffer
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    if pos == len(buffer) and not is_array:
+                        return
+                    raise
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield record
+
+
+def iter_batches(records: Iterable, batch_size: int = 100_000) -> Iterator[list]:
+    """
+    Groups ``records`` into lists of ``batch_size`` (the last one may be
+    shorter).
+    """
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        yield batch
+
+
+def read_batches(path: Path, batch_size: int = 100_000, chunk_size: int = 2**20) -> Iterator[list]:
+    """
+    Yields the records of a detections file in lists of ``batch_size``.
+    """
+    return iter_batches(iter_records(path, chunk_size), batch_size)
+
+
+class DetectionWriter:
+    """
+    Buffers ``[timestamp, pnum, detections]`` records and writes them to the
+    partitioned Parquet dataset. Use as a context manager, or call close().
+
+    BirdNET confidences are float32 to begin with, and chunk start and end
+    times are multiples of the chunk step, so storing them as float32 loses
+    nothing.
+
+    Args:
+        root (Path): Root directory of the dataset.
+        rows_per_file (int): Number of buffered rows that triggers a write.
+    """
+
+    def __init__(self, root: Path, rows_per_file: int = 1_000_000):
+        self.root = Path(root)
+        self.rows_per_file = rows_per_file
+        self._columns = {name: [] for name in SCHEMA.names}
+
+    def add(self, record: list) -> None:
+        """
+        Adds the detections of one recording.
+        """
+        timestamp, pnum, detections = record
+        day = date(int(timestamp[:4]), int(timestamp[4:6]), int(timestamp[6:8]))
+        columns = self._columns
+        for d in detections or [{}]:  # placeholder row
+            columns["timestamp"].append(timestamp)
+            columns["date"].append(day)
+            columns["start_time"].append(d.get("start_time"))
+            columns["end_time"].append(d.get("end_time"))
+            columns["scientific_name"].append(d.get("scientific_name"))
+            columns["common_name"].append(d.get("common_name"))
+            columns["confidence"].append(d.get("confidence"))
+            columns["year"].append(day.year)
+            columns["pnum"].append(pnum)
+        if len(columns["timestamp"]) >= self.rows_per_file:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes the buffered rows, one new file per (year, pnum) partition.
+        """
+        if not self._columns["timestamp"]:
+            return
+        arrays = []
+        for field in SCHEMA:
+            values = self._columns[field.name]
+            if pa.types.is_dictionary(field.type):
+                arrays.append(pa.array(values, pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, field.type))
+        ds.write_dataset(
+            pa.Table.from_arrays(arrays, schema=SCHEMA),
+            self.root,
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        self._columns = {name: [] for name in SCHEMA.names}
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "DetectionWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def write_detections(records: Iterable[list], root: Path, rows_per_file: int = 1_000_000) -> int:
+    """
+    Writes ``[timestamp, pnum, detections]`` records as a new dataset at
+    ``root``, replacing any previous one only once it is complete.
+
+    Returns:
+        int: Number of recordings written.
+    """
+    root = Path(root)
+    tmp = root.with_name(root.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    n = 0
+    with DetectionWriter(tmp, rows_per_file) as writer:
+        for record in records:
+            writer.add(record)
+            n += 1
+    old = root.with_name(root.name + ".old")
+    if root.exists():
+        root.rename(old)
+    tmp.rename(root)
+    shutil.rmtree(old, ignore_errors=True)
+    return n
+
+
+def sync_detections(manifest: RunManifest, root: Path) -> int:
+    """
+    Appends to the dataset at ``root`` the recordings finished in
+    ``manifest`` since the previous sync, as new Parquet files; existing
+    files are never rewritten. The time of the last recording synced is kept
+    in ``root/_synced.json``. Without it (e.g. the dataset was written by
+    convert_json), recordings already in the dataset are skipped.
+
+    Returns:
+        int: Number of recordings appended.
+    """
+    root = Path(root)
+    watermark = root / "_synced.json"
+    since = json.loads(watermark.read_text())["finished_at"] if watermark.exists() else None
+    until = manifest.last_finished()
+    root.mkdir(parents=True, exist_ok=True)
+    present = set()
+    if since is None:
+        table = ds.dataset(root, format="parquet", partitioning=PARTITIONING, schema=SCHEMA).to_table(
+            columns=["pnum", "timestamp"]
+        )
+        present = set(zip(table["pnum"].to_pylist(), table["timestamp"].to_pylist()))
+    n = 0
+    with DetectionWriter(root) as writer:
+        for record in manifest.iter_detections(since=since, until=until):
+            if (record[1], record[0]) in present:
+                continue
+            writer.add(record)
+            n += 1
+    # Left untouched when nothing finished, so stages reading ``root`` stay up to date
+    if until != since or not watermark.exists():
+        tmp = watermark.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"finished_at": until}))
+        tmp.replace(watermark)
+    return n
+
+
+def iter_json_dir(json_dir: Path) -> Iterator[list]:
+    """
+    Yields the records stored as per-recording ``<pnum>_<timestamp>.json``
+    files by earlier versions of inference, including those packed into a
+    majorvocal.archive.
+    """
+    return iter_json_records(json_dir)
+
+
+def convert_json(source: Path, root: Path) -> int:
+    """
+    Converts a JSON archive of detections, either a combined detections file
+    (array or NDJSON) or a directory of per-recording JSON files, into the
+    Parquet dataset at ``root``.
+
+    Returns:
+        int: Number of recordings converted.
+    """
+    source = Path(source)
+    records = iter_json_dir(source) if source.is_dir() else iter_records(source)
+    return write_detections(records, root)
+
+
+def read_detections(
+    root: Path,
+    pnums: Optional[Iterable[str]] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    species: Optional[Iterable[str]] = None,
+    min_conf: Optional[float] = None,
+    columns: Optional[list[str]] = None,
+) -> pa.Table:
+    """
+    Reads the detections dataset, pushing the filters down to the partitions
+    (pnum and year) and to the Parquet row groups (date, species,
+    confidence).
+
+    Args:
+        root (Path): Root directory of the dataset.
+        pnums (Iterable[str], optional): Only these nestbox-years.
+        start_date (date, optional): First date, inclusive.
+        end_date (date, optional): Last date, inclusive.
+        species (Iterable[str], optional): Only these scientific names;
+            placeholder rows are dropped.
+        min_conf (float, optional): Only detections with at least this
+            confidence; placeholder rows are dropped.
+        columns (list[str], optional): Columns to read; all by default.
+
+    Returns:
+        pa.Table: The matching rows.
+    """
+    dataset = ds.dataset(root, format="parquet", partitioning=PARTITIONING, schema=SCHEMA)
+    conditions = []
+    if pnums is not None:
+        conditions.append(ds.field("pnum").isin(list(pnums)))
+    if start_date is not None:
+        conditions += [ds.field("year") >= start_date.year, ds.field("date") >= start_date]
+    if end_date is not None:
+        conditions += [ds.field("year") <= end_date.year, ds.field("date") <= end_date]
+    if species is not None:
+        conditions.append(ds.field("scientific_name").isin(list(species)))
+    if min_conf is not None:
+        conditions.append(ds.field("confidence") >= min_conf)
+    condition = reduce(and_, conditions) if conditions else None
+    return dataset.to_table(columns=columns, filter=condition)
@@ -0,0 +1,205 @@
+"""
+Per-chunk acoustic features of every recording, computed once.
+
+For each 3-second chunk the index keeps its RMS level, its energy in the great
+tit band (2-8 kHz, mean and loudest frame) and its spectral flatness (near 1
+for noise such as rain, near 0 for tonal sounds such as song), plus the band
+noise floor of the whole recording. These are a few kilobytes per recording,
+so activity over the whole archive can be explored without decoding any audio,
+and inference can use them to skip quiet chunks (see majorvocal.prefilter)
+without measuring them again.
+
+The index is one Parquet file per pnum next to the recording index, with one
+row per recording and one list entry per chunk. Recordings are decoded in a
+process pool; a refresh only processes recordings that are new or whose mtime
+has changed.
+"""
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+import polars as pl
+
+from majorvocal.audio import CHUNK_SECONDS, SAMPLE_RATE, load_chunks
+from majorvocal.prefilter import band_mask, frame_power, summarize, to_db
+
+FEATURES = ("rms", "band_db", "peak_db", "flatness")
+SCHEMA = {
+    "path": pl.String,
+    "pnum": pl.String,
+    "date": pl.Date,
+    "time": pl.String,
+    "mtime": pl.Int64,
+    "floor_db": pl.Float32,
+    **{name: pl.List(pl.Float32) for name in FEATURES},
+}
+
+
+def chunk_features(chunks: np.ndarray, sr: int = SAMPLE_RATE) -> dict:
+    """
+    Computes the features of each chunk of a recording.
+
+    Args:
+        chunks (np.ndarray): Array of shape (n_chunks, n_samples).
+        sr (int): Sample rate.
+
+    Returns:
+        dict: ``rms``, ``band_db`` (mean 2-8 kHz level, dB), ``peak_db``
+        (loudest frame in the band, dB) and ``flatness`` arrays of one value
+        per chunk, and ``floor_db``, the recording's band noise floor.
+    """
+    n_chunks = len(chunks)
+    in_band = band_mask(sr)
+    band_db = np.zeros(n_chunks, dtype=np.float32)
+    flatness = np.zeros(n_chunks, dtype=np.float32)
+    levels = np.zeros((n_chunks, 0), dtype=np.float32)
+    for start, power in frame_power(chunks):
+        if start == 0:
+            levels = np.empty((n_chunks, power.shape[1]), dtype=np.float32)
+        band = power[..., in_band].sum(axis=-1)
+        levels[start : start + len(power)] = to_db(band)
+        band_db[start : start + len(power)] = to_db(band.mean(axis=1))
+        spectrum = power.mean(axis=1) + 1e-12
+        flatness[start : start + len(power)] = np.exp(np.log(spectrum).mean(axis=1)) / spectrum.mean(axis=1)
+    peak_db, floor_db = summarize(levels)
+    # einsum avoids a squared copy of the whole recording
+    rms = np.sqrt(np.einsum("ij,ij->i", chunks, chunks) / max(chunks.shape[1], 1)).astype(np.float32)
+    return {"rms": rms, "band_db": band_db, "peak_db": peak_db, "flatness": flatness, "floor_db": floor_db}
+
+
+def file_features(path: str) -> Optional[dict]:
+    """
+    Decodes a recording and computes its features, or returns None if it
+    cannot be decoded. Runs in the pool of FeatureIndex.refresh.
+    """
+    try:
+        chunks = load_chunks(Path(path))
+    except Exception:  # an unreadable recording is retried at the next refresh
+        return None
+    return chunk_features(chunks)
+
+
+class FeatureIndex:
+    """
+    Per-chunk features of the recordings, one Parquet file per pnum.
+
+    Args:
+        path (Path): Directory holding the feature files.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._levels_pnum = None
+        self._levels = {}
+
+    def _file(self, pnum: str) -> Path:
+        return self.path / f"{pnum}.parquet"
+
+    def pnums(self) -> list[str]:
+        return sorted(p.stem for p in self.path.glob("*.parquet"))
+
+    def read(self, pnums: Optional[Iterable[str]] = None) -> pl.DataFrame:
+        """
+        Returns one row per recording with its features, for ``pnums`` or
+        every pnum.
+        """
+        pnums = self.pnums() if pnums is None else pnums
+        frames = [pl.read_parquet(self._file(p)) for p in pnums if self._file(p).exists()]
+        return pl.concat(frames) if frames else pl.DataFrame(schema=SCHEMA)
+
+    def chunks(self, pnums: Optional[Iterable[str]] = None) -> pl.DataFrame:
+        """
+        Returns one row per chunk: the recording's path, pnum, date and time,
+        the chunk index and start (seconds into the recording), and its
+        features.
+        """
+        df = self.read(pnums).with_columns(chunk=pl.int_ranges(0, pl.col("rms").list.len(), dtype=pl.Int32))
+        df = df.explode(["chunk", *FEATURES])
+        return df.select(
+            "path", "pnum", "date", "time", "chunk", (pl.col("chunk") * CHUNK_SECONDS).alias("start"), *FEATURES
+        )
+
+    def refresh(
+        self,
+        recordings: pl.DataFrame,
+        n_workers: Optional[int] = None,
+        start_method: str = "spawn",
+        compute: Callable[[str], Optional[dict]] = file_features,
+    ) -> dict[str, int]:
+        """
+        Brings the index in line with ``recordings``: features are computed
+        for recordings that are new or whose mtime has changed, and dropped
+        for recordings that are no longer listed. Each pnum's file is written
+        as soon as its recordings are done, so an interrupted refresh keeps
+        its progress.
+
+        Args:
+            recordings (pl.DataFrame): Rows of majorvocal.index.RecordingIndex
+                (path, pnum, date, time and mtime).
+            n_workers (int, optional): Decoding processes; one per core by
+                default.
+            start_method (str): multiprocessing start method of the pool.
+            compute (Callable): Module-level function returning the features
+                of a recording given its path, or None if it cannot be read.
+
+        Returns:
+            dict[str, int]: Number of recordings computed, failed and removed,
+            and of recordings in the index.
+        """
+        recordings = recordings.select("path", "pnum", "date", "time", "mtime")
+        todo, removed, total = {}, 0, 0
+        for pnum in sorted(set(recordings["pnum"]) | set(self.pnums())):
+            listed, known = recordings.filter(pl.col("pnum") == pnum), self.read([pnum])
+            kept = known.join(listed, on=["path", "mtime"], how="semi")
+            new = listed.join(known, on=["path", "mtime"], how="anti")
+            removed += len(known.join(listed, on="path", how="anti"))
+            if len(new) or len(kept) < len(known):
+                todo[pnum] = (kept, new)
+            total += len(kept)
+
+        computed = failed = 0
+        paths = [p for _, new in todo.values() for p in new["path"]]
+        with contextlib.ExitStack() as stack:
+            results = iter(())
+            if paths:
+                context = multiprocessing.get_context(start_method)
+                executor = stack.enter_context(ProcessPoolExecutor(n_workers, mp_context=context))
+                results = executor.map(compute, paths, chunksize=4)
+            for pnum, (kept, new) in todo.items():
+                rows = []
+                for row, features in zip(new.iter_rows(named=True), results):
+                    if features is None:
+                        failed += 1
+                        continue
+                    rows.append({**row, **features})
+                computed += len(rows)
+                total += len(rows)
+                frame = pl.concat([kept, pl.DataFrame(rows, schema=SCHEMA)]) if rows else kept
+                self._write(pnum, frame.sort("date", "time"))
+        return {"computed": computed, "failed": failed, "removed": removed, "recordings": total}
+
+    def _write(self, pnum: str, frame: pl.DataFrame) -> None:
+        if frame.is_empty():
+            self._file(pnum).unlink(missing_ok=True)
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = self._file(pnum).with_suffix(".tmp")
+        frame.write_parquet(tmp)
+        tmp.replace(self._file(pnum))
+
+    def levels(self, file_path: Path) -> Optional[tuple[np.ndarray, float]]:
+        """
+        Returns the peak band level of each chunk of a recording and its noise
+        floor, or None if it is not in the index. A pnum's file is read once
+        and kept until a recording of another pnum is asked for, so callers
+        should go through the recordings in pnum order.
+        """
+        pnum = Path(file_path).parent.name
+        if pnum != self._levels_pnum:
+            rows = self.read([pnum]).select("path", "peak_db", "floor_db").iter_rows()
+            self._levels = {path: (np.asarray(peaks, dtype=np.float32), floor) for path, peaks, floor in rows}
+            self._levels_pnum = pnum
+        return self._levels.get(str(file_path))
@@ -1,24 +1,49 @@
-from matplotlib import pyplot as plt
-
-plt.rcParams.update(
-    {
-        "axes.facecolor": "#1d1d1d",
-        "figure.facecolor": "#1d1d1d",
-        "text.color": "white",
-        "axes.labelcolor": "white",
-        "xtick.color": "white",
-        "ytick.color": "white",
-        "axes.edgecolor": "white",
-        "axes.titlecolor": "white",
-        "axes.titlepad": 17,
-        "font.size": 15,
-        "xtick.labelsize": 13,
-        "ytick.labelsize": 13,
-    }
-)
-site_palette = [plt.get_cmap("Spectral", 7)(i) for i in range(7)]
+"""
+Plotting style and palettes.
+
+matplotlib is only imported, and its global style only changed, when
+set_style() is called or ``site_palette`` is first used.
+"""
+import functools
+
+STYLE = {
+    "axes.facecolor": "#1d1d1d",
+    "figure.facecolor": "#1d1d1d",
+    "text.color": "white",
+    "axes.labelcolor": "white",
+    "xtick.color": "white",
+    "ytick.color": "white",
+    "axes.edgecolor": "white",
+    "axes.titlecolor": "white",
+    "axes.titlepad": 17,
+    "font.size": 15,
+    "xtick.labelsize": 13,
+    "ytick.labelsize": 13,
+}
 cluster_palette = ["#ed6a5a", "#f4f1bb", "#9bc1bc"]
 cluster_palette_4 = ["#335c67", "#fff3b0", "#e09f3e", "#9e2a2b"]
 
 figwidth = 8
 textsize = 15
+
+
+def set_style() -> None:
+    """
+    Applies the project's dark plotting style to matplotlib.
+    """
+    from matplotlib import pyplot as plt
+
+    plt.rcParams.update(STYLE)
+
+
+@functools.lru_cache(maxsize=None)
+def _site_palette() -> list:
+    from matplotlib import pyplot as plt
+
+    return [plt.get_cmap("Spectral", 7)(i) for i in range(7)]
+
+
+def __getattr__(name: str):
+    if name == "site_palette":
+        return _site_palette()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,186 @@
+"""
+Index of the raw recordings on the data drive.
+
+Recordings live in ``DATA_PATH/GRETI_<year>/<pnum>/<YYYYMMDD_HHMMSS>.WAV``.
+Listing them with repeated globs on a network mount takes minutes, so the
+index crawls the tree once with ``os.scandir`` (one thread per nestbox
+directory) and keeps path, pnum, date, time, size and mtime in a local
+Parquet table. Later refreshes only rescan nestbox directories whose mtime has
+changed, i.e. those in which recordings were added, removed or renamed.
+Selections by pnum, date range and time of day are then vectorised queries.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Iterable, Optional
+
+import polars as pl
+
+SCHEMA = {
+    "path": pl.String,
+    "site": pl.String,
+    "pnum": pl.String,
+    "date": pl.Date,
+    "time": pl.String,
+    "size": pl.Int64,
+    "mtime": pl.Int64,
+}
+DIR_SCHEMA = {"dir": pl.String, "mtime": pl.Int64}
+
+
+def scan_dir(directory: str) -> list[tuple]:
+    """
+    Lists the recordings in one nestbox directory.
+
+    Args:
+        directory (str): Path to ``GRETI_<year>/<pnum>``.
+
+    Returns:
+        list[tuple]: ``(path, site, pnum, stem, size, mtime_ns)`` for each WAV.
+    """
+    pnum = os.path.basename(directory)
+    site = os.path.basename(os.path.dirname(directory))
+    rows = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(".WAV") and entry.is_file():
+                stat = entry.stat()
+                rows.append((entry.path, site, pnum, entry.name[:-4], stat.st_size, stat.st_mtime_ns))
+    return rows
+
+
+def _rows_to_frame(rows: list[tuple]) -> pl.DataFrame:
+    df = pl.DataFrame(
+        rows,
+        schema={
+            "path": pl.String,
+            "site": pl.String,
+            "pnum": pl.String,
+            "stem": pl.String,
+            "size": pl.Int64,
+            "mtime": pl.Int64,
+        },
+        orient="row",
+    )
+    df = df.filter(pl.col("stem").str.contains(r"^\d{8}_\d{6}$"))
+    return df.select(
+        "path",
+        "site",
+        "pnum",
+        pl.col("stem").str.slice(0, 8).str.strptime(pl.Date, "%Y%m%d").alias("date"),
+        pl.col("stem").str.slice(9, 6).alias("time"),
+        "size",
+        "mtime",
+    ).cast(SCHEMA)
+
+
+class RecordingIndex:
+    """
+    Persistent table of recordings, refreshed incrementally.
+
+    Args:
+        path (Path): Directory holding the index tables.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._files_path = self.path / "recordings.parquet"
+        self._dirs_path = self.path / "directories.parquet"
+        if self._files_path.exists():
+            self.files = pl.read_parquet(self._files_path)
+            self.dirs = pl.read_parquet(self._dirs_path)
+        else:
+            self.files = pl.DataFrame(schema=SCHEMA)
+            self.dirs = pl.DataFrame(schema=DIR_SCHEMA)
+
+    def refresh(self, data_path: Path, pattern: str = "GRETI_20*", n_threads: int = 16) -> dict[str, int]:
+        """
+        Brings the index up to date with ``data_path``, rescanning only
+        nestbox directories that are new or have changed since the last
+        refresh, and dropping those that have disappeared. The index files
+        are only rewritten if something changed.
+
+        Args:
+            data_path (Path): Root of the raw recordings.
+            pattern (str): Glob pattern of the season directories to index.
+            n_threads (int): Number of directories scanned in parallel.
+
+        Returns:
+            dict[str, int]: Number of directories rescanned and removed, and
+            of recordings in the index.
+        """
+        current = {}
+        with os.scandir(data_path) as seasons:
+            for season in seasons:
+                if not (fnmatch(season.name, pattern) and season.is_dir()):
+                    continue
+                with os.scandir(season.path) as nestboxes:
+                    for nestbox in nestboxes:
+                        if nestbox.is_dir():
+                            current[nestbox.path] = nestbox.stat().st_mtime_ns
+
+        known = dict(self.dirs.iter_rows())
+        changed = [d for d, mtime in current.items() if known.get(d) != mtime]
+        removed = [d for d in known if d not in current]
+
+        with ThreadPoolExecutor(n_threads) as executor:
+            rows = [row for dir_rows in executor.map(scan_dir, changed) for row in dir_rows]
+
+        if not (changed or removed) and self._files_path.exists():
+            return {"rescanned": 0, "removed": 0, "recordings": len(self.files)}
+
+        stale = changed + removed
+        dir_of = pl.col("path").str.replace(r"/[^/]*$", "")
+        self.files = (
+            pl.concat([self.files.filter(~dir_of.is_in(stale)), _rows_to_frame(rows)])
+            .sort("pnum", "date", "time")
+        )
+        self.dirs = pl.DataFrame(list(current.items()), schema=DIR_SCHEMA, orient="row")
+        self.save()
+        return {"rescanned": len(changed), "removed": len(removed), "recordings": len(self.files)}
+
+    def save(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.files.write_parquet(self._files_path)
+        self.dirs.write_parquet(self._dirs_path)
+
+    def select(
+        self,
+        pnums: Optional[Iterable[str]] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        time_window: Optional[tuple[str, str]] = None,
+        min_size: int = 0,
+    ) -> pl.DataFrame:
+        """
+        Selects recordings with a single vectorised filter.
+
+        Args:
+            pnums (Iterable[str], optional): Only these nestbox-years.
+            start_date (date, optional): First date, inclusive.
+            end_date (date, optional): Last date, inclusive.
+            time_window (tuple[str, str], optional): ``(start, end)`` times
+                of day as ``HHMMSS``, both exclusive.
+            min_size (int): Minimum file size in bytes.
+
+        Returns:
+            pl.DataFrame: The matching rows of the index.
+        """
+        condition = pl.col("size") >= min_size
+        if pnums is not None:
+            condition &= pl.col("pnum").is_in(list(pnums))
+        if start_date is not None:
+            condition &= pl.col("date") >= start_date
+        if end_date is not None:
+            condition &= pl.col("date") <= end_date
+        if time_window is not None:
+            condition &= (pl.col("time") > time_window[0]) & (pl.col("time") < time_window[1])
+        return self.files.filter(condition)
+
+    def paths(self, **kwargs) -> list[Path]:
+        """
+        Returns the paths of the recordings selected by ``select(**kwargs)``.
+        """
+        return [Path(p) for p in self.select(**kwargs)["path"]]
@@ -0,0 +1,797 @@
+"""
+BirdNET inference over a pool of worker processes.
+
+Each worker loads the model exactly once, in the pool initializer, and keeps it
+in a module-level global for the lifetime of the process. Nothing is inherited
+from the parent process, so the pool behaves the same under the ``spawn``,
+``forkserver`` and ``fork`` start methods.
+"""
+import calendar
+import collections
+import contextlib
+import functools
+import json
+import math
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.util
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional
+
+import numpy as np
+
+from majorvocal.audio import CHUNK_SAMPLES, CHUNK_SECONDS, load_chunks
+from majorvocal.cache import ChunkCache
+from majorvocal.manifest import file_record
+from majorvocal.metrics import Stopwatch, rss_bytes, start_profiler
+
+if TYPE_CHECKING:
+    from majorvocal.scores import ScoreWriter
+
+# Wytham Woods, used by BirdNET to restrict the species list
+LATITUDE = 51.775036
+LONGITUDE = -1.336488
+MIN_CONF = 0.8
+MODEL_VERSION = "2.4"
+LOCATION_FILTER_THRESHOLD = 0.03
+BATCH_SIZE = 64
+MIN_FILE_SIZE = 1000  # bytes; smaller recordings are headers only
+
+# Per-process state, set by init_worker
+_analyzer = None
+_log = None
+_profiler = None
+
+
+def set_num_threads(n_threads: int) -> None:
+    """
+    Limits the number of threads used by the numerical libraries in this
+    process. Must be called before TensorFlow is first imported.
+
+    Args:
+        n_threads (int): Number of intra-op threads.
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+        os.environ[var] = str(n_threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+
+
+def load_analyzer(version: str = MODEL_VERSION, n_threads: int = 1):
+    """
+    Loads the BirdNET analyzer. birdnetlib always builds its TFLite interpreter
+    with a single thread, so the interpreter is rebuilt if more are requested.
+
+    Args:
+        version (str): BirdNET model version.
+        n_threads (int): Number of threads used by the TFLite interpreter.
+
+    Returns:
+        birdnetlib.analyzer.Analyzer: The loaded analyzer.
+    """
+    from birdnetlib.analyzer import Analyzer, tflite
+
+    analyzer = Analyzer(version=version)
+    if n_threads != 1:
+        analyzer.interpreter = tflite.Interpreter(model_path=analyzer.model_path, num_threads=n_threads)
+        analyzer.interpreter.allocate_tensors()
+        analyzer.input_details = analyzer.interpreter.get_input_details()
+        analyzer.output_details = analyzer.interpreter.get_output_details()
+        analyzer.input_layer_index = analyzer.input_details[0]["index"]
+        analyzer.output_layer_index = analyzer.output_details[0]["index"]
+    return analyzer
+
+
+def init_worker(
+    analyzer_factory: Callable = load_analyzer,
+    version: str = MODEL_VERSION,
+    n_threads: int = 1,
+    log_file: Optional[Path] = None,
+    profile: Optional[str] = None,
+    profile_dir: Optional[Path] = None,
+) -> None:
+    """
+    Pool initializer: loads the model once per worker process.
+
+    Args:
+        analyzer_factory (Callable): Module-level function returning an
+            analyzer, called as ``analyzer_factory(version=..., n_threads=...)``.
+        version (str): Model version passed to the factory.
+        n_threads (int): Intra-op threads per worker.
+        log_file (Path, optional): File that receives the worker's stdout
+            (birdnetlib prints progress for every file). Discarded if None.
+        profile (str, optional): Profile the worker, with "cprofile" or
+            "sample" (see majorvocal.metrics.start_profiler). The profile is
+            written to ``profile_dir`` after every group of files and when the
+            worker exits.
+        profile_dir (Path, optional): Folder for the profiles.
+    """
+    global _analyzer, _log, _profiler
+    set_num_threads(n_threads)
+    _log = open(log_file, "a", buffering=1) if log_file else open(os.devnull, "w")
+    if profile:
+        _profiler = start_profiler(profile, profile_dir)
+        multiprocessing.util.Finalize(None, _profiler.stop, exitpriority=10)
+    with contextlib.redirect_stdout(_log):
+        _analyzer = analyzer_factory(version=version, n_threads=n_threads)
+
+
+def get_analyzer():
+    """
+    Returns the analyzer loaded by init_worker in this process.
+
+    Raises:
+        RuntimeError: If called outside an initialised worker.
+    """
+    if _analyzer is None:
+        raise RuntimeError("No analyzer loaded in this process; run it through init_worker.")
+    return _analyzer
+
+
+def analyze_file(file_path: Path, min_conf: float = MIN_CONF) -> list[dict]:
+    """
+    Runs the worker's analyzer on a single recording.
+
+    Args:
+        file_path (Path): Path to a WAV file named ``YYYYMMDD_HHMMSS.WAV``.
+        min_conf (float): Minimum confidence for a detection to be kept.
+
+    Returns:
+        list[dict]: The detections, as returned by birdnetlib.
+    """
+    from birdnetlib import Recording
+
+    recording = Recording(
+        get_analyzer(),
+        str(file_path),
+        lat=LATITUDE,
+        lon=LONGITUDE,
+        date=recording_date(file_path),
+        min_conf=min_conf,
+    )
+    with contextlib.redirect_stdout(_log):
+        recording.analyze()
+    return recording.detections
+
+
+def process_file(file_path: Path, json_dir: Path, min_conf: float = MIN_CONF) -> Optional[list]:
+    """
+    Analyzes a single file and saves its detections to a JSON file in
+    ``json_dir``, or to the archive there once the directory is packed (see
+    majorvocal.archive). Files that have already been processed, or that are
+    too small to contain audio, are skipped.
+
+    Args:
+        file_path (Path): The path to the file to be processed.
+        json_dir (Path): Output directory for the per-file JSON files.
+        min_conf (float): Minimum confidence for a detection to be kept.
+
+    Returns:
+        Optional[list]: ``[timestamp, pnum, detections]``, or None if the file
+        was skipped.
+    """
+    if _saved(json_dir, file_path):
+        return None
+    if too_small(file_path):
+        return None
+
+    detections = analyze_file(file_path, min_conf=min_conf)
+    _save_json(json_dir, file_path, detections)
+    return [file_path.stem, file_path.parent.name, detections]
+
+
+def run_inference(
+    file_paths: Iterable[Path],
+    task: Callable = process_file,
+    n_workers: Optional[int] = None,
+    n_threads: int = 1,
+    start_method: str = "spawn",
+    analyzer_factory: Callable = load_analyzer,
+    version: str = MODEL_VERSION,
+    log_file: Optional[Path] = None,
+    chunksize: int = 1,
+    profile: Optional[str] = None,
+    profile_dir: Optional[Path] = None,
+    **task_kwargs,
+) -> Iterator:
+    """
+    Maps ``task`` over ``file_paths`` in a pool of model-holding workers and
+    yields the results in completion order.
+
+    Args:
+        file_paths (Iterable[Path]): Recordings to process.
+        task (Callable): Module-level function called as
+            ``task(file_path, **task_kwargs)`` inside a worker.
+        n_workers (int, optional): Number of worker processes. Defaults to
+            as many as fit in the available cores with ``n_threads`` each.
+        n_threads (int): Intra-op threads per worker.
+        start_method (str): multiprocessing start method ("spawn",
+            "forkserver" or "fork").
+        analyzer_factory (Callable): Module-level function that loads the model.
+        version (str): Model version passed to ``analyzer_factory``.
+        log_file (Path, optional): File that receives the workers' stdout.
+        chunksize (int): Number of files sent to a worker at a time.
+        profile (str, optional): Profile each worker with "cprofile" or
+            "sample"; see init_worker.
+        profile_dir (Path, optional): Folder for the profiles.
+        **task_kwargs: Extra keyword arguments passed to ``task``.
+
+    Yields:
+        The return value of ``task`` for each file.
+    """
+    with worker_pool(
+        n_workers, n_threads, start_method, analyzer_factory, version, log_file, profile, profile_dir
+    ) as pool:
+        yield from pool.imap_unordered(functools.partial(task, **task_kwargs), file_paths, chunksize=chunksize)
+
+
+@contextlib.contextmanager
+def worker_pool(
+    n_workers: Optional[int] = None,
+    n_threads: int = 1,
+    start_method: str = "spawn",
+    analyzer_factory: Callable = load_analyzer,
+    version: str = MODEL_VERSION,
+    log_file: Optional[Path] = None,
+    profile: Optional[str] = None,
+    profile_dir: Optional[Path] = None,
+) -> Iterator[multiprocessing.pool.Pool]:
+    """
+    Pool of model-holding workers that can be reused for several maps, e.g.
+    for every shard a node claims (see majorvocal.shards). The arguments are
+    those of run_inference. The workers are shut down cleanly (so their
+    profiles are written) unless an exception is raised.
+    """
+    if n_workers is None:
+        n_workers = max(1, (os.cpu_count() or 1) // n_threads)
+    ctx = multiprocessing.get_context(start_method)
+    with ctx.Pool(
+        processes=n_workers,
+        initializer=init_worker,
+        initargs=(analyzer_factory, version, n_threads, log_file, profile, profile_dir),
+    ) as pool:
+        yield pool
+        pool.close()
+        pool.join()
+
+
+def week_48(date: datetime) -> int:
+    """
+    Converts a date to the 48-week year used by BirdNET's species list model.
+    """
+    day_of_year = date.timetuple().tm_yday
+    days_in_year = 366 if calendar.isleap(date.year) else 365
+    return math.ceil((day_of_year / days_in_year) * 48)
+
+
+def species_list(analyzer, date: datetime) -> frozenset:
+    """
+    Returns the species expected at Wytham on ``date``, cached on the analyzer
+    by week. An empty set means no location filter is applied.
+
+    Args:
+        analyzer: The loaded analyzer.
+        date (datetime): Recording date.
+
+    Returns:
+        frozenset: Labels (``"Scientific name_Common name"``) of allowed species.
+    """
+    week = week_48(date)
+    cache = analyzer.__dict__.setdefault("_majorvocal_species", {})
+    if week not in cache:
+        with contextlib.redirect_stdout(_log):
+            cache[week] = frozenset(
+                analyzer.return_predicted_species_list(
+                    lon=LONGITUDE, lat=LATITUDE, week_48=week, filter_threshold=LOCATION_FILTER_THRESHOLD
+                )
+            )
+    return cache[week]
+
+
+def predict_batch(analyzer, batch: np.ndarray, sensitivity: float = 1.0) -> np.ndarray:
+    """
+    Runs the model on a batch of chunks in a single interpreter call. Tensors
+    are only reallocated when the batch shape changes, so callers should pass
+    fixed-size batches.
+
+    Args:
+        analyzer: The loaded analyzer, or any object with a ``predict_batch``
+            method returning sigmoid scores.
+        batch (np.ndarray): Array of shape (batch_size, 144000).
+        sensitivity (float): BirdNET detection sensitivity.
+
+    Returns:
+        np.ndarray: Scores of shape (batch_size, n_labels).
+    """
+    if hasattr(analyzer, "predict_batch"):
+        return analyzer.predict_batch(batch)
+
+    interpreter = analyzer.interpreter
+    if getattr(analyzer, "_majorvocal_batch_shape", None) != batch.shape:
+        interpreter.resize_tensor_input(analyzer.input_layer_index, list(batch.shape))
+        interpreter.allocate_tensors()
+        analyzer._majorvocal_batch_shape = batch.shape
+    interpreter.set_tensor(analyzer.input_layer_index, batch)
+    interpreter.invoke()
+    prediction = interpreter.get_tensor(analyzer.output_layer_index)
+    return analyzer.flat_sigmoid(np.array(prediction), sensitivity=-sensitivity)
+
+
+def scores_to_detections(
+    scores: np.ndarray, labels: list[str], start_time: float, allowed: frozenset, min_conf: float = MIN_CONF
+) -> list[dict]:
+    """
+    Converts the scores of one chunk to detections, with the same filtering,
+    ordering and fields as birdnetlib's ``Recording.detections``.
+
+    Args:
+        scores (np.ndarray): Scores of shape (n_labels,).
+        labels (list[str]): Model labels.
+        start_time (float): Start of the chunk in seconds.
+        allowed (frozenset): Allowed labels; empty to keep all species.
+        min_conf (float): Minimum confidence for a detection to be kept.
+
+    Returns:
+        list[dict]: Detections in decreasing order of confidence.
+    """
+    min_conf = max(0.01, min(min_conf, 0.99))
+    candidates = np.flatnonzero(scores > min_conf)
+    candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+    detections = []
+    for i in candidates:
+        label = labels[i]
+        if allowed and label not in allowed:
+            continue
+        scientific_name, common_name = label.split("_")[:2]
+        detections.append(
+            {
+                "common_name": common_name,
+                "scientific_name": scientific_name,
+                "start_time": float(start_time),
+                "end_time": float(start_time + CHUNK_SECONDS),
+                "confidence": float(scores[i]),
+                "label": label,
+            }
+        )
+    return detections
+
+
+def iter_batches(items: Iterable[tuple], batch_size: int = BATCH_SIZE) -> Iterator[tuple[np.ndarray, list]]:
+    """
+    Packs the chunks of many recordings into fixed-size batches. The last
+    batch is zero-padded. The same array is reused for every batch, so it must
+    be consumed before the next one is requested.
+
+    Args:
+        items (Iterable[tuple]): ``(key, chunks)`` pairs, where ``chunks`` has
+            shape (n_chunks, 144000).
+        batch_size (int): Number of chunks per batch.
+
+    Yields:
+        tuple[np.ndarray, list]: The batch and a list of ``(key, chunk_index)``
+        for each filled row.
+    """
+    batch = np.zeros((batch_size, CHUNK_SAMPLES), dtype=np.float32)
+    owners = []
+    for key, chunks in items:
+        for i, chunk in enumerate(chunks):
+            batch[len(owners)] = chunk
+            owners.append((key, i))
+            if len(owners) == batch_size:
+                yield batch, owners
+                owners = []
+    if owners:
+        batch[len(owners) :] = 0
+        yield batch, owners
+
+
+def _select(chunks, rows: np.ndarray):
+    """
+    Returns the rows of ``chunks`` without copying them all at once: lazily
+    read chunks (majorvocal.wav.WavChunks) stay lazy, arrays are read a row
+    at a time as they are batched.
+    """
+    if hasattr(chunks, "subset"):
+        return chunks.subset(rows)
+    return (chunks[i] for i in rows)
+
+
+def predict_scores(
+    analyzer, items: Iterable[tuple], batch_size: int = BATCH_SIZE, prefilter: Optional[Callable] = None
+) -> Iterator[tuple[Path, np.ndarray]]:
+    """
+    Runs batched inference over the chunks of many recordings and maps the
+    scores back to each file.
+
+    Args:
+        analyzer: The loaded analyzer.
+        items (Iterable[tuple]): ``(file_path, chunks)`` pairs, in order.
+        batch_size (int): Number of chunks per model call.
+        prefilter (Callable, optional): Called as ``prefilter(file_path,
+            chunks)``, returns a boolean mask of the chunks to run the model
+            on (see majorvocal.prefilter). The others score zero.
+
+    Yields:
+        tuple[Path, np.ndarray]: Each file and its scores, of shape
+        (n_chunks, n_labels), in input order.
+    """
+    pending = {}  # file_path -> [chunks to score, scored chunks, scores, index of the scored chunks]
+
+    def counted(items):
+        for file_path, chunks in items:
+            scores = np.zeros((len(chunks), len(analyzer.labels)), dtype=np.float32)
+            if prefilter is None:
+                pending[file_path] = [len(chunks), 0, scores, None]
+                yield file_path, chunks
+            else:
+                kept = np.flatnonzero(prefilter(file_path, chunks))
+                pending[file_path] = [len(kept), 0, scores, kept]
+                yield file_path, _select(chunks, kept)
+
+    def completed():
+        while pending:
+            file_path, (n_chunks, n_scored, scores, _) = next(iter(pending.items()))
+            if n_scored < n_chunks:
+                return
+            del pending[file_path]
+            yield file_path, scores
+
+    for batch, owners in iter_batches(counted(items), batch_size):
+        scores = predict_batch(analyzer, batch)
+        for row, (file_path, i) in enumerate(owners):
+            entry = pending[file_path]
+            entry[2][i if entry[3] is None else entry[3][i]] = scores[row]
+            entry[1] += 1
+        yield from completed()
+    yield from completed()
+
+
+def recording_date(file_path: Path) -> datetime:
+    """
+    Returns the date of a recording named ``YYYYMMDD_HHMMSS``.
+    """
+    return datetime.strptime(file_path.stem.split("_")[0], "%Y%m%d")
+
+
+def predict_files(
+    analyzer,
+    items: Iterable[tuple],
+    batch_size: int = BATCH_SIZE,
+    min_conf: float = MIN_CONF,
+    overlap: float = 0.0,
+    score_writer: Optional["ScoreWriter"] = None,
+    prefilter: Optional[Callable] = None,
+) -> Iterator[tuple[Path, list[dict]]]:
+    """
+    Runs batched inference over the chunks of many recordings and converts
+    the scores of each file to detections.
+
+    Args:
+        analyzer: The loaded analyzer.
+        items (Iterable[tuple]): ``(file_path, chunks)`` pairs, in order.
+        batch_size (int): Number of chunks per model call.
+        min_conf (float): Minimum confidence for a detection to be kept.
+        overlap (float): Overlap used when the chunks were split, in seconds.
+        score_writer (ScoreWriter, optional): Also stores the raw scores of
+            every chunk, so other thresholds can be applied later.
+        prefilter (Callable, optional): Selects the chunks the model is run
+            on; see predict_scores.
+
+    Yields:
+        tuple[Path, list[dict]]: Each file and its detections, in input order.
+    """
+    for file_path, scores in predict_scores(analyzer, items, batch_size, prefilter):
+        allowed = species_list(analyzer, recording_date(file_path))
+        if score_writer is not None:
+            score_writer.add(file_path, scores, allowed, overlap)
+        detections = [
+            d
+            for i, chunk_scores in enumerate(scores)
+            for d in scores_to_detections(
+                chunk_scores, analyzer.labels, i * (CHUNK_SECONDS - overlap), allowed, min_conf
+            )
+        ]
+        yield file_path, detections
+
+
+@functools.lru_cache(maxsize=None)
+def _chunk_cache(cache_dir: Path, max_bytes: int) -> ChunkCache:
+    return ChunkCache(cache_dir, max_bytes)
+
+
+def _score_writer(scores_dir: Optional[Path], labels: list[str]) -> contextlib.AbstractContextManager:
+    if not scores_dir:
+        return contextlib.nullcontext()
+    from majorvocal.scores import ScoreWriter  # pyarrow is only imported when scores are stored
+
+    return ScoreWriter(scores_dir, labels)
+
+
+def too_small(file_path: Path) -> bool:
+    """
+    Whether a recording is too small to contain any audio.
+    """
+    return file_path.stat().st_size < MIN_FILE_SIZE
+
+
+@functools.lru_cache(maxsize=None)
+def _archive(json_dir: Path):
+    from majorvocal.archive import DetectionArchive
+
+    return DetectionArchive(json_dir)
+
+
+@functools.lru_cache(maxsize=None)
+def _archive_writer(json_dir: Path):
+    from majorvocal.archive import ArchiveWriter
+
+    # One segment per worker process, reopened for the next files
+    return ArchiveWriter(json_dir)
+
+
+def _saved(json_dir: Path, file_path: Path) -> bool:
+    from majorvocal.archive import is_archive
+
+    if Path(json_dir, f"{file_path.parent.name}_{file_path.stem}.json").exists():
+        return True
+    if not is_archive(json_dir):
+        return False
+    # Other workers append to the archive while this one runs
+    archive = _archive(Path(json_dir))
+    archive.refresh()
+    return (file_path.parent.name, file_path.stem) in archive
+
+
+def _save_json(json_dir: Optional[Path], file_path: Path, detections: list[dict]) -> None:
+    from majorvocal.archive import is_archive
+
+    if json_dir is None:
+        return
+    if is_archive(json_dir):
+        writer = _archive_writer(Path(json_dir))
+        writer.add([file_path.stem, file_path.parent.name, detections])
+        writer.close()
+        return
+    with open(Path(json_dir, f"{file_path.parent.name}_{file_path.stem}.json"), "w") as f:
+        json.dump(detections, f)
+
+
+def process_files(
+    file_paths: list[Path],
+    json_dir: Optional[Path] = None,
+    batch_size: int = BATCH_SIZE,
+    min_conf: float = MIN_CONF,
+    cache_dir: Optional[Path] = None,
+    cache_bytes: int = 100 * 2**30,
+    scores_dir: Optional[Path] = None,
+    prefilter_db: Optional[float] = None,
+    features_dir: Optional[Path] = None,
+    reader: str = "librosa",
+) -> list[dict]:
+    """
+    Batched counterpart of process_file: decodes a group of recordings and
+    runs the model over fixed-size batches that span file boundaries. A
+    recording that is too small or cannot be decoded is reported rather than
+    aborting the group.
+
+    Args:
+        file_paths (list[Path]): The recordings in this group.
+        json_dir (Path, optional): If given, each file's detections are also
+            saved there as a JSON file, or appended to its archive once it
+            is packed (see majorvocal.archive).
+        batch_size (int): Number of chunks per model call.
+        min_conf (float): Minimum confidence for a detection to be kept.
+        cache_dir (Path, optional): ChunkCache directory. Recordings cached
+            by the same ``reader`` are memory-mapped instead of decoded, and
+            new ones are added.
+        cache_bytes (int): Size cap of the cache.
+        scores_dir (Path, optional): If given, the top species scores of every
+            chunk are also stored there (see majorvocal.scores).
+        prefilter_db (float, optional): Only run the model on chunks whose
+            great tit band energy peaks this many dB above the recording's
+            noise floor (see majorvocal.prefilter).
+        features_dir (Path, optional): majorvocal.features.FeatureIndex whose
+            band levels are used by the prefilter instead of measuring the
+            chunks again.
+        reader (str): "librosa" decodes each recording in full; "mmap"
+            memory-maps it and resamples its windows as the model needs them
+            (see majorvocal.wav), so memory does not grow with the length of
+            the recordings. The two resample differently.
+
+    Returns:
+        list[dict]: A majorvocal.manifest record for each file, in input
+        order, with the number of chunks (``chunks``) and of those the model
+        was run on (``analysed``), the worker's pid and memory use (``rss``, bytes) and the
+        time spent on the file by stage (``timings``: stat, decode,
+        resample, inference and write; see majorvocal.metrics). Inference
+        time is the file's share of the model time, by chunks analysed,
+        and processing time (``elapsed``) is the sum of the stages.
+    """
+    analyzer = get_analyzer()
+    cache = _chunk_cache(Path(cache_dir), cache_bytes) if cache_dir else None
+    prefilter = _prefilter(prefilter_db, features_dir)
+    loader = _loader(reader)
+    records, stopwatches, n_chunks = {}, {}, {}
+
+    def items():
+        for file_path in file_paths:
+            stopwatch = stopwatches[file_path] = Stopwatch()
+            try:
+                with stopwatch("stat"):
+                    small = too_small(file_path)
+                if small:
+                    records[file_path] = file_record(file_path, "skipped")
+                    continue
+                start = time.perf_counter()
+                load = functools.partial(loader, stopwatch=stopwatch)
+                chunks = cache.get_or_load(file_path, load=load, reader=reader) if cache else load(file_path)
+                # Reading from the cache and splitting into chunks count as decoding
+                timed = sum(stopwatch.timings.get(k, 0.0) for k in ("decode", "resample"))
+                stopwatch.add("decode", time.perf_counter() - start - timed)
+            except Exception as e:  # one unreadable recording must not stop the others
+                records[file_path] = file_record(file_path, "failed", error=f"{type(e).__name__}: {e}")
+                continue
+            n_chunks[file_path] = len(chunks)
+            yield file_path, chunks
+
+    start = time.perf_counter()
+    with _score_writer(scores_dir, analyzer.labels) as writer:
+        if writer is not None:
+            writer = _TimedWriter(writer, stopwatches)
+        results = predict_files(analyzer, items(), batch_size, min_conf, score_writer=writer, prefilter=prefilter)
+        for file_path, detections in results:
+            with stopwatches[file_path]("write"):
+                _save_json(json_dir, file_path, detections)
+            n = n_chunks[file_path]
+            record = file_record(file_path, "done", duration=n * CHUNK_SECONDS, detections=detections)
+            record.update(chunks=n, analysed=_analysed(prefilter, file_path, n))
+            records[file_path] = record
+    timed = sum(seconds for stopwatch in stopwatches.values() for seconds in stopwatch.timings.values())
+    model_time = time.perf_counter() - start - timed
+    analysed = {f: r["analysed"] for f, r in records.items() if "analysed" in r}
+    total_chunks = max(1, sum(analysed.values()))
+    pid, rss = os.getpid(), rss_bytes()
+    for file_path, stopwatch in stopwatches.items():
+        if file_path in analysed:
+            stopwatch.add("inference", model_time * analysed[file_path] / total_chunks)
+        record = records[file_path]
+        record.update(timings=stopwatch.timings, pid=pid, rss=rss)
+        if record["status"] == "done":
+            record["elapsed"] = sum(stopwatch.timings.values())
+    if _profiler is not None:
+        _profiler.dump()
+    return [records[f] for f in file_paths]
+
+
+def _loader(reader: str) -> Callable[..., np.ndarray]:
+    if reader == "mmap":
+        from majorvocal.wav import open_chunks
+
+        return open_chunks
+    if reader == "librosa":
+        return load_chunks
+    raise ValueError(f"Unknown reader {reader!r}; expected 'librosa' or 'mmap'")
+
+
+def _prefilter(margin_db: Optional[float], features_dir: Optional[Path] = None):
+    if margin_db is None:
+        return None
+    from majorvocal.prefilter import Prefilter
+
+    levels = _feature_index(Path(features_dir)).levels if features_dir else None
+    return Prefilter(margin_db, levels=levels)
+
+
+@functools.lru_cache(maxsize=None)
+def _feature_index(features_dir: Path):
+    from majorvocal.features import FeatureIndex
+
+    return FeatureIndex(features_dir)
+
+
+def _analysed(prefilter, file_path: Path, n_chunks: int) -> int:
+    return n_chunks if prefilter is None else prefilter.counts.pop(file_path)[1]
+
+
+class _TimedWriter:
+    """
+    Wraps a ScoreWriter to add the time spent storing each file's scores to
+    its "write" time.
+    """
+
+    def __init__(self, writer: "ScoreWriter", stopwatches: dict[Path, Stopwatch]):
+        self.writer = writer
+        self.stopwatches = stopwatches
+
+    def add(self, file_path: Path, *args) -> None:
+        with self.stopwatches[file_path]("write"):
+            self.writer.add(file_path, *args)
+
+
+def run_streaming_inference(
+    prefetcher: Iterable[tuple[Path, np.ndarray]],
+    json_dir: Optional[Path] = None,
+    batch_size: int = BATCH_SIZE,
+    min_conf: float = MIN_CONF,
+    n_threads: int = 1,
+    analyzer_factory: Callable = load_analyzer,
+    version: str = MODEL_VERSION,
+    log_file: Optional[Path] = None,
+    scores_dir: Optional[Path] = None,
+    profile: Optional[str] = None,
+    profile_dir: Optional[Path] = None,
+    prefilter_db: Optional[float] = None,
+    features_dir: Optional[Path] = None,
+) -> Iterator[dict]:
+    """
+    Runs the model in this process over recordings that are read and decoded
+    ahead of time by a majorvocal.pipeline.Prefetcher, so the model never
+    waits for the disk or the decoders.
+
+    Args:
+        prefetcher (Iterable[tuple[Path, np.ndarray]]): Yields
+            ``(file_path, chunks)`` pairs, typically a Prefetcher created with
+            ``return_exceptions=True`` so that a recording that cannot be
+            decoded is reported as failed.
+        json_dir (Path, optional): If given, each file's detections are also
+            saved there as a JSON file, or appended to its archive once it
+            is packed (see majorvocal.archive).
+        batch_size (int): Number of chunks per model call.
+        min_conf (float): Minimum confidence for a detection to be kept.
+        n_threads (int): Intra-op threads used by the model.
+        analyzer_factory (Callable): Function that loads the model.
+        version (str): Model version passed to ``analyzer_factory``.
+        log_file (Path, optional): File that receives the model's stdout.
+        scores_dir (Path, optional): If given, the top species scores of every
+            chunk are also stored there (see majorvocal.scores).
+        profile (str, optional): Profile this process with "cprofile" or
+            "sample"; see init_worker. The profile is written every 100 files.
+        profile_dir (Path, optional): Folder for the profile.
+        prefilter_db (float, optional): Skip quiet chunks; see process_files.
+        features_dir (Path, optional): Precomputed levels for the prefilter;
+            see process_files.
+
+    Yields:
+        dict: A majorvocal.manifest record for each file, in completion
+        order, with timings as in process_files. Decoding happens in the
+        prefetcher, so only the inference and write times are known; the
+        processing time is the time since the previous file.
+    """
+    init_worker(analyzer_factory, version, n_threads, log_file, profile, profile_dir)
+    analyzer = get_analyzer()
+    prefilter = _prefilter(prefilter_db, features_dir)
+    failed, n_chunks, stopwatches = [], {}, collections.defaultdict(Stopwatch)
+
+    def items():
+        for file_path, chunks in prefetcher:
+            if isinstance(chunks, Exception):
+                failed.append(file_record(file_path, "failed", error=f"{type(chunks).__name__}: {chunks}"))
+                continue
+            n_chunks[file_path] = len(chunks)
+            yield file_path, chunks
+
+    last, n_done = time.perf_counter(), 0
+    with _score_writer(scores_dir, analyzer.labels) as writer:
+        if writer is not None:
+            writer = _TimedWriter(writer, stopwatches)
+        results = predict_files(analyzer, items(), batch_size, min_conf, score_writer=writer, prefilter=prefilter)
+        for file_path, detections in results:
+            stopwatch = stopwatches.pop(file_path)
+            with stopwatch("write"):
+                _save_json(json_dir, file_path, detections)
+            now = time.perf_counter()
+            stopwatch.add("inference", now - last - stopwatch.timings["write"])
+            yield from failed
+            failed.clear()
+            n = n_chunks.pop(file_path)
+            record = file_record(
+                file_path, "done", duration=n * CHUNK_SECONDS, elapsed=now - last, detections=detections
+            )
+            record.update(chunks=n, analysed=_analysed(prefilter, file_path, n))
+            yield {**record, "timings": stopwatch.timings, "pid": os.getpid(), "rss": rss_bytes()}
+            last, n_done = now, n_done + 1
+            if _profiler is not None and n_done % 100 == 0:
+                _profiler.dump()
+    yield from failed
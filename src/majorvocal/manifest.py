@@ -0,0 +1,234 @@
+"""
+Crash-safe record of an inference run.
+
+The manifest is an SQLite database in WAL mode with one row per recording,
+written by the main process as soon as each result comes back from the
+workers. If a run is interrupted, everything committed so far survives, and a
+resumed run skips finished recordings with a single set lookup each. The
+combined detections file is rebuilt from the manifest at any time.
+"""
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from majorvocal.archive import iter_json_records
+
+# Recordings with these statuses are not processed again on resume
+FINISHED = ("done", "skipped")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    pnum TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration REAL,
+    elapsed REAL,
+    n_detections INTEGER,
+    detections TEXT,
+    error TEXT,
+    finished_at REAL NOT NULL,
+    PRIMARY KEY (pnum, timestamp)
+)
+"""
+
+
+class RunManifest:
+    """
+    Append-only manifest of processed recordings.
+
+    Each record is a dict with the keys ``path``, ``timestamp``, ``pnum``,
+    ``status`` ("done", "skipped" or "failed"), ``duration`` (seconds of
+    audio), ``elapsed`` (seconds spent processing), ``detections`` and
+    ``error``, as returned by majorvocal.inference.process_files. Recordings
+    are identified by (pnum, timestamp), so the manifest stays valid if the
+    data drive is mounted elsewhere. A recording recorded again (e.g. a failed
+    one that is retried) replaces its old row.
+
+    Args:
+        path (Path): Database file; created if it does not exist.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+
+    def record(self, records: Iterable[dict]) -> None:
+        """
+        Commits a group of records in a single transaction.
+        """
+        now = time.time()
+        rows = [
+            (
+                r["pnum"],
+                r["timestamp"],
+                r["path"],
+                r["status"],
+                r.get("duration"),
+                r.get("elapsed"),
+                None if r.get("detections") is None else len(r["detections"]),
+                None if r.get("detections") is None else json.dumps(r["detections"]),
+                r.get("error"),
+                now,
+            )
+            for r in records
+        ]
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def merge(self, path: Path) -> int:
+        """
+        Adds the records of another manifest (e.g. one shard of a run spread
+        over several machines), replacing those of the same recordings. The
+        merged records count as finished now, so the next sync_detections
+        picks them up.
+
+        Returns:
+            int: Number of records merged.
+        """
+        self._db.execute("ATTACH DATABASE ? AS other", (str(path),))
+        try:
+            with self._db:
+                columns = "pnum, timestamp, path, status, duration, elapsed, n_detections, detections, error"
+                cursor = self._db.execute(
+                    f"INSERT OR REPLACE INTO files SELECT {columns}, ? FROM other.files ORDER BY finished_at",
+                    (time.time(),),
+                )
+        finally:
+            self._db.execute("DETACH DATABASE other")
+        return cursor.rowcount
+
+    def finished(self) -> set[tuple[str, str]]:
+        """
+        Returns ``(pnum, timestamp)`` of recordings that do not need
+        processing again.
+        """
+        query = f"SELECT pnum, timestamp FROM files WHERE status IN ({','.join('?' * len(FINISHED))})"
+        return set(self._db.execute(query, FINISHED))
+
+    def pending(self, file_paths: Iterable[Path]) -> list[Path]:
+        """
+        Drops the recordings already finished in a previous run.
+        """
+        finished = self.finished()
+        return [f for f in file_paths if (f.parent.name, f.stem) not in finished]
+
+    def import_json_dir(self, json_dir: Path) -> int:
+        """
+        Adds recordings processed before the manifest existed, from the
+        per-file ``<pnum>_<timestamp>.json`` outputs of earlier runs, loose
+        or packed (see majorvocal.archive). Recordings already in the
+        manifest are left untouched.
+
+        Returns:
+            int: Number of recordings added.
+        """
+        records = [
+            file_record(Path(pnum, timestamp), "done", detections=detections)
+            for timestamp, pnum, detections in iter_json_records(json_dir, skip=self.finished())
+        ]
+        self.record(records)
+        return len(records)
+
+    def summary(self) -> dict[str, int]:
+        """
+        Returns the number of recordings with each status.
+        """
+        return dict(self._db.execute("SELECT status, COUNT(*) FROM files GROUP BY status"))
+
+    def failures(self) -> list[tuple[str, str]]:
+        """
+        Returns ``(path, error)`` for every failed recording.
+        """
+        return list(self._db.execute("SELECT path, error FROM files WHERE status = 'failed' ORDER BY pnum, timestamp"))
+
+    def iter_detections(self, since: Optional[float] = None, until: Optional[float] = None) -> Iterator[list]:
+        """
+        Yields ``[timestamp, pnum, detections]`` for every analysed
+        recording, in the order they finished.
+
+        Args:
+            since (float, optional): Only recordings finished after this time.
+            until (float, optional): Only recordings finished at or before
+                this time.
+        """
+        query = "SELECT timestamp, pnum, detections FROM files WHERE status = 'done'"
+        query += " AND finished_at > ? AND finished_at <= ? ORDER BY finished_at, rowid"
+        bounds = (-1.0 if since is None else since, float("inf") if until is None else until)
+        for timestamp, pnum, detections in self._db.execute(query, bounds):
+            yield [timestamp, pnum, json.loads(detections)]
+
+    def last_finished(self) -> float:
+        """
+        Returns the time the most recent recording was recorded, or 0 if the
+        manifest is empty.
+        """
+        return self._db.execute("SELECT COALESCE(MAX(finished_at), 0) FROM files").fetchone()[0]
+
+    def export_json(self, path: Path, lines: bool = False) -> int:
+        """
+        Writes the combined detections file (the format of detections.json)
+        one record at a time, through a temporary file that replaces ``path``
+        only once it is complete.
+
+        Args:
+            path (Path): Output file.
+            lines (bool): Write one record per line (NDJSON) instead of a
+                single JSON array.
+
+        Returns:
+            int: Number of recordings written.
+        """
+        path = Path(path)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        n = 0
+        with open(tmp, "w") as f:
+            f.write("" if lines else "[")
+            for record in self.iter_detections():
+                if not lines and n:
+                    f.write(", ")
+                json.dump(record, f)
+                f.write("\n" if lines else "")
+                n += 1
+            f.write("" if lines else "]")
+        tmp.replace(path)
+        return n
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "RunManifest":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def file_record(
+    file_path: Path,
+    status: str,
+    duration: Optional[float] = None,
+    elapsed: Optional[float] = None,
+    detections: Optional[list[dict]] = None,
+    error: Optional[str] = None,
+) -> dict:
+    """
+    Builds a manifest record for a recording named ``<pnum>/<YYYYMMDD_HHMMSS>``.
+    """
+    return {
+        "path": str(file_path),
+        "timestamp": file_path.stem,
+        "pnum": file_path.parent.name,
+        "status": status,
+        "duration": duration,
+        "elapsed": elapsed,
+        "detections": detections,
+        "error": error,
+    }
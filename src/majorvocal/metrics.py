@@ -0,0 +1,284 @@
+"""
+Instrumentation of long inference runs.
+
+Workers time each recording by stage (stat, decode, resample, inference and
+write) with a Stopwatch and return the timings, their pid and their memory use
+with the recording's manifest record. Only the main process writes metrics:
+a MetricsSink appends one JSON line per recording (and per gauge reading) to a
+rolling log, and keeps a Prometheus textfile (for node_exporter's textfile
+collector) with running totals, worker utilisation, queue depths and memory.
+
+Profiling is opt-in: start_profiler runs cProfile, or a sampling profiler that
+records collapsed stacks (the format read by flamegraph.pl and speedscope),
+in each worker, and the profiles are dumped after every group of recordings so
+they are available while a run is still going.
+"""
+import cProfile
+import collections
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+STAGES = ("stat", "decode", "resample", "inference", "write")
+PROFILERS = ("cprofile", "sample")
+
+
+class Stopwatch:
+    """
+    Accumulates the time spent in named stages.
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def __call__(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+
+def rss_bytes() -> int:
+    """
+    Returns the resident memory of this process, or its peak where the
+    current value is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        # Kilobytes on Linux, bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+class MetricsSink:
+    """
+    Writes the metrics of a run, from the main process.
+
+    Args:
+        path (Path): JSONL log; rolled over to ``path.1``, ``path.2``... when
+            it reaches ``max_bytes``.
+        textfile (Path, optional): Prometheus textfile, rewritten atomically
+            at most every ``interval`` seconds and on close.
+        max_bytes (int): Size at which the JSONL log rolls over.
+        backups (int): Rolled-over logs kept.
+        interval (float): Minimum seconds between textfile updates.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        textfile: Optional[Path] = None,
+        max_bytes: int = 64 * 2**20,
+        backups: int = 5,
+        interval: float = 15.0,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.textfile = Path(textfile) if textfile else None
+        self.interval = interval
+        self._handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=backups)
+        self._start = time.time()
+        self._written = 0.0
+        self._counters = collections.Counter()
+        self._gauges = {}
+        self._busy = collections.Counter()
+
+    def _log(self, event: dict) -> None:
+        self._handler.handle(logging.makeLogRecord({"msg": json.dumps(event, default=str)}))
+
+    def record(self, records: Iterable[dict]) -> None:
+        """
+        Logs the manifest records returned by the workers, with their
+        timings, and adds them to the totals.
+        """
+        now = time.time()
+        for r in records:
+            event = {
+                "time": now,
+                "event": "file",
+                **{k: r.get(k) for k in ("path", "status", "duration", "elapsed", "chunks", "analysed", "pid", "rss")},
+                "timings": r.get("timings") or {},
+            }
+            self._log(event)
+            self._counters[("majorvocal_files_total", (("status", r["status"]),))] += 1
+            self._counters[("majorvocal_audio_seconds_total", ())] += r.get("duration") or 0.0
+            if r.get("analysed") is not None:
+                self._counters[("majorvocal_chunks_total", ())] += r["chunks"]
+                self._counters[("majorvocal_chunks_analysed_total", ())] += r["analysed"]
+            for stage, seconds in event["timings"].items():
+                self._counters[("majorvocal_stage_seconds_total", (("stage", stage),))] += seconds
+            if r.get("pid") is not None:
+                worker = (("worker", str(r["pid"])),)
+                self._busy[worker] += r.get("elapsed") or 0.0
+                if r.get("rss") is not None:
+                    self._gauges[("majorvocal_worker_rss_bytes", worker)] = r["rss"]
+        self._maybe_write()
+
+    def gauge(self, name: str, value: float, **labels) -> None:
+        """
+        Logs and sets a gauge, e.g. a queue depth.
+        """
+        self._log({"time": time.time(), "event": "gauge", "name": name, "value": value, **labels})
+        self._gauges[(f"majorvocal_{name}", tuple(sorted(labels.items())))] = value
+        self._maybe_write()
+
+    def skip_ratio(self) -> float:
+        """
+        Returns the fraction of chunks the prefilter kept from the model (see
+        majorvocal.prefilter); 0 if it is off.
+        """
+        total = self._counters[("majorvocal_chunks_total", ())]
+        return 1 - self._counters[("majorvocal_chunks_analysed_total", ())] / total if total else 0.0
+
+    def utilization(self) -> dict[str, float]:
+        """
+        Returns the fraction of the run each worker spent processing.
+        """
+        wall = max(time.time() - self._start, 1e-9)
+        return {dict(worker)["worker"]: busy / wall for worker, busy in self._busy.items()}
+
+    def _maybe_write(self) -> None:
+        if self.textfile is not None and time.time() - self._written >= self.interval:
+            self.write_textfile()
+
+    def write_textfile(self) -> None:
+        """
+        Writes the Prometheus textfile now.
+        """
+        if self.textfile is None:
+            return
+        gauges = dict(self._gauges)
+        for worker, value in self.utilization().items():
+            gauges[("majorvocal_worker_utilization", (("worker", worker),))] = value
+        gauges[("majorvocal_main_rss_bytes", ())] = rss_bytes()
+        lines = []
+        for kind, metrics in [("counter", self._counters), ("gauge", gauges)]:
+            for name in sorted({name for name, _ in metrics}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (metric, labels), value in sorted(metrics.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(dict(labels))} {value}")
+        self.textfile.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.textfile.with_suffix(".tmp")
+        tmp.write_text("\n".join(lines) + "\n")
+        tmp.replace(self.textfile)
+        self._written = time.time()
+
+    def close(self) -> None:
+        self._log({"time": time.time(), "event": "utilization", **self.utilization()})
+        self.write_textfile()
+        self._handler.close()
+
+    def __enter__(self) -> "MetricsSink":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# ──── PROFILING ──────────────────────────────────────────────────────────────
+
+
+class StackSampler:
+    """
+    Sampling profiler: a thread records the stack of the thread that started
+    it every ``interval`` seconds. The overhead does not depend on how much
+    Python code runs, unlike cProfile's.
+
+    Args:
+        path (Path): Output file, in collapsed-stack format (one
+            ``frame;frame;frame count`` line per distinct stack).
+        interval (float): Seconds between samples.
+    """
+
+    def __init__(self, path: Path, interval: float = 0.01):
+        self.path = Path(path)
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._target = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def dump(self) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text("".join(f"{stack} {n}\n" for stack, n in self.counts.copy().items()))
+        tmp.replace(self.path)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.dump()
+
+
+class _CProfiler:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def dump(self) -> None:
+        # dump_stats disables the profiler
+        self.profile.dump_stats(self.path)
+        self.profile.enable()
+
+    def stop(self) -> None:
+        self.profile.dump_stats(self.path)
+
+
+def start_profiler(kind: str, profile_dir: Path, interval: float = 0.01):
+    """
+    Starts profiling this process.
+
+    Args:
+        kind (str): "cprofile" (a ``.prof`` file, read with pstats or
+            snakeviz) or "sample" (a ``.folded`` file of collapsed stacks).
+        profile_dir (Path): Folder for the profile, named after the pid.
+        interval (float): Seconds between samples, for "sample".
+
+    Returns:
+        An object with ``dump()``, which writes the profile so far, and
+        ``stop()``.
+
+    Raises:
+        ValueError: If ``kind`` is unknown.
+    """
+    profile_dir = Path(profile_dir)
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    if kind == "cprofile":
+        return _CProfiler(profile_dir / f"worker-{os.getpid()}.prof")
+    if kind == "sample":
+        return StackSampler(profile_dir / f"worker-{os.getpid()}.folded", interval)
+    raise ValueError(f"Unknown profiler {kind!r}; expected one of {PROFILERS}")
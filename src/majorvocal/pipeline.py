@@ -0,0 +1,160 @@
+"""
+Producer/consumer pipeline that overlaps audio I/O and decoding with model
+inference.
+
+Reader threads pull raw file bytes off disk, a process pool decodes and
+resamples them, and the consumer (the inference stage) iterates over the
+decoded chunks. At most ``depth`` files are held between the reader and the
+consumer, so memory stays bounded while the disk and decoders stay ahead of
+the model. Recordings found in a ChunkCache skip both stages and are
+memory-mapped straight from the cache.
+"""
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
+
+from majorvocal.audio import decode_chunks
+from majorvocal.cache import ChunkCache
+
+_DONE = object()
+
+
+class Prefetcher:
+    """
+    Iterates over ``(file_path, chunks)`` pairs, in completion order, while
+    reading and decoding the next files in the background.
+
+    Args:
+        file_paths (Iterable[Path]): Recordings to read.
+        n_readers (int): Number of I/O threads.
+        n_decoders (int): Number of decoding/resampling processes.
+        depth (int): Maximum number of files read but not yet consumed.
+        decode (Callable): Module-level function turning file bytes into an
+            array of chunks; runs in the decoder processes.
+        start_method (str): multiprocessing start method of the decoders.
+        cache (ChunkCache, optional): Cache checked before reading a file and
+            filled with newly decoded chunks.
+        return_exceptions (bool): Yield ``(file_path, exception)`` for files
+            that cannot be read or decoded instead of raising.
+
+    Raises:
+        Exception: Unless ``return_exceptions`` is set, errors raised while
+        reading or decoding a file are raised again when that file is reached
+        during iteration.
+    """
+
+    def __init__(
+        self,
+        file_paths: Iterable[Path],
+        n_readers: int = 2,
+        n_decoders: int = 2,
+        depth: int = 16,
+        decode: Callable[[bytes], np.ndarray] = decode_chunks,
+        start_method: str = "spawn",
+        cache: Optional[ChunkCache] = None,
+        return_exceptions: bool = False,
+    ):
+        self.file_paths = list(file_paths)
+        self.n_readers = n_readers
+        self.n_decoders = n_decoders
+        self.depth = depth
+        self.decode = decode
+        self.start_method = start_method
+        self.cache = cache
+        self.return_exceptions = return_exceptions
+
+        self._read_queue = queue.Queue(maxsize=depth)
+        self._ready_queue = queue.Queue()
+        self._slots = threading.Semaphore(depth)
+        self._lock = threading.Lock()
+        self._decoding = 0
+
+    def queue_depths(self) -> dict[str, int]:
+        """
+        Returns the number of files currently waiting in each stage: read but
+        not yet sent to a decoder, being decoded, and decoded but not yet
+        consumed. Each is bounded by ``depth``.
+        """
+        return {
+            "read": self._read_queue.qsize(),
+            "decode": self._decoding,
+            "ready": self._ready_queue.qsize(),
+        }
+
+    def _read(self, paths: Iterator[Path]) -> None:
+        try:
+            while True:
+                with self._lock:
+                    file_path = next(paths, None)
+                if file_path is None:
+                    break
+                self._slots.acquire()
+                try:
+                    chunks = self.cache.get(file_path) if self.cache else None
+                    if chunks is not None:
+                        self._ready_queue.put((file_path, chunks))
+                        continue
+                    self._read_queue.put((file_path, file_path.read_bytes()))
+                except Exception as e:  # e.g. MemoryError, or a broken cache entry
+                    self._read_queue.put((file_path, e))
+        finally:
+            # The dispatcher waits for every reader, whatever happened to it
+            self._read_queue.put(_DONE)
+
+    def _dispatch(self, executor: ProcessPoolExecutor) -> None:
+        n_finished = 0
+        while n_finished < self.n_readers:
+            item = self._read_queue.get()
+            if item is _DONE:
+                n_finished += 1
+                continue
+            file_path, data = item
+            if isinstance(data, Exception):
+                self._ready_queue.put(item)
+                continue
+            with self._lock:
+                self._decoding += 1
+            try:
+                future = executor.submit(self.decode, data)
+            except RuntimeError as e:  # the executor was shut down
+                self._ready_queue.put((file_path, e))
+                return
+            future.add_done_callback(lambda f, file_path=file_path: self._decoded(file_path, f))
+
+    def _decoded(self, file_path: Path, future: Future) -> None:
+        with self._lock:
+            self._decoding -= 1
+        if future.cancelled():
+            return
+        result = future.exception() or future.result()
+        if self.cache and not isinstance(result, Exception):
+            try:
+                result = self.cache.put(file_path, result)
+            except OSError:  # e.g. a full cache disk; carry on uncached
+                pass
+        self._ready_queue.put((file_path, result))
+
+    def __len__(self) -> int:
+        return len(self.file_paths)
+
+    def __iter__(self) -> Iterator[tuple[Path, np.ndarray]]:
+        paths = iter(self.file_paths)
+        executor = ProcessPoolExecutor(self.n_decoders, mp_context=multiprocessing.get_context(self.start_method))
+        threads = [threading.Thread(target=self._read, args=(paths,), daemon=True) for _ in range(self.n_readers)]
+        threads.append(threading.Thread(target=self._dispatch, args=(executor,), daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            for _ in range(len(self.file_paths)):
+                file_path, result = self._ready_queue.get()
+                self._slots.release()
+                if isinstance(result, Exception) and not self.return_exceptions:
+                    raise result
+                yield file_path, result
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
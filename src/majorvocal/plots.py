@@ -0,0 +1,220 @@
+"""
+Sanity-check figures of the detections and daily counts.
+
+Each function takes pandas frames from majorvocal.aggregate (converted with
+``to_pandas()``) or majorvocal.utils.to_df and returns a matplotlib figure;
+save_figures writes them all to a folder. matplotlib and seaborn are imported
+when a figure is made.
+"""
+from pathlib import Path
+
+import pandas as pd
+
+from majorvocal.graphical import figwidth, set_style
+
+
+def rows_per_pnum(daily_counts: pd.DataFrame):
+    """
+    Distribution of the number of recorded days per pnum.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig, ax = plt.subplots(figsize=(figwidth, figwidth / 2))
+    sns.histplot(data=daily_counts["pnum"].value_counts(), ax=ax)
+    ax.set_xlabel("Number of Detections")
+    ax.set_ylabel("Number of Pnums")
+    fig.tight_layout()
+    return fig
+
+
+def seasonal_activity(pmajor: pd.DataFrame, daily_counts: pd.DataFrame):
+    """
+    Detections per day of the year (5-day rolling mean) and number of first
+    eggs per day, by year.
+    """
+    import matplotlib.pyplot as plt
+
+    from majorvocal.graphical import site_palette
+
+    fig, ax = plt.subplots(figsize=(10, 4))
+    grouped_data = pmajor.dropna(subset=["confidence"]).groupby(["year", "dayofyear"]).size().unstack("year")
+    grouped_data.columns = grouped_data.columns.astype(int)
+
+    # Plot the smoothed lines (5 day rolling average)
+    for i, year in enumerate(grouped_data.columns):
+        smoothed = grouped_data[year].rolling(window=5, min_periods=1).mean()
+        ax.plot(
+            smoothed.index,
+            smoothed,
+            color=site_palette[i],
+            linewidth=2,
+            linestyle="dotted",
+            label=f"Song activity {year}",
+        )
+
+    lay_dates = daily_counts[["pnum", "lay_date", "year"]].drop_duplicates()
+    lay_dates["lay_date"] = lay_dates["lay_date"].dt.dayofyear
+    lay_dates = lay_dates.groupby(["lay_date", "year"]).size().reset_index(name="count")
+
+    # Plot the number of lay_dates for each day on a second y-axis, by year
+    ax2 = ax.twinx()
+    for i, year in enumerate(sorted(lay_dates["year"].unique())):
+        data = lay_dates[lay_dates["year"] == year]
+        smoothed = data["count"].rolling(window=5, min_periods=1).mean()
+        ax2.plot(data["lay_date"], smoothed, color=site_palette[i], linewidth=2, label=f"Eggs {year}")
+
+    ax.legend(title="Legend", bbox_to_anchor=(1.2, 1), loc="upper left", prop={"size": 10})
+    ax.set_xlabel("Day")
+    ax.set_ylabel("Number of Detections")
+    ax2.set_ylabel("Number of 1st eggs")
+    ax.set_title("Great tit Detections")
+    fig.tight_layout()
+    return fig
+
+
+def recorded_ranges(daily_counts: pd.DataFrame):
+    """
+    Recorded range of each breeding attempt, in days from the lay date.
+    """
+    import matplotlib.pyplot as plt
+
+    bounds = daily_counts.groupby("pnum", sort=False)["days_from_lay"].agg(["min", "max"])
+    fig, ax = plt.subplots(figsize=(15, max(len(bounds), 1) * 0.4))
+    for y, (pnum, row) in enumerate(bounds.iterrows()):
+        ax.plot([row["min"], row["max"]], [y, y], marker="o", markersize=10, label=pnum)
+
+    ax.set_xlabel("Days from Lay Date")
+    ax.set_ylabel("Pnum")
+    ax.set_yticks(range(len(bounds)))
+    ax.set_yticklabels(bounds.index)
+    ax.grid(True)
+    ax.set_title("Gantt Chart of Pnum Activities Centered Around Lay Date")
+    ax.legend(title="Pnum", bbox_to_anchor=(1.05, 1), loc="upper left")
+    fig.tight_layout()
+    return fig
+
+
+def peak_distribution(peaks: pd.DataFrame):
+    """
+    Distribution of the day of peak song activity, in days from the first egg.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig, ax = plt.subplots(figsize=(figwidth, figwidth / 2))
+    sns.histplot(data=peaks["days_from_lay"], ax=ax, bins=10 + 6, discrete=True)
+    ax.axvline(0, color="red", linestyle="--")
+    ax.set_xlim(-11, 6)
+    ax.set_xticks(range(-11, 7))
+    ax.set_xticklabels(range(-11, 7))
+    ax.set_xlabel("Days from first egg")
+    ax.set_ylabel("Density")
+    fig.tight_layout()
+    return fig
+
+
+def sampling_correlation(daily_counts: pd.DataFrame):
+    """
+    Total automated detections against the number of manually segmented
+    songs of each pnum.
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    samplingcorr = daily_counts.groupby("pnum", as_index=False).agg({"count": "sum", "n_vocalisations": "first"})
+    fig, ax = plt.subplots(figsize=(figwidth, figwidth))
+    sns.scatterplot(data=samplingcorr, y="count", x="n_vocalisations", ax=ax)
+    ax.set_xscale("log")
+    ax.set_yscale("log")
+    ax.plot([1, 1e4], [1, 1e4], color="#5fa389", linestyle="--")
+    ax.grid(True)
+    ax.set_xlabel("N Songs (manual)")
+    ax.set_ylabel("N Detections (automated)")
+    fig.tight_layout()
+    return fig
+
+
+def scaled_activity(subset: pd.DataFrame):
+    """
+    Detections per day of each pnum, scaled to its maximum and centred
+    around the lay date. Takes the output of aggregate.scaled_counts.
+    """
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(15, figwidth))
+    for pnum, group in subset.groupby("pnum", sort=False):
+        ax.plot(group["days_from_lay"] + 3, group["scaled_count"], label=pnum)
+    ax.set_xlabel("Days from Lay Date")
+    ax.set_ylabel("Scaled Number of Detections")
+    ax.set_title("Detections per day, centred around lay date (scaled)")
+    fig.tight_layout()
+    return fig
+
+
+def detection_times(pmajor: pd.DataFrame):
+    """
+    Distribution of detections over the time of day.
+    """
+    import matplotlib.pyplot as plt
+
+    from majorvocal.graphical import site_palette
+
+    start = pmajor["start_datetime"].dropna()
+    minutes = start.dt.hour * 60 + start.dt.minute
+    fig, ax = plt.subplots(figsize=(figwidth, 4))
+    ax.hist(minutes, bins=20, color=site_palette[0], edgecolor="white")
+    ax.set_xlabel("Time (HHMM)")
+    ax.set_ylabel("Number of detections")
+    ax.set_title("Distribution of detections over time")
+    ax.tick_params(axis="x", rotation=45)
+    ax.xaxis.set_major_formatter(plt.FuncFormatter(lambda x, _: "{:02d}{:02d}".format(int(x) // 60, int(x) % 60)))
+    fig.tight_layout()
+    return fig
+
+
+def save_figures(
+    pmajor: pd.DataFrame,
+    daily_counts: pd.DataFrame,
+    peaks: pd.DataFrame,
+    subset: pd.DataFrame,
+    subset_peaks: pd.DataFrame,
+    out_dir: Path,
+) -> list[Path]:
+    """
+    Makes every figure and saves it as a PNG in ``out_dir``.
+
+    Args:
+        pmajor (pd.DataFrame): Detections, from utils.to_df.
+        daily_counts (pd.DataFrame): From aggregate.daily_counts.
+        peaks (pd.DataFrame): From aggregate.peak_days.
+        subset (pd.DataFrame): From aggregate.scaled_counts, applied to the
+            output of aggregate.subset_pnums.
+        subset_peaks (pd.DataFrame): From aggregate.peak_days, on the subset.
+        out_dir (Path): Output folder; created if needed.
+
+    Returns:
+        list[Path]: The files written.
+    """
+    import matplotlib.pyplot as plt
+
+    set_style()
+    figures = {
+        "rows_per_pnum": rows_per_pnum(daily_counts),
+        "seasonal_activity": seasonal_activity(pmajor, daily_counts),
+        "recorded_ranges": recorded_ranges(daily_counts),
+        "peak_distribution": peak_distribution(peaks),
+        "sampling_correlation": sampling_correlation(daily_counts),
+        "scaled_activity": scaled_activity(subset),
+        "subset_peak_distribution": peak_distribution(subset_peaks),
+        "detection_times": detection_times(pmajor),
+    }
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name, fig in figures.items():
+        path = out_dir / f"{name}.png"
+        fig.savefig(path, dpi=150, facecolor=fig.get_facecolor())
+        plt.close(fig)
+        paths.append(path)
+    return paths
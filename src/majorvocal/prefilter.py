@@ -0,0 +1,227 @@
+"""
+Energy prefilter that decides which chunks are worth running the model on.
+
+Great tit song sits between 2 and 8 kHz. For each chunk, the prefilter
+measures the energy in that band over short frames and compares the loudest
+frame with the noise floor of the whole recording (a low percentile of all
+frames). Chunks whose peak does not rise at least ``margin_db`` above the floor
+are skipped: the model is not run on them and they have no detections. As the
+floor is estimated per recording, the threshold adapts to wind and rain, which
+raise the floor without adding song.
+
+Use ``validate`` (``majorvocal check-prefilter``) on a sample of recordings to
+check the detections lost against full inference before enabling it for a
+season.
+"""
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+import numpy as np
+
+from majorvocal.audio import SAMPLE_RATE
+
+BAND = (2000.0, 8000.0)
+FRAME = 1024
+MARGIN_DB = 8.0
+FLOOR_PERCENTILE = 20
+
+
+def frame_power(chunks: np.ndarray, frame: int = FRAME, block: int = 16) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Power spectra of non-overlapping Hann-windowed frames of each chunk,
+    computed ``block`` chunks at a time to keep them small.
+
+    Args:
+        chunks (np.ndarray): Array of shape (n_chunks, n_samples).
+        frame (int): Frame length in samples.
+        block (int): Number of chunks per FFT.
+
+    Yields:
+        tuple[int, np.ndarray]: Index of the first chunk of the block and its
+        spectra, of shape (n_block, n_samples // frame, frame // 2 + 1).
+    """
+    n_frames = chunks.shape[1] // frame
+    window = np.hanning(frame).astype(np.float32)
+    for start in range(0, len(chunks), block):
+        frames = np.asarray(chunks[start : start + block, : n_frames * frame]).reshape(-1, n_frames, frame)
+        spectrum = np.fft.rfft(frames * window, axis=-1)
+        yield start, spectrum.real**2 + spectrum.imag**2
+
+
+def band_levels(chunks: np.ndarray, sr: int = SAMPLE_RATE, band: tuple = BAND, frame: int = FRAME) -> np.ndarray:
+    """
+    Energy in ``band`` of non-overlapping Hann-windowed frames of each chunk.
+
+    Args:
+        chunks (np.ndarray): Array of shape (n_chunks, n_samples).
+        sr (int): Sample rate.
+        band (tuple): Lower (inclusive) and upper (exclusive) frequency, Hz.
+        frame (int): Frame length in samples.
+
+    Returns:
+        np.ndarray: Levels in dB, of shape (n_chunks, n_samples // frame).
+    """
+    in_band = band_mask(sr, band, frame)
+    levels = np.empty((len(chunks), chunks.shape[1] // frame), dtype=np.float32)
+    for start, power in frame_power(chunks, frame):
+        levels[start : start + len(power)] = to_db(power[..., in_band].sum(axis=-1))
+    return levels
+
+
+def band_mask(sr: int = SAMPLE_RATE, band: tuple = BAND, frame: int = FRAME) -> np.ndarray:
+    """
+    Returns the FFT bins of a ``frame``-sample frame that fall in ``band``.
+    """
+    freqs = np.fft.rfftfreq(frame, 1 / sr)
+    return (freqs >= band[0]) & (freqs < band[1])
+
+
+def to_db(energy: np.ndarray) -> np.ndarray:
+    """
+    Converts energies to decibels, with silence at -120 dB.
+    """
+    return 10 * np.log10(energy + 1e-12)
+
+
+def summarize(levels: np.ndarray) -> tuple[np.ndarray, float]:
+    """
+    Reduces the frame levels of a recording to what the prefilter needs: the
+    loudest frame of each chunk and the recording's noise floor.
+
+    Args:
+        levels (np.ndarray): Output of band_levels.
+
+    Returns:
+        tuple[np.ndarray, float]: Peak level of each chunk and noise floor, dB.
+    """
+    if levels.size == 0:
+        return np.zeros(len(levels), dtype=np.float32), 0.0
+    return levels.max(axis=1), float(np.percentile(levels, FLOOR_PERCENTILE))
+
+
+def keep_mask(peaks: np.ndarray, floor: float, margin_db: float = MARGIN_DB, pad: int = 0) -> np.ndarray:
+    """
+    Selects the chunks whose peak level is ``margin_db`` above ``floor``,
+    and ``pad`` chunks on each side of them.
+    """
+    keep = np.asarray(peaks) - floor >= margin_db
+    if pad > 0 and keep.size:
+        keep = np.convolve(keep, np.ones(2 * pad + 1))[pad : pad + len(keep)] > 0
+    return keep
+
+
+def select_chunks(
+    chunks: np.ndarray, margin_db: float = MARGIN_DB, pad: int = 0, sr: int = SAMPLE_RATE, band: tuple = BAND
+) -> np.ndarray:
+    """
+    Selects the chunks of a recording whose band energy peaks ``margin_db``
+    above the recording's noise floor.
+
+    Args:
+        chunks (np.ndarray): The chunks of one recording, (n_chunks, n_samples).
+        margin_db (float): Required rise above the floor.
+        pad (int): Also keep this many chunks on each side of a selected one,
+            for songs that straddle chunk boundaries.
+        sr (int): Sample rate.
+        band (tuple): Frequency band, Hz.
+
+    Returns:
+        np.ndarray: Boolean mask of the chunks to analyse.
+    """
+    if len(chunks) == 0:
+        return np.zeros(0, dtype=bool)
+    return keep_mask(*summarize(band_levels(chunks, sr, band)), margin_db, pad)
+
+
+class Prefilter:
+    """
+    Callable passed to majorvocal.inference.predict_files that selects the
+    chunks of each recording and keeps count of the chunks seen and
+    analysed.
+
+    Args:
+        margin_db (float): See select_chunks.
+        pad (int): See select_chunks.
+        levels (Callable, optional): Returns the peak level of each chunk of
+            a recording and its noise floor, computed ahead of time (e.g.
+            majorvocal.features.FeatureIndex.levels), or None. Recordings
+            without them are measured from their chunks.
+    """
+
+    def __init__(self, margin_db: float = MARGIN_DB, pad: int = 0, levels: Optional[Callable] = None):
+        self.margin_db = margin_db
+        self.pad = pad
+        self.levels = levels
+        self.counts = {}
+
+    def __call__(self, file_path: Path, chunks: np.ndarray) -> np.ndarray:
+        peaks, floor = (self.levels and self.levels(file_path)) or (None, None)
+        if peaks is not None and len(peaks) == len(chunks):
+            keep = keep_mask(peaks, floor, self.margin_db, self.pad)
+        else:
+            keep = select_chunks(chunks, self.margin_db, self.pad)
+        self.counts[file_path] = (len(keep), int(keep.sum()))
+        return keep
+
+    def skip_ratio(self) -> float:
+        """
+        Returns the fraction of chunks skipped so far.
+        """
+        total = sum(n for n, _ in self.counts.values())
+        return 1 - sum(kept for _, kept in self.counts.values()) / total if total else 0.0
+
+
+def validate(
+    analyzer,
+    items: Iterable[tuple],
+    margin_db: float = MARGIN_DB,
+    pad: int = 0,
+    min_conf: float = 0.8,
+    species: Optional[str] = "Parus major",
+    batch_size: int = 64,
+) -> dict:
+    """
+    Runs full and prefiltered inference on the same recordings and compares
+    their detections.
+
+    Args:
+        analyzer: The loaded analyzer.
+        items (Iterable[tuple]): ``(file_path, chunks)`` pairs, e.g. a sample
+            of recordings decoded with majorvocal.audio.load_chunks.
+        margin_db (float): See select_chunks.
+        pad (int): See select_chunks.
+        min_conf (float): Minimum confidence for a detection to be kept.
+        species (str, optional): Only count detections of this species; None
+            counts all.
+        batch_size (int): Number of chunks per model call.
+
+    Returns:
+        dict: Chunks, chunks analysed, skip ratio, detections with and
+        without the prefilter, recall (the fraction of full-inference
+        detections kept), and per-file detection counts.
+    """
+    from majorvocal.inference import predict_files
+
+    prefilter = Prefilter(margin_db, pad)
+
+    def count(detections: list[dict]) -> int:
+        return sum(species is None or d["scientific_name"] == species for d in detections)
+
+    # One recording at a time, so a large sample never has to fit in memory
+    files = {}
+    for file_path, chunks in items:
+        item = [(file_path, chunks)]
+        [(_, full)] = predict_files(analyzer, item, batch_size, min_conf)
+        [(_, filtered)] = predict_files(analyzer, item, batch_size, min_conf, prefilter=prefilter)
+        files[str(file_path)] = (count(full), count(filtered))
+    n_full = sum(full for full, _ in files.values())
+    n_filtered = sum(filtered for _, filtered in files.values())
+    return {
+        "chunks": sum(n for n, _ in prefilter.counts.values()),
+        "analysed": sum(kept for _, kept in prefilter.counts.values()),
+        "skip_ratio": prefilter.skip_ratio(),
+        "detections": n_full,
+        "detections_prefiltered": n_filtered,
+        "recall": n_filtered / n_full if n_full else 1.0,
+        "files": files,
+    }
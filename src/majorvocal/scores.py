@@ -0,0 +1,243 @@
+"""
+Columnar store of raw per-chunk BirdNET scores.
+
+Detections written by inference only keep species above ``min_conf``, so a
+different threshold means running the model again. This module stores the
+``top_k`` scores of every chunk, among the species expected at the site, as
+float16 Parquet partitioned by year and pnum (``root/year=2020/pnum=20201EX26``)
+and rebuilds the ``[timestamp, pnum, detections]`` records read by
+majorvocal.utils.extract_parus_major for other thresholds or species sets.
+
+Only the ``top_k`` highest scores of a chunk are kept, so the rebuilt
+detections are exact as long as a chunk has at most ``top_k`` species above
+the threshold: a species outside a chunk's top ``top_k`` is lost, which
+matters for low thresholds in busy chunks. Scores are stored at half
+precision, so a detection whose score is within ~1e-3 of the threshold may
+fall on the other side of it.
+"""
+import uuid
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from majorvocal.audio import CHUNK_SECONDS
+
+TOP_K = 10
+SCORE_FLOOR = 0.01  # birdnetlib never reports detections below this
+
+SCHEMA = pa.schema(
+    [
+        ("timestamp", pa.string()),
+        ("start_time", pa.float32()),
+        ("end_time", pa.float32()),
+        ("label", pa.dictionary(pa.int16(), pa.string())),
+        ("score", pa.float16()),
+        ("year", pa.int16()),
+        ("pnum", pa.string()),
+    ]
+)
+PARTITIONING = ds.partitioning(pa.schema([("year", pa.int16()), ("pnum", pa.string())]), flavor="hive")
+
+
+class ScoreWriter:
+    """
+    Buffers the scores of many recordings and writes them as partitioned
+    Parquet files. Every recording gets at least one row (with a null label
+    if none of its chunks scored above the floor), so recordings without
+    detections are not lost. Use as a context manager, or call close().
+
+    Args:
+        root (Path): Root directory of the dataset.
+        labels (list[str]): Model labels, in score order.
+        top_k (int): Number of scores kept per chunk.
+        floor (float): Scores below this are not stored.
+        rows_per_file (int): Number of buffered rows that triggers a write.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        labels: list[str],
+        top_k: int = TOP_K,
+        floor: float = SCORE_FLOOR,
+        rows_per_file: int = 500_000,
+    ):
+        self.root = Path(root)
+        self.labels = pa.array(labels, pa.string())
+        self.top_k = top_k
+        self.floor = floor
+        self.rows_per_file = rows_per_file
+        self._batches = []
+        self._n_rows = 0
+
+    def add(self, file_path: Path, scores: np.ndarray, allowed: frozenset = frozenset(), overlap: float = 0.0) -> None:
+        """
+        Adds the scores of one recording.
+
+        Args:
+            file_path (Path): Recording, named ``<pnum>/<YYYYMMDD_HHMMSS>.WAV``.
+            scores (np.ndarray): Scores of shape (n_chunks, n_labels).
+            allowed (frozenset): Labels expected at the site; other species
+                are not stored. Empty to store all species.
+            overlap (float): Overlap between chunks, in seconds.
+        """
+        scores = np.asarray(scores, dtype=np.float32)
+        if allowed:
+            mask = np.isin(self.labels.to_numpy(zero_copy_only=False), list(allowed))
+            scores = np.where(mask, scores, 0)
+        k = min(self.top_k, scores.shape[1]) if scores.size else 0
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k else np.zeros((len(scores), 0), dtype=np.int64)
+        chunk = np.repeat(np.arange(len(scores)), k)
+        label = top.ravel()
+        score = scores[chunk, label]
+        keep = score >= self.floor
+        chunk, label, score = chunk[keep], label[keep], score[keep]
+
+        n = len(chunk)
+        labels = pa.DictionaryArray.from_arrays(pa.array(label, pa.int16()), self.labels)
+        if n == 0:  # placeholder row
+            n, chunk = 1, np.zeros(1, dtype=np.int64)
+            labels = pa.DictionaryArray.from_arrays(pa.array([None], pa.int16()), self.labels)
+            score = np.array([np.nan])
+        start = chunk * (CHUNK_SECONDS - overlap)
+        timestamp = file_path.stem
+        batch = pa.record_batch(
+            [
+                pa.array([timestamp] * n, pa.string()),
+                pa.array(start, pa.float32()),
+                pa.array(start + CHUNK_SECONDS, pa.float32()),
+                labels,
+                pa.array(score.astype(np.float16), pa.float16(), from_pandas=True),
+                pa.array(np.full(n, int(timestamp[:4])), pa.int16()),
+                pa.array([file_path.parent.name] * n, pa.string()),
+            ],
+            schema=SCHEMA,
+        )
+        self._batches.append(batch)
+        self._n_rows += n
+        if self._n_rows >= self.rows_per_file:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes the buffered rows, one new file per (year, pnum) partition.
+        """
+        if not self._batches:
+            return
+        table = pa.Table.from_batches(self._batches, schema=SCHEMA)
+        ds.write_dataset(
+            table,
+            self.root,
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        self._batches = []
+        self._n_rows = 0
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "ScoreWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def read_scores(
+    root: Path, pnums: Optional[Iterable[str]] = None, years: Optional[Iterable[int]] = None
+) -> pa.Table:
+    """
+    Reads the stored scores, only touching the requested partitions.
+
+    Args:
+        root (Path): Root directory of the dataset.
+        pnums (Iterable[str], optional): Only read these nestbox-years.
+        years (Iterable[int], optional): Only read these years.
+
+    Returns:
+        pa.Table: One row per stored (chunk, species) score, with scores
+        converted to float32.
+    """
+    dataset = ds.dataset(root, format="parquet", partitioning=PARTITIONING, schema=SCHEMA)
+    condition = None
+    if pnums is not None:
+        condition = ds.field("pnum").isin(list(pnums))
+    if years is not None:
+        year_condition = ds.field("year").isin(list(years))
+        condition = year_condition if condition is None else condition & year_condition
+    table = dataset.to_table(filter=condition)
+    return table.set_column(table.schema.get_field_index("score"), "score", table["score"].cast(pa.float32()))
+
+
+def load_detections(
+    root: Path,
+    min_conf: float = 0.8,
+    species: Optional[Iterable[str]] = None,
+    pnums: Optional[Iterable[str]] = None,
+    years: Optional[Iterable[int]] = None,
+) -> list[list]:
+    """
+    Rebuilds inference detections from the stored scores for another
+    confidence threshold or species set, without running the model. Species
+    outside the ``top_k`` scores of a chunk were not stored and are missing.
+
+    Args:
+        root (Path): Root directory of the dataset.
+        min_conf (float): Minimum confidence, applied as birdnetlib does
+            (clamped to [0.01, 0.99], strictly greater).
+        species (Iterable[str], optional): Only keep these scientific names.
+        pnums (Iterable[str], optional): Only read these nestbox-years.
+        years (Iterable[int], optional): Only read these years.
+
+    Returns:
+        list[list]: ``[timestamp, pnum, detections]`` for every stored
+        recording, in (pnum, timestamp) order, as written by inference.
+    """
+    import polars as pl
+
+    min_conf = max(0.01, min(min_conf, 0.99))
+    df = pl.from_arrow(read_scores(root, pnums, years)).with_columns(pl.col("label").cast(pl.String))
+    df = df.with_columns(
+        pl.col("label").str.split_exact("_", 1).struct.rename_fields(["scientific_name", "common_name"]).alias("names")
+    ).unnest("names")
+
+    keep = pl.col("score") > min_conf
+    if species is not None:
+        keep = keep & pl.col("scientific_name").is_in(list(species))
+    recordings = df.select("pnum", "timestamp").unique().sort("pnum", "timestamp")
+    hits = (
+        df.filter(keep)
+        .sort(["pnum", "timestamp", "start_time", "score"], descending=[False, False, False, True])
+        .group_by(["pnum", "timestamp"], maintain_order=True)
+        .agg(
+            pl.struct("common_name", "scientific_name", "start_time", "end_time", "score", "label").alias("detections")
+        )
+    )
+    records = recordings.join(hits, on=["pnum", "timestamp"], how="left")
+
+    out = []
+    for pnum, timestamp, detections in records.iter_rows():
+        out.append(
+            [
+                timestamp,
+                pnum,
+                [
+                    {
+                        "common_name": d["common_name"],
+                        "scientific_name": d["scientific_name"],
+                        "start_time": float(d["start_time"]),
+                        "end_time": float(d["end_time"]),
+                        "confidence": float(d["score"]),
+                        "label": d["label"],
+                    }
+                    for d in detections or []
+                ],
+            ]
+        )
+    return out
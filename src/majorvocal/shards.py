@@ -0,0 +1,301 @@
+"""
+Work queue for running inference on several machines at once.
+
+The recordings are split into deterministic shards, one per pnum and day, and
+listed in an SQLite database on storage shared by every node (no broker or
+server is needed). A worker claims a shard by taking a lease on it, renews the
+lease while it works, and marks the shard done once its results are safely
+written to a per-shard manifest. If a worker dies, its lease expires and the
+shard is claimed again by another worker. When every shard is done, the
+per-shard manifests are merged into the run manifest.
+
+The database uses a rollback journal rather than WAL, which needs shared
+memory and does not work across machines. SQLite relies on the file locks of
+the shared filesystem, so NFS mounts need working locks (``lock``, not
+``nolock``).
+"""
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from majorvocal.manifest import RunManifest
+
+LEASE_SECONDS = 30 * 60
+MAX_ATTEMPTS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    id TEXT PRIMARY KEY,
+    paths TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+)
+"""
+
+
+def make_shards(file_paths: Iterable[Path]) -> dict[str, list[str]]:
+    """
+    Groups recordings named ``<pnum>/<YYYYMMDD_HHMMSS>.WAV`` into one shard
+    per pnum and day. Shard ids (``<pnum>_<YYYYMMDD>``) only depend on the
+    recordings, so the same selection always produces the same shards.
+    """
+    shards = {}
+    for f in sorted(Path(p) for p in file_paths):
+        shards.setdefault(f"{f.parent.name}_{f.stem[:8]}", []).append(str(f))
+    return shards
+
+
+def worker_id() -> str:
+    """
+    Returns an id unique to this process across the nodes: host and pid.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class ShardQueue:
+    """
+    Lease-based queue of shards in an SQLite database.
+
+    Args:
+        path (Path): Database file, on storage shared by the workers;
+            created if it does not exist.
+        lease_seconds (float): How long a claim lasts without being renewed.
+        max_attempts (int): Claims after which a shard that keeps failing,
+            or whose worker keeps dying, is marked failed.
+    """
+
+    def __init__(self, path: Path, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Transactions are managed explicitly, so claims can take the write
+        # lock before reading
+        self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=DELETE")
+        self._db.execute(_SCHEMA)
+
+    def _transaction(self, query: str, params: tuple = ()) -> list:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(query, params).fetchall()
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return rows
+
+    def add(self, shards: dict[str, list[str]]) -> int:
+        """
+        Adds shards from make_shards. Shards already in the queue, whatever
+        their status, are left untouched, so enqueueing the same selection
+        again only adds new recordings' shards. Recordings added to a shard
+        already queued (e.g. copied late from the field) get a shard of their
+        own, ``<shard_id>-<hash of their paths>``.
+
+        Returns:
+            int: Number of shards added.
+        """
+        with self._lock:
+            before = self._db.total_changes
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                ids, queued = set(), set()
+                for shard_id, paths in self._db.execute("SELECT id, paths FROM shards"):
+                    ids.add(shard_id)
+                    queued.update(json.loads(paths))
+                rows = []
+                for shard_id, paths in shards.items():
+                    missing = [p for p in paths if p not in queued]
+                    if not missing:
+                        continue
+                    if shard_id in ids:
+                        digest = hashlib.sha1(json.dumps(missing).encode(), usedforsecurity=False).hexdigest()
+                        shard_id = f"{shard_id}-{digest[:10]}"
+                    rows.append((shard_id, json.dumps(missing)))
+                self._db.executemany("INSERT OR IGNORE INTO shards (id, paths) VALUES (?, ?)", rows)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            return self._db.total_changes - before
+
+    def claim(self, owner: str) -> Optional[tuple[str, list[str]]]:
+        """
+        Leases the next pending shard, or one whose lease has expired, to
+        ``owner``.
+
+        Returns:
+            tuple[str, list[str]] or None: The shard id and its recordings,
+            or None if there is nothing left to claim.
+        """
+        now = time.time()
+        # Shards whose worker died too often are given up on
+        self._transaction(
+            "UPDATE shards SET status = 'failed', error = 'lease expired' "
+            "WHERE status = 'leased' AND expires < ? AND attempts >= ?",
+            (now, self.max_attempts),
+        )
+        rows = self._transaction(
+            "UPDATE shards SET status = 'leased', owner = ?, expires = ?, attempts = attempts + 1 "
+            "WHERE id = (SELECT id FROM shards WHERE status = 'pending' OR (status = 'leased' AND expires < ?) "
+            "ORDER BY id LIMIT 1) RETURNING id, paths",
+            (owner, now + self.lease_seconds, now),
+        )
+        if not rows:
+            return None
+        shard_id, paths = rows[0]
+        return shard_id, json.loads(paths)
+
+    def renew(self, shard_id: str, owner: str) -> bool:
+        """
+        Extends the lease of ``owner`` on a shard.
+
+        Returns:
+            bool: False if the lease was lost (it expired and the shard was
+            claimed by another worker).
+        """
+        rows = self._transaction(
+            "UPDATE shards SET expires = ? WHERE id = ? AND owner = ? AND status = 'leased' RETURNING id",
+            (time.time() + self.lease_seconds, shard_id, owner),
+        )
+        return bool(rows)
+
+    def complete(self, shard_id: str, owner: str) -> bool:
+        """
+        Marks a shard done.
+
+        Returns:
+            bool: False if ``owner`` no longer held the lease. Its output is
+            still valid, since shards are deterministic.
+        """
+        rows = self._transaction(
+            "UPDATE shards SET status = 'done', expires = NULL, error = NULL "
+            "WHERE id = ? AND owner = ? AND status = 'leased' RETURNING id",
+            (shard_id, owner),
+        )
+        return bool(rows)
+
+    def fail(self, shard_id: str, owner: str, error: str) -> None:
+        """
+        Releases a shard whose processing raised; it is retried unless it has
+        been attempted ``max_attempts`` times.
+        """
+        self._transaction(
+            "UPDATE shards SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "expires = NULL, error = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+            (self.max_attempts, error, shard_id, owner),
+        )
+
+    def summary(self) -> dict[str, int]:
+        """
+        Returns the number of shards with each status.
+        """
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM shards GROUP BY status"))
+
+    def failures(self) -> list[tuple[str, str]]:
+        """
+        Returns ``(shard_id, error)`` for every failed shard.
+        """
+        with self._lock:
+            return list(self._db.execute("SELECT id, error FROM shards WHERE status = 'failed' ORDER BY id"))
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "ShardQueue":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _heartbeat(queue: ShardQueue, shard_id: str, owner: str, stop: threading.Event) -> None:
+    while not stop.wait(queue.lease_seconds / 3):
+        if not queue.renew(shard_id, owner):
+            return
+
+
+def work(
+    queue: ShardQueue,
+    out_dir: Path,
+    process: Callable[[list[Path]], Iterable[dict]],
+    owner: Optional[str] = None,
+    max_shards: Optional[int] = None,
+) -> int:
+    """
+    Claims and processes shards until the queue is empty.
+
+    The records of each shard are written to ``out_dir/<shard_id>.sqlite``
+    (a RunManifest) through a temporary file, so a shard's output is either
+    complete or absent, and is only then marked done. The lease is renewed
+    in the background while the shard is processed.
+
+    Args:
+        queue (ShardQueue): The queue.
+        out_dir (Path): Folder for the per-shard manifests, on shared storage.
+        process (Callable): Takes the recordings of a shard and returns
+            their manifest records, e.g. a wrapper around
+            majorvocal.inference.run_inference with process_files.
+        owner (str, optional): Worker id; defaults to worker_id().
+        max_shards (int, optional): Stop after this many shards.
+
+    Returns:
+        int: Number of shards processed.
+    """
+    owner = owner or worker_id()
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    n = 0
+    while max_shards is None or n < max_shards:
+        claimed = queue.claim(owner)
+        if claimed is None:
+            break
+        shard_id, paths = claimed
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_heartbeat, args=(queue, shard_id, owner, stop), daemon=True)
+        heartbeat.start()
+        tmp = out_dir / f".{shard_id}.{os.getpid()}.sqlite"
+        try:
+            with RunManifest(tmp) as manifest:
+                manifest.record(process([Path(p) for p in paths]))
+            tmp.replace(out_dir / f"{shard_id}.sqlite")
+        except Exception:
+            for leftover in out_dir.glob(f"{tmp.name}*"):  # with its -wal and -shm files
+                leftover.unlink(missing_ok=True)
+            queue.fail(shard_id, owner, traceback.format_exc(limit=1).strip())
+        else:
+            queue.complete(shard_id, owner)
+        finally:
+            stop.set()
+            heartbeat.join()
+        n += 1
+    return n
+
+
+def merge_shards(out_dir: Path, manifest: RunManifest) -> int:
+    """
+    Merges the per-shard manifests written by ``work`` into ``manifest``
+    and removes them.
+
+    Returns:
+        int: Number of shards merged.
+    """
+    shard_files = sorted(Path(out_dir).glob("[!.]*.sqlite"))
+    for shard_file in shard_files:
+        manifest.merge(shard_file)
+        shard_file.unlink()
+    return len(shard_files)
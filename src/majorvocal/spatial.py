@@ -0,0 +1,244 @@
+"""
+Neighbouring nestboxes and how closely their daily activity follows each other.
+
+NestboxIndex keeps the nestbox coordinates (``data/metadata/nestboxes.csv``,
+in metres on a projected grid) in a KD-tree, so the boxes within a radius of
+another, or its k nearest, are found without computing every distance.
+
+neighbour_correlations correlates the daily song counts (see
+majorvocal.aggregate.daily_counts) of every pair of boxes closer than a
+radius that were both recorded in the same year. Each year is a pnums × days
+matrix, with NaN on the days a box was not recorded, and pairs are correlated
+``block`` at a time over the days both boxes were recorded, so memory depends
+on the block size and the length of the season, not on the number of pairs.
+Years are independent and processed in parallel.
+"""
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from functools import partial
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+import polars as pl
+
+MIN_DAYS = 5
+
+PAIR_SCHEMA = {
+    "year": pl.Int32,
+    "pnum_a": pl.String,
+    "pnum_b": pl.String,
+    "distance": pl.Float64,
+    "days": pl.Int32,
+    "r": pl.Float64,
+}
+
+
+def nestbox(pnum: str) -> str:
+    """
+    Returns the nestbox of a pnum (``20201EX26`` -> ``EX26``).
+    """
+    return pnum[5:]
+
+
+class NestboxIndex:
+    """
+    KD-tree of nestbox coordinates.
+
+    Args:
+        names (Iterable[str]): Nestbox names, e.g. ``EX26``.
+        coords (np.ndarray): Their x and y coordinates, in metres.
+
+    Raises:
+        ValueError: If names are repeated or do not match the coordinates.
+    """
+
+    def __init__(self, names: Iterable[str], coords: np.ndarray):
+        from scipy.spatial import cKDTree
+
+        self.names = list(names)
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        if len(self.names) != len(self.coords) or len(set(self.names)) != len(self.names):
+            raise ValueError("Expected one pair of coordinates per nestbox, and unique names")
+        self._positions = {name: i for i, name in enumerate(self.names)}
+        self._tree = cKDTree(self.coords)
+
+    @classmethod
+    def from_csv(cls, path: Path, name: str = "nestbox", x: str = "x", y: str = "y") -> "NestboxIndex":
+        """
+        Reads the nestbox coordinates from a CSV file with one row per box.
+        Rows without coordinates are skipped.
+        """
+        df = pl.read_csv(path, columns=[name, x, y]).drop_nulls()
+        return cls(df[name].cast(pl.String), df.select(x, y).to_numpy())
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._positions
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.coords[self._positions[name]]
+
+    def within(self, name: str, radius: float) -> list[tuple[str, float]]:
+        """
+        Returns the other nestboxes within ``radius`` metres of ``name`` and
+        their distances, nearest first.
+        """
+        point = self[name]
+        rows = np.array(self._tree.query_ball_point(point, radius), dtype=int)
+        distances = np.hypot(*(self.coords[rows] - point).T)
+        order = np.argsort(distances, kind="stable")
+        return [(self.names[i], float(d)) for i, d in zip(rows[order], distances[order]) if self.names[i] != name]
+
+    def nearest(self, name: str, k: int) -> list[tuple[str, float]]:
+        """
+        Returns the ``k`` nestboxes nearest to ``name`` and their distances,
+        nearest first.
+        """
+        k = min(k, len(self) - 1)
+        if k < 1:
+            return []
+        distances, rows = self._tree.query(self[name], k=k + 1)
+        return [(self.names[i], float(d)) for d, i in zip(distances, rows) if self.names[i] != name][:k]
+
+    def pairs(self, radius: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the pairs of nestboxes within ``radius`` metres of each other,
+        as positions in ``names`` (an array of shape (n, 2), the first
+        position lower than the second) and their distances.
+        """
+        pairs = self._tree.query_pairs(radius, output_type="ndarray")
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        return pairs, np.hypot(*(self.coords[pairs[:, 0]] - self.coords[pairs[:, 1]]).T)
+
+
+def daily_matrix(daily: pl.DataFrame) -> tuple[np.ndarray, list[str], list[date]]:
+    """
+    Returns the daily counts as a pnums × days matrix with NaN on the days a
+    pnum was not recorded, and the labels of its rows and columns.
+
+    Args:
+        daily (pl.DataFrame): Rows with pnum, date and count, e.g. the
+            output of majorvocal.aggregate.daily_counts.
+    """
+    pnums = sorted(daily["pnum"].unique().to_list())
+    if not pnums:
+        return np.zeros((0, 0)), [], []
+    first, last = daily["date"].min(), daily["date"].max()
+    days = pl.date_range(first, last, eager=True).to_list()
+    matrix = np.full((len(pnums), len(days)), np.nan)
+    rows = daily["pnum"].replace_strict(pnums, list(range(len(pnums)))).to_numpy()
+    columns = (daily["date"].to_numpy() - np.datetime64(first, "D")).astype(np.int64)
+    matrix[rows, columns] = daily["count"].to_numpy()
+    return matrix, pnums, days
+
+
+def correlate_pairs(
+    matrix: np.ndarray, pairs: np.ndarray, min_days: int = MIN_DAYS, block: int = 4096
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Pearson correlation between pairs of rows of ``matrix``, over the columns
+    where neither is NaN.
+
+    Args:
+        matrix (np.ndarray): One row per series, NaN where missing.
+        pairs (np.ndarray): Row positions, of shape (n, 2).
+        min_days (int): Pairs with fewer shared columns get NaN.
+        block (int): Pairs correlated at a time.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The correlation of each pair (NaN if
+        too few shared columns, or if one series is constant over them) and
+        the number of shared columns.
+    """
+    r = np.full(len(pairs), np.nan)
+    n = np.zeros(len(pairs), dtype=np.int64)
+    for start in range(0, len(pairs), block):
+        a, b = matrix[pairs[start : start + block, 0]], matrix[pairs[start : start + block, 1]]
+        shared = ~(np.isnan(a) | np.isnan(b))
+        count = shared.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            a = np.where(shared, a, 0.0)
+            b = np.where(shared, b, 0.0)
+            a -= np.where(shared, (a.sum(axis=1) / count)[:, None], 0.0)
+            b -= np.where(shared, (b.sum(axis=1) / count)[:, None], 0.0)
+            block_r = (a * b).sum(axis=1) / np.sqrt((a * a).sum(axis=1) * (b * b).sum(axis=1))
+        r[start : start + len(count)] = np.where(count >= min_days, block_r, np.nan)
+        n[start : start + len(count)] = count
+    return r, n
+
+
+def _correlate_year(
+    year_daily: tuple[int, pl.DataFrame], index: NestboxIndex, radius: float, min_days: int, block: int
+) -> pl.DataFrame:
+    year, daily = year_daily
+    matrix, pnums, _ = daily_matrix(daily.filter(pl.col("pnum").str.slice(5).is_in(index.names)))
+    if not pnums:
+        return pl.DataFrame(schema=PAIR_SCHEMA)
+    # Pnums rather than nestboxes, as a box can have two breeding attempts a year
+    pairs, distances = NestboxIndex(pnums, [index[nestbox(p)] for p in pnums]).pairs(radius)
+    r, n = correlate_pairs(matrix, pairs, min_days, block)
+    return pl.DataFrame(
+        {
+            "year": [year] * len(pairs),
+            "pnum_a": [pnums[i] for i in pairs[:, 0]],
+            "pnum_b": [pnums[i] for i in pairs[:, 1]],
+            "distance": distances,
+            "days": n,
+            "r": r,
+        },
+        schema=PAIR_SCHEMA,
+    )
+
+
+def neighbour_correlations(
+    daily: pl.DataFrame,
+    index: NestboxIndex,
+    radius: float,
+    min_days: int = MIN_DAYS,
+    block: int = 4096,
+    n_workers: Optional[int] = None,
+    start_method: str = "spawn",
+) -> pl.DataFrame:
+    """
+    Correlates the daily activity of every pair of nestboxes within
+    ``radius`` metres of each other that were recorded in the same year.
+
+    Args:
+        daily (pl.DataFrame): Rows with pnum, date and count, e.g. the
+            output of majorvocal.aggregate.daily_counts. Pnums of nestboxes
+            missing from ``index`` are skipped.
+        index (NestboxIndex): Nestbox coordinates.
+        radius (float): Maximum distance between the boxes of a pair, in
+            metres.
+        min_days (int): Pairs recorded together on fewer days get a null
+            correlation.
+        block (int): Pairs correlated at a time.
+        n_workers (int, optional): Processes, one per year at most; one per
+            core by default. With 1, years are processed in this process.
+        start_method (str): multiprocessing start method of the pool.
+
+    Returns:
+        pl.DataFrame: One row per pair with the year, both pnums, their
+        distance, the number of days both were recorded and the Pearson
+        correlation of their daily counts; sorted by year and pnums.
+    """
+    daily = daily.select("pnum", "date", pl.col("count").cast(pl.Float64))
+    years = sorted(daily.with_columns(year=pl.col("date").dt.year()).partition_by("year", as_dict=True).items())
+    items = [(year, frame.drop("year")) for (year,), frame in years]
+    work = partial(_correlate_year, index=index, radius=radius, min_days=min_days, block=block)
+    with contextlib.ExitStack() as stack:
+        if n_workers == 1 or len(items) < 2:
+            results = map(work, items)
+        else:
+            context = multiprocessing.get_context(start_method)
+            n_workers = min(n_workers or len(items), len(items))
+            results = stack.enter_context(ProcessPoolExecutor(n_workers, mp_context=context)).map(work, items)
+        frames = list(results)
+    if not frames:
+        return pl.DataFrame(schema=PAIR_SCHEMA)
+    return pl.concat(frames).with_columns(pl.col("r").fill_nan(None)).sort("year", "pnum_a", "pnum_b")
@@ -0,0 +1,183 @@
+"""
+Pipeline stages and the DAG that runs them.
+
+Each stage declares the stages it depends on, the files it reads and the
+parameters that change its output. Before a stage runs, a fingerprint of its
+inputs and parameters is compared with the one stored after its last
+successful run, and the stage is skipped if nothing changed and its outputs
+exist. Because a stage's inputs include the outputs of the stages upstream of
+it, a change anywhere reruns exactly the stages downstream of it.
+
+Files are fingerprinted by content. Directories (e.g. Parquet datasets, whose
+files are written once and never modified) are fingerprinted by the relative
+path, size and modification time of every file in them, which avoids reading
+gigabytes of data to decide that nothing changed.
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+
+def fingerprint(paths: Iterable[Path], params: Optional[dict] = None) -> str:
+    """
+    Returns a hash of the contents of ``paths`` and of ``params``.
+
+    Args:
+        paths (Iterable[Path]): Files (hashed by content) and directories
+            (hashed by the path, size and mtime of the files in them).
+            Missing paths are hashed as missing.
+        params (dict, optional): JSON-serialisable parameters.
+    """
+    digest = hashlib.sha1(usedforsecurity=False)
+    digest.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+    for path in paths:
+        path = Path(path)
+        digest.update(f"\0{path}\0".encode())
+        if path.is_file():
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(2**20), b""):
+                    digest.update(block)
+        elif path.is_dir():
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    stat = os.stat(os.path.join(root, name))
+                    relpath = os.path.relpath(os.path.join(root, name), path)
+                    digest.update(f"{relpath}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+        else:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+
+class Stage:
+    """
+    A step of the pipeline.
+
+    Args:
+        name (str): Name of the stage, also its CLI subcommand.
+        run (Callable): Function taking the parameters dict and doing the
+            work; its return value is reported.
+        inputs (Callable): Function taking the parameters dict and returning
+            the paths whose changes make the stage rerun.
+        outputs (Callable): Function taking the parameters dict and returning
+            the paths the stage writes; the stage reruns if any is missing.
+        deps (list[str]): Stages that must run (or be up to date) first.
+        params (list[str]): Names of the parameters that change the output
+            of the stage (e.g. filters, but not the number of workers).
+        always (bool): Run the stage every time, e.g. because it is
+            incremental itself and cheap to run.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: Callable[[dict], object],
+        inputs: Callable[[dict], list[Path]] = lambda params: [],
+        outputs: Callable[[dict], list[Path]] = lambda params: [],
+        deps: Iterable[str] = (),
+        params: Iterable[str] = (),
+        always: bool = False,
+    ):
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.outputs = outputs
+        self.deps = list(deps)
+        self.params = list(params)
+        self.always = always
+
+    def fingerprint(self, params: dict) -> str:
+        return fingerprint(self.inputs(params), {k: params.get(k) for k in self.params})
+
+
+class Pipeline:
+    """
+    A DAG of stages whose fingerprints are kept in a JSON state file.
+
+    Args:
+        stages (Iterable[Stage]): The stages; dependencies must be among them.
+        state_file (Path): Where the fingerprints of the last successful
+            runs are kept.
+    """
+
+    def __init__(self, stages: Iterable[Stage], state_file: Path):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_file = Path(state_file)
+
+    def _state(self) -> dict:
+        if not self.state_file.exists():
+            return {}
+        return json.loads(self.state_file.read_text())
+
+    def _save_state(self, state: dict) -> None:
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state, indent=2))
+        tmp.replace(self.state_file)
+
+    def plan(self, targets: Iterable[str], with_deps: bool = True) -> list[str]:
+        """
+        Returns the stages needed for ``targets``, in dependency order.
+
+        Raises:
+            KeyError: If a stage is unknown.
+            ValueError: If the dependencies contain a cycle.
+        """
+        order, visiting = [], set()
+
+        def visit(name: str) -> None:
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle through stage {name!r}")
+            visiting.add(name)
+            if with_deps:
+                for dep in self.stages[name].deps:
+                    visit(dep)
+            visiting.discard(name)
+            order.append(name)
+
+        for target in targets:
+            if target not in self.stages:
+                raise KeyError(f"Unknown stage {target!r}; expected one of {sorted(self.stages)}")
+            visit(target)
+        return order
+
+    def run(
+        self, targets: Iterable[str], params: Optional[dict] = None, with_deps: bool = True, force: bool = False
+    ) -> dict[str, dict]:
+        """
+        Runs ``targets`` and the stages they depend on, skipping those that
+        are up to date.
+
+        Args:
+            targets (Iterable[str]): Stages to bring up to date.
+            params (dict, optional): Parameters passed to every stage.
+            with_deps (bool): Also bring the dependencies up to date.
+            force (bool): Run the stages even if they are up to date.
+
+        Returns:
+            dict[str, dict]: For each stage, whether it ran, its result and
+            the time it took.
+        """
+        params = params or {}
+        state = self._state()
+        report = {}
+        for name in self.plan(targets, with_deps):
+            stage = self.stages[name]
+            key = stage.fingerprint(params)
+            outputs_exist = all(Path(p).exists() for p in stage.outputs(params))
+            if not (force or stage.always) and state.get(name) == key and outputs_exist:
+                report[name] = {"ran": False}
+                continue
+            start = time.perf_counter()
+            result = stage.run(params)
+            report[name] = {"ran": True, "result": result, "seconds": time.perf_counter() - start}
+            # Inputs are hashed before running, so changes made while the
+            # stage ran are picked up next time
+            state[name] = key
+            self._save_state(state)
+        return report
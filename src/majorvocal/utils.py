@@ -1,72 +1,335 @@
-import json
+from datetime import date
 from pathlib import Path
+from typing import Iterable, Mapping, Optional, Union
 
 import pandas as pd
+import polars as pl
+import pyarrow as pa
 from tqdm import tqdm
 
+from majorvocal.detections import iter_batches, read_detections
 
-def extract_parus_major(data: list[list[str, str, list[dict]]]) -> list[dict]:
+# Fields of each detection that are kept; any others (e.g. common_name,
+# label) are dropped while converting to Arrow.
+DETECTION_TYPE = pa.list_(
+    pa.struct(
+        [
+            ("scientific_name", pa.string()),
+            ("start_time", pa.float64()),
+            ("end_time", pa.float64()),
+            ("confidence", pa.float64()),
+        ]
+    )
+)
+
+PMAJOR_SCHEMA = {
+    "timestamp": pl.String,
+    "pnum": pl.String,
+    "start_time": pl.Float64,
+    "end_time": pl.Float64,
+    "confidence": pl.Float64,
+}
+
+
+SPECIES_SCHEMA = {
+    "timestamp": pl.String,
+    "pnum": pl.String,
+    "species": pl.Categorical,
+    "start_time": pl.Float64,
+    "end_time": pl.Float64,
+    "confidence": pl.Float64,
+}
+
+Species = Union[str, Iterable[str], Mapping[str, float]]
+
+
+def _thresholds(species: Optional[Species]) -> Optional[dict[str, float]]:
+    """
+    Returns the minimum confidence of each species to keep, or None to keep
+    every detection.
+    """
+    if species is None:
+        return None
+    if isinstance(species, str):
+        return {species: 0.0}
+    if isinstance(species, Mapping):
+        return {name: float(threshold) for name, threshold in species.items()}
+    return dict.fromkeys(species, 0.0)
+
+
+def _species_dtype(thresholds: Optional[dict[str, float]]) -> pl.DataType:
+    return pl.Categorical if thresholds is None else pl.Enum(sorted(thresholds))
+
+
+def _kept(name: pl.Expr, confidence: pl.Expr, thresholds: dict[str, float]) -> pl.Expr:
+    """
+    Whether a detection is of one of the species, with at least its minimum
+    confidence; one vectorised lookup whatever the number of species.
+    """
+    names, values = list(thresholds), list(thresholds.values())
+    return confidence >= name.replace_strict(names, values, default=None, return_dtype=pl.Float64)
+
+
+def _flatten(batch: list[list[str, str, list[dict]]], thresholds: Optional[dict[str, float]]) -> pl.DataFrame:
+    timestamps, pnums, detections = zip(*batch)
+    df = pl.from_arrow(
+        pa.table(
+            {
+                "timestamp": pa.array(timestamps, pa.string()),
+                "pnum": pa.array(pnums, pa.string()),
+                "detections": pa.array(detections, DETECTION_TYPE),
+            }
+        )
+    )
+    if thresholds is not None:
+        detection = pl.element().struct
+        kept = _kept(detection.field("scientific_name"), detection.field("confidence"), thresholds)
+        df = df.with_columns(pl.col("detections").list.eval(pl.element().filter(kept)))
+    return (
+        df
+        # Recordings without detections become a single row of nulls
+        .with_columns(pl.when(pl.col("detections").list.len() > 0).then(pl.col("detections")))
+        .explode("detections")
+        .unnest("detections")
+        .select(
+            "timestamp",
+            "pnum",
+            pl.col("scientific_name").cast(_species_dtype(thresholds)).alias("species"),
+            "start_time",
+            "end_time",
+            "confidence",
+        )
+    )
+
+
+def _extract(
+    data: Iterable[list[str, str, list[dict]]], thresholds: Optional[dict[str, float]], batch_size: int, desc: str
+) -> pl.DataFrame:
+    frames = []
+    with tqdm(desc=desc, unit=" recordings") as progress:
+        for batch in iter_batches(data, batch_size):
+            frames.append(_flatten(batch, thresholds))
+            progress.update(len(batch))
+    if not frames:
+        return pl.DataFrame(schema={**SPECIES_SCHEMA, "species": _species_dtype(thresholds)})
+    return pl.concat(frames)
+
+
+def extract_species(
+    data: Iterable[list[str, str, list[dict]]], species: Optional[Species] = None, batch_size: int = 100_000
+) -> pl.DataFrame:
+    """
+    Extracts the detections of several species in a single pass over the
+    data. The result is one long table with a dictionary-encoded species
+    column; use split_species to get one table per species.
+
+    Args:
+        data (Iterable[List[str, str, List[dict]]]): Recordings, as taken by
+            extract_parus_major.
+        species (str | Iterable[str] | Mapping[str, float], optional):
+            Scientific names of the species to keep, or a mapping from each
+            to the minimum confidence of its detections. None keeps every
+            detection.
+        batch_size (int): Number of recordings flattened at once.
+
+    Returns:
+        pl.DataFrame: One row per detection, with columns timestamp, pnum,
+            species (an Enum of the requested species, or a Categorical if
+            ``species`` is None), start_time, end_time and confidence, in
+            input order. Recordings without a detection of any of the species
+            contribute a single row where the other columns are null.
+    """
+    return _extract(data, _thresholds(species), batch_size, "Extracting Detections")
+
+
+def extract_parus_major(
+    data: Iterable[list[str, str, list[dict]]], species: Optional[str] = "Parus major", batch_size: int = 100_000
+) -> pl.DataFrame:
     """
-    Extracts detections of Parus major from the given data. For each recording,
-    the function checks if there is a detection of Parus major. If there is, it
-    extracts the timestamp, recording ID, start time, end time, and confidence
-    level of the detection. If there is no detection of Parus major, it adds
-    a dictionary with the timestamp, recording ID, start time, end time, and
-    confidence level as None.
+    Extracts detections of Parus major (or ``species``) from the given data.
+    Each recording with a detection contributes one row per detection, with
+    the timestamp, recording ID, start time, end time, and confidence level.
+    Recordings without a detection contribute a single row where start time,
+    end time, and confidence are null.
+
+    Recordings are flattened and filtered ``batch_size`` at a time, so only
+    the matching rows are kept in memory when ``data`` is a lazy iterable
+    such as majorvocal.detections.iter_records.
 
     Args:
-        data (List[List[str, str, List[dict]]]): A list of recordings, where each recording is a list
+        data (Iterable[List[str, str, List[dict]]]): Recordings, where each recording is a list
                      containing the timestamp, recording ID, and a list of dictionaries
                      containing the detections.
+        species (str, optional): Scientific name of the species to keep, or
+            None to keep all detections.
+        batch_size (int): Number of recordings flattened at once.
+
+    Returns:
+        pl.DataFrame: One row per detection (or per recording without
+            detections), with columns timestamp, pnum, start_time, end_time,
+            and confidence, in input order.
+    """
+    return _extract(data, _thresholds(species), batch_size, "Extracting Parus Major Detections").drop("species")
+
+
+def split_species(detections: pl.DataFrame) -> dict[str, pl.DataFrame]:
+    """
+    Splits the output of extract_species or load_species into one table per
+    species, each in the format returned by extract_parus_major: the
+    species' detections, and a row of nulls for each recording without one.
 
     Returns:
-        List[dict]: A list of dictionaries representing the Parus major detections. Each
-              dictionary contains the timestamp, recording ID, start time, end time,
-              and confidence level of the detection.
-    """
-    parus_major_detections = []
-
-    for recording in tqdm(data, desc="Extracting Parus Major Detections"):
-        timestamp, recording_id, detections = recording
-        n_pmajor = 0
-        for detection in detections:
-            if detection["scientific_name"] == "Parus major":
-                parus_major_detections.append(
-                    {
-                        "timestamp": timestamp,
-                        "pnum": recording_id,
-                        "date": timestamp.split("_")[0],
-                        "start_time": detection["start_time"],
-                        "end_time": detection["end_time"],
-                        "confidence": detection["confidence"],
-                    }
-                )
-                n_pmajor += 1
-        if n_pmajor == 0:
-            parus_major_detections.append(
-                {
-                    "timestamp": timestamp,
-                    "pnum": recording_id,
-                    "date": timestamp.split("_")[0],
-                    "start_time": None,
-                    "end_time": None,
-                    "confidence": None,
-                }
-            )
-
-    return parus_major_detections
-
-
-def to_df(pmajor: list[dict]) -> pd.DataFrame:
-    df = pd.DataFrame(pmajor)
-    df["date"] = pd.to_datetime(df["date"], format="%Y%m%d")
-    df["start_datetime"] = pd.to_datetime(df["timestamp"], format="%Y%m%d_%H%M%S") + pd.to_timedelta(
-        df["start_time"], unit="s"
+        dict[str, pl.DataFrame]: Tables by species, in the order of the
+        categories of the species column (every requested species, for an
+        Enum) and keeping the order of the rows.
+    """
+    dtype = detections.schema["species"]
+    if isinstance(dtype, pl.Enum):
+        names = dtype.categories.to_list()
+    else:
+        names = sorted(detections["species"].drop_nulls().unique().cast(pl.String).to_list())
+    recordings = detections.select("timestamp", "pnum").unique(maintain_order=True)
+    by_species = detections.drop_nulls("species").partition_by("species", as_dict=True, include_key=False)
+    empty = detections.clear().drop("species")
+    return {
+        name: recordings.join(
+            by_species.get((name,), empty), on=["timestamp", "pnum"], how="left", maintain_order="left_right"
+        ).cast(PMAJOR_SCHEMA)
+        for name in names
+    }
+
+
+def species_rows(detections: pl.DataFrame, species: Species) -> pl.DataFrame:
+    """
+    Keeps the detections of ``species`` from rows of the detections dataset
+    (see majorvocal.detections), and a row of nulls for each recording
+    without any.
+
+    Args:
+        detections (pl.DataFrame): Rows with at least timestamp, pnum,
+            scientific_name, start_time, end_time and confidence.
+        species (str | Iterable[str] | Mapping[str, float]): As taken by
+            extract_species.
+
+    Returns:
+        pl.DataFrame: As returned by extract_species, sorted by pnum,
+            timestamp, species and start time.
+    """
+    thresholds = _thresholds(species)
+    df = detections.with_columns(pl.col("scientific_name").cast(pl.String))
+    hits = df.filter(_kept(pl.col("scientific_name"), pl.col("confidence"), thresholds))
+    hits = hits.select("timestamp", "pnum", pl.col("scientific_name").alias("species"), *list(PMAJOR_SCHEMA)[2:])
+    missing = df.select("timestamp", "pnum").unique().join(hits, on=["timestamp", "pnum"], how="anti")
+    return (
+        pl.concat([hits, missing], how="diagonal_relaxed")
+        .sort("pnum", "timestamp", "species", "start_time", nulls_last=True)
+        .cast({**SPECIES_SCHEMA, "species": _species_dtype(thresholds)})
+        .select(list(SPECIES_SCHEMA))
+    )
+
+
+def load_species(
+    root: Path,
+    species: Species,
+    pnums: Optional[Iterable[str]] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+) -> pl.DataFrame:
+    """
+    Reads the detections of several species from the Parquet detections
+    dataset in a single pass, in the format returned by extract_species.
+    Only the partitions and row groups matching ``pnums`` and the date range
+    are read.
+
+    Args:
+        root (Path): Root directory of the detections dataset.
+        species (str | Iterable[str] | Mapping[str, float]): As taken by
+            extract_species.
+        pnums (Iterable[str], optional): Only these nestbox-years.
+        start_date (date, optional): First date, inclusive.
+        end_date (date, optional): Last date, inclusive.
+    """
+    table = read_detections(
+        root,
+        pnums=pnums,
+        start_date=start_date,
+        end_date=end_date,
+        columns=["timestamp", "pnum", "scientific_name", "start_time", "end_time", "confidence"],
+    )
+    return species_rows(pl.from_arrow(table), species)
+
+
+def load_parus_major(
+    root: Path,
+    species: str = "Parus major",
+    pnums: Optional[Iterable[str]] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+) -> pl.DataFrame:
+    """
+    Reads the detections of Parus major (or ``species``) from the Parquet
+    detections dataset, in the format returned by extract_parus_major. Only
+    the partitions and row groups matching ``pnums`` and the date range are
+    read.
+
+    Args:
+        root (Path): Root directory of the detections dataset.
+        species (str): Scientific name of the species to keep.
+        pnums (Iterable[str], optional): Only these nestbox-years.
+        start_date (date, optional): First date, inclusive.
+        end_date (date, optional): Last date, inclusive.
+
+    Returns:
+        pl.DataFrame: One row per detection (or per recording without
+            detections), sorted by pnum, timestamp and start time.
+    """
+    return load_species(root, species, pnums, start_date, end_date).drop("species").cast(PMAJOR_SCHEMA)
+
+
+def select_species(detections: pl.DataFrame, species: str = "Parus major") -> pl.DataFrame:
+    """
+    Keeps the detections of ``species`` from rows of the detections dataset
+    (see majorvocal.detections), and a row of nulls for each recording
+    without one.
+
+    Args:
+        detections (pl.DataFrame): Rows with at least timestamp, pnum,
+            scientific_name, start_time, end_time and confidence.
+        species (str): Scientific name of the species to keep.
+
+    Returns:
+        pl.DataFrame: As returned by extract_parus_major, sorted by pnum,
+            timestamp and start time.
+    """
+    return species_rows(detections, species).drop("species").cast(PMAJOR_SCHEMA)
+
+
+def to_df(pmajor: Union[pl.DataFrame, list[dict]]) -> pd.DataFrame:
+    """
+    Adds dates, start and end datetimes, location, year and day of year to
+    the output of extract_parus_major. Timestamps are parsed once.
+
+    Args:
+        pmajor (pl.DataFrame | list[dict]): Detections, with columns
+            timestamp, pnum, start_time, end_time, and confidence.
+
+    Returns:
+        pd.DataFrame: The detections with the derived columns.
+    """
+    df = pmajor if isinstance(pmajor, pl.DataFrame) else pl.DataFrame(pmajor)
+    recorded = pl.col("timestamp").str.strptime(pl.Datetime("us"), "%Y%m%d_%H%M%S")
+    df = df.with_columns(recorded.alias("_recorded"))
+    start = pl.duration(microseconds=(pl.col("start_time") * 1e6).cast(pl.Int64))
+    end = pl.duration(microseconds=(pl.col("end_time") * 1e6).cast(pl.Int64))
+    df = df.with_columns(
+        (pl.col("_recorded") + start).alias("start_datetime"),
+        (pl.col("_recorded") + end).alias("end_datetime"),
     )
-    df["end_datetime"] = pd.to_datetime(df["timestamp"], format="%Y%m%d_%H%M%S") + pd.to_timedelta(
-        df["end_time"], unit="s"
+    df = df.with_columns(
+        pl.col("_recorded").dt.truncate("1d").alias("date"),
+        pl.col("pnum").str.slice(5).alias("location"),
+        pl.col("start_datetime").dt.year().cast(pl.Int32).alias("year"),
+        pl.col("start_datetime").dt.ordinal_day().cast(pl.Int32).alias("dayofyear"),
     )
-    df["location"] = df["pnum"].str[5:]
-    df["year"] = df["start_datetime"].dt.year
-    df["dayofyear"] = df["start_datetime"].dt.dayofyear
-    return df
+    columns = ["timestamp", "pnum", "date", "start_time", "end_time", "confidence", "start_datetime", "end_datetime"]
+    return df.select(columns + ["location", "year", "dayofyear"]).to_pandas()
@@ -0,0 +1,217 @@
+"""
+Memory-mapped WAV reading with lazily resampled analysis windows.
+
+librosa decodes and resamples a whole recording before it is chunked, so a
+worker holds the full signal at the native and at the target sample rate; for
+long or high sample rate AudioMoth recordings that is hundreds of MB. WavReader
+memory-maps the PCM data instead, and computes each 3-second window when it is
+needed from the samples around it, with a polyphase filter (scipy's
+``resample_poly``). Windows are aligned on the filter's period and read with
+enough context on each side that every window is identical to the same samples
+of the whole recording resampled at once. Memory use therefore depends on the
+window and batch sizes, not on the length of the recording.
+
+The polyphase filter is not librosa's ``kaiser_fast`` resampler, so the
+samples differ slightly from those of majorvocal.audio.load_chunks unless the
+recording is already at 48 kHz, in which case they are identical.
+"""
+import copy
+import math
+import struct
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+import numpy as np
+
+from majorvocal.audio import CHUNK_SECONDS, MIN_CHUNK_SECONDS, SAMPLE_RATE
+from majorvocal.metrics import Stopwatch
+
+_PCM, _FLOAT, _EXTENSIBLE = 1, 3, 0xFFFE
+
+
+class WavReader:
+    """
+    Reads the header of a PCM (8, 16, 24 or 32-bit) or float WAV file and
+    memory-maps its samples.
+
+    Args:
+        path (Path): WAV file.
+
+    Raises:
+        ValueError: If the file is not a WAV file, or its format is not
+            supported.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+            if riff != b"RIFF" or wave != b"WAVE":
+                raise ValueError(f"{self.path} is not a WAV file")
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError(f"{self.path} has no data chunk")
+                chunk_id, size = struct.unpack("<4sI", header)
+                if chunk_id == b"fmt ":
+                    fmt = f.read(size)
+                elif chunk_id == b"data":
+                    self.offset = f.tell()
+                    break
+                else:
+                    f.seek(size + size % 2, 1)
+        if fmt is None:
+            raise ValueError(f"{self.path} has no fmt chunk")
+        tag, self.channels, self.sample_rate, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+        if tag == _EXTENSIBLE:
+            tag = struct.unpack("<H", fmt[24:26])[0]
+        self.bits = bits
+        self.width = bits // 8
+        if (tag, bits) not in {(_PCM, 8), (_PCM, 16), (_PCM, 24), (_PCM, 32), (_FLOAT, 32), (_FLOAT, 64)}:
+            raise ValueError(f"{self.path}: unsupported WAV format {tag} with {bits} bits")
+        self.is_float = tag == _FLOAT
+        # Recorders that stop abruptly leave a wrong data size; trust the file size
+        size = min(size, self.path.stat().st_size - self.offset)
+        self.n_frames = size // (self.width * self.channels)
+        dtype = np.uint8 if bits in (8, 24) else np.dtype(f"<{'f' if self.is_float else 'i'}{self.width}")
+        shape = (self.n_frames, self.channels, 3) if bits == 24 else (self.n_frames, self.channels)
+        self._data = None
+        if self.n_frames:
+            self._data = np.memmap(self.path, dtype=dtype, mode="r", offset=self.offset, shape=shape)
+
+    @property
+    def duration(self) -> float:
+        return self.n_frames / self.sample_rate
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """
+        Returns frames ``start`` to ``stop`` as a mono float32 signal scaled
+        to [-1, 1), as librosa would.
+        """
+        start, stop = max(start, 0), min(stop, self.n_frames)
+        if stop <= start:
+            return np.zeros(0, dtype=np.float32)
+        frames = np.asarray(self._data[start:stop])
+        if self.bits == 8:
+            signal = (frames.astype(np.float32) - 128) / 128
+        elif self.bits == 24:
+            # Little-endian 24-bit samples, placed in the top bytes of an int32
+            padded = np.zeros(frames.shape[:2] + (4,), dtype=np.uint8)
+            padded[..., 1:] = frames
+            signal = padded.view("<i4")[..., 0].astype(np.float32) / 2**31
+        elif self.is_float:
+            signal = frames.astype(np.float32)
+        else:
+            signal = frames.astype(np.float32) / 2 ** (self.bits - 1)
+        return signal.mean(axis=1) if self.channels > 1 else signal[:, 0]
+
+
+class WavChunks:
+    """
+    The analysis windows of a recording, resampled to ``sr`` on demand. It
+    behaves like the array returned by majorvocal.audio.load_chunks
+    (``len``, iteration, ``shape`` and indexing by row, slice, index array or
+    mask), and windows are split as split_chunks does, but at most ``block``
+    windows are held in memory at a time while iterating.
+
+    Args:
+        path (Path | WavReader): The recording.
+        sr (int): Target sample rate.
+        overlap (float): Overlap between consecutive windows, in seconds.
+        block (int): Windows resampled together while iterating.
+        stopwatch (Stopwatch, optional): Receives the time spent reading
+            ("decode") and resampling ("resample").
+    """
+
+    def __init__(
+        self,
+        path: Union[Path, WavReader],
+        sr: int = SAMPLE_RATE,
+        overlap: float = 0.0,
+        block: int = 16,
+        stopwatch: Optional[Stopwatch] = None,
+    ):
+        self.reader = path if isinstance(path, WavReader) else WavReader(path)
+        self.sr = sr
+        self.block = block
+        self.stopwatch = stopwatch or Stopwatch()
+        self.window = int(sr * CHUNK_SECONDS)
+        self.step = int((CHUNK_SECONDS - overlap) * sr)
+        ratio = math.gcd(sr, self.reader.sample_rate)
+        self.up, self.down = sr // ratio, self.reader.sample_rate // ratio
+        # Context on each side: half of resample_poly's filter, in input
+        # frames, rounded up to whole filter periods
+        self.pad = (math.ceil(10 * max(self.up, self.down) / self.up) // self.down + 2) * self.down
+        self.length = -(-self.reader.n_frames * self.up // self.down)  # of the whole resampled signal
+        starts = np.arange(0, self.length, self.step)
+        self.starts = starts[self.length - starts >= int(MIN_CHUNK_SECONDS * sr)]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return (len(self), self.window)
+
+    def _resample(self, start: int, stop: int) -> np.ndarray:
+        """
+        Returns samples ``start`` to ``stop`` of the resampled recording.
+        """
+        from scipy.signal import resample_poly
+
+        stop = min(stop, self.length)
+        first = max(0, (start // self.up) * self.down - self.pad)  # a multiple of down, so phases line up
+        last = -(-stop * self.down // self.up) + self.pad
+        with self.stopwatch("decode"):
+            signal = self.reader.read(first, last)
+        if self.up == self.down:
+            return signal[start - first : stop - first]
+        with self.stopwatch("resample"):
+            resampled = resample_poly(signal, self.up, self.down).astype(np.float32, copy=False)
+        offset = start - first * self.up // self.down
+        return resampled[offset : offset + stop - start]
+
+    def _windows(self, rows: np.ndarray) -> np.ndarray:
+        out = np.zeros((len(rows), self.window), dtype=np.float32)
+        for first in range(0, len(rows), self.block):
+            starts = self.starts[rows[first : first + self.block]]
+            if np.all(np.diff(starts) == self.step):
+                # Consecutive windows: one resampling call for all of them
+                signal = self._resample(starts[0], starts[-1] + self.window)
+                windows = (signal[start : start + self.window] for start in starts - starts[0])
+            else:
+                windows = (self._resample(start, start + self.window) for start in starts)
+            for i, window in enumerate(windows, start=first):
+                out[i, : len(window)] = window
+        return out
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for first in range(0, len(self), self.block):
+            yield from self._windows(np.arange(first, min(first + self.block, len(self))))
+
+    def __getitem__(self, key) -> np.ndarray:
+        rows, rest = (key[0], key[1:]) if isinstance(key, tuple) else (key, ())
+        if isinstance(rows, (int, np.integer)):
+            return self._windows(np.arange(len(self))[[rows]])[0][rest]
+        return self._windows(np.arange(len(self))[rows])[(slice(None), *rest)]
+
+    def subset(self, rows) -> "WavChunks":
+        """
+        Returns the windows ``rows`` (an index array or mask), still read
+        lazily, e.g. the chunks kept by majorvocal.prefilter.
+        """
+        subset = copy.copy(self)
+        subset.starts = self.starts[np.arange(len(self))[rows]]
+        return subset
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return self[:] if dtype is None else self[:].astype(dtype)
+
+
+def open_chunks(file_path: Path, overlap: float = 0.0, stopwatch: Optional[Stopwatch] = None) -> WavChunks:
+    """
+    Drop-in replacement for majorvocal.audio.load_chunks that reads windows
+    lazily from a memory map.
+    """
+    return WavChunks(file_path, overlap=overlap, stopwatch=stopwatch)
@@ -0,0 +1,102 @@
+from datetime import date
+
+import numpy as np
+import polars as pl
+import pytest
+
+from majorvocal.activity import ActivityCube, bin_counts
+from majorvocal.aggregate import DerivedTables
+from majorvocal.detections import DetectionWriter
+from majorvocal.utils import to_df
+
+BROOD = pl.DataFrame({"pnum": ["20201EX26", "20201B5", "20211EX26"], "lay_date": ["2020-04-17"] * 2 + ["2021-04-20"]})
+
+
+def records(days, seed=0):
+    """
+    Recordings at 04:00 and 05:50 on each day, with random songs; the second
+    one runs past 06:00 into the next bin.
+    """
+    rng = np.random.default_rng(seed)
+    song = {"scientific_name": "Parus major", "common_name": "Great Tit"}
+    out = []
+    for pnum in BROOD["pnum"]:
+        for day in days:
+            for time in ("040000", "055000"):
+                starts = sorted(rng.choice(400, size=rng.integers(0, 6), replace=False) * 3.0)
+                detections = [{**song, "start_time": s, "end_time": s + 3, "confidence": 0.9} for s in starts]
+                out.append([f"{pnum[:4]}04{day}_{time}", pnum, detections])
+    return out
+
+
+def fold(tmp_path, new_records):
+    with DetectionWriter(tmp_path / "detections") as writer:
+        for record in new_records:
+            writer.add(record)
+    tables = DerivedTables(tmp_path / "tables")
+    tables.update(tmp_path / "detections", BROOD)
+    return tables
+
+
+def test_bin_counts_match_floored_start_times():
+    data = pl.DataFrame(
+        [
+            ("20200414_055000", "20201EX26", 0.0, 3.0, 0.9),
+            ("20200414_055000", "20201EX26", 597.0, 600.0, 0.9),
+            ("20200414_055000", "20201EX26", 603.0, 606.0, 0.9),  # starts after 06:00
+            ("20200415_040000", "20201EX26", None, None, None),
+        ],
+        schema=["timestamp", "pnum", "start_time", "end_time", "confidence"],
+        orient="row",
+    )
+
+    counts = bin_counts(data)
+
+    assert counts.rows() == [
+        ("20201EX26", date(2020, 4, 14), 11, 2),
+        ("20201EX26", date(2020, 4, 14), 12, 1),
+        ("20201EX26", date(2020, 4, 15), 8, 0),
+    ]
+    legacy = to_df(data).dropna(subset=["start_time"])["start_datetime"].dt.floor("30min")
+    assert (legacy.dt.hour * 2 + legacy.dt.minute // 30).tolist() == [11, 11, 12]
+
+
+def test_cube_updates_incrementally(tmp_path):
+    first, later = records(["14", "15"]), records(["21"], seed=1)
+    cube = ActivityCube(tmp_path / "activity")
+    assert cube.update(fold(tmp_path, first)) == {"pnums": 3, "removed": 0, "rewritten": 2}
+    assert cube.update(DerivedTables(tmp_path / "tables")) == {"pnums": 0, "removed": 0, "rewritten": 0}
+
+    tables = fold(tmp_path, later)
+    assert cube.update(tables) == {"pnums": 3, "removed": 0, "rewritten": 2}  # the date axes grow
+
+    cube = ActivityCube(tmp_path / "activity")
+    assert cube.years == [2020, 2021]
+    assert cube.pnums(2020) == ["20201B5", "20201EX26"]
+    assert cube.dates(2021) == [date(2021, 4, d) for d in range(14, 22)]
+    expected = bin_counts(tables.detections())
+    total = sum(int(cube.counts(year).sum()) for year in cube.years)
+    assert total == expected["count"].sum() == sum(len(r[2]) for r in first + later)
+    for pnum, day, bin, count in expected.rows():
+        counts, _, _ = cube.select(day.year, pnums=[pnum], start_date=day, end_date=day)
+        assert counts[0, 0, bin] == count
+
+    # Activity by time of day at one nestbox in one year
+    counts, pnums, days = cube.select(2020, locations=["EX26"], start_date=date(2020, 4, 15))
+    assert pnums == ["20201EX26"] and days[0] == date(2020, 4, 15) and counts.shape == (1, 7, 48)
+    hist = cube.time_of_day(years=[2020], locations=["EX26"], start_date=date(2020, 4, 15))
+    in_range = expected.filter((pl.col("pnum") == "20201EX26") & (pl.col("date") >= date(2020, 4, 15)))
+    assert hist.tolist() == [in_range.filter(pl.col("bin") == b)["count"].sum() for b in range(48)]
+    assert cube.time_of_day().sum() == total and np.all(cube.time_of_day()[:8] == 0)
+
+
+def test_cube_rebuilds_with_other_bins(tmp_path):
+    tables = fold(tmp_path, records(["14"]))
+    ActivityCube(tmp_path / "activity").update(tables)
+
+    hourly = ActivityCube(tmp_path / "activity", bin_minutes=60)
+    assert hourly.update(tables)["pnums"] == 3
+    assert hourly.counts(2020).shape == (2, 1, 24)
+    assert hourly.bins()[5] == 300
+    with pytest.raises(ValueError):
+        ActivityCube(tmp_path / "activity", bin_minutes=7)
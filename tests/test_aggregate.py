@@ -0,0 +1,146 @@
+from pathlib import Path
+
+import pandas as pd
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from majorvocal.aggregate import DerivedTables, daily_counts, date_bounds, peak_days, scaled_counts, subset_pnums
+from majorvocal.detections import DetectionWriter, write_detections
+from majorvocal.utils import to_df
+
+REFERENCE = Path(__file__).resolve().parents[1] / "data" / "derived" / "daily_counts.csv"
+
+
+# Implementation in scripts/0.3-processing.py before majorvocal.aggregate
+def legacy_daily_counts(detections, brood_data):
+    detections["count"] = detections["confidence"].notna().astype(int)
+    daily_counts = detections.groupby(["pnum", "date"], as_index=False)["count"].sum()
+    daily_counts = daily_counts.merge(brood_data, on="pnum")
+    daily_counts["date"] = pd.to_datetime(daily_counts["date"])
+    daily_counts["lay_date"] = pd.to_datetime(daily_counts["lay_date"])
+    daily_counts["days_from_lay"] = (daily_counts["date"] - daily_counts["lay_date"]).dt.days
+    date_range = (
+        daily_counts.groupby("pnum")["date"]
+        .agg(["min", "max"])
+        .rename(columns={"min": "date_first", "max": "date_last"})
+    )
+    daily_counts = daily_counts.merge(date_range, on="pnum")
+    return daily_counts[
+        (daily_counts["date"] >= daily_counts["date_first"]) & (daily_counts["date"] <= daily_counts["date_last"])
+    ]
+
+
+@pytest.fixture(scope="module")
+def reference():
+    return pd.read_csv(REFERENCE)
+
+
+@pytest.fixture(scope="module")
+def inputs(reference):
+    """
+    Brood data and detections that produce the reference daily counts: one
+    detection per counted song, plus a recording without detections per day.
+    """
+    brood = reference.drop(columns=["date", "count", "days_from_lay", "date_first", "date_last"])
+    brood = brood.drop_duplicates("pnum").reset_index(drop=True)
+    detections = []
+    for pnum, day, count in reference[["pnum", "date", "count"]].itertuples(index=False):
+        timestamp = day.replace("-", "") + "_050000"
+        detections += [(timestamp, pnum, 3.0 * i, 3.0 * i + 3, 0.9) for i in range(count)]
+        detections.append((day.replace("-", "") + "_060000", pnum, None, None, None))
+    # Detections of a pnum without brood data are dropped
+    detections.append(("20200401_050000", "20201XX1", 0.0, 3.0, 0.9))
+    columns = ["timestamp", "pnum", "start_time", "end_time", "confidence"]
+    return brood, pl.DataFrame(detections, schema=columns, orient="row")
+
+
+def as_csv(df, tmp_path):
+    df.to_csv(tmp_path / "daily_counts.csv", index=False)
+    return pd.read_csv(tmp_path / "daily_counts.csv")
+
+
+def test_daily_counts_matches_reference_csv(tmp_path, reference, inputs):
+    brood, detections = inputs
+    daily = daily_counts(detections, pl.from_pandas(brood))
+    pd.testing.assert_frame_equal(as_csv(daily.to_pandas(), tmp_path), reference)
+
+    legacy = legacy_daily_counts(to_df(detections), brood)
+    pd.testing.assert_frame_equal(as_csv(legacy, tmp_path), reference)
+
+
+def test_peak_days_and_subset_match_legacy(reference, inputs):
+    brood, detections = inputs
+    daily = daily_counts(detections, pl.from_pandas(brood))
+    legacy = legacy_daily_counts(to_df(detections), brood)
+
+    legacy_peaks = legacy.groupby("pnum", as_index=False).apply(lambda g: g.loc[g["count"].idxmax()])
+    peaks = peak_days(daily)
+    assert peaks["pnum"].to_list() == legacy_peaks["pnum"].tolist()
+    assert peaks["count"].to_list() == legacy_peaks["count"].tolist()
+    pd.testing.assert_series_equal(
+        peaks["days_from_lay"].to_pandas(), legacy_peaks["days_from_lay"].reset_index(drop=True), check_dtype=False
+    )
+
+    legacy_subset = legacy.groupby("pnum").filter(
+        lambda x: (-10 <= x["days_from_lay"].min() <= -3) and (1 <= x["days_from_lay"].max() <= 10)
+    )
+    subset = subset_pnums(daily)
+    assert len(subset) > 0
+    assert subset.select("pnum", "count").rows() == list(legacy_subset[["pnum", "count"]].itertuples(index=False))
+
+    bounds = date_bounds(daily).to_pandas().set_index("pnum")
+    pd.testing.assert_series_equal(
+        bounds["first_from_lay"], legacy.groupby("pnum")["days_from_lay"].min(), check_dtype=False, check_names=False
+    )
+    assert scaled_counts(daily).group_by("pnum").agg(pl.col("scaled_count").max())["scaled_count"].max() == 1
+
+
+def test_derived_tables_update_incrementally(tmp_path, inputs):
+    brood, detections = inputs
+    brood = pl.from_pandas(brood)
+    records = [
+        [timestamp, pnum, [{"scientific_name": "Parus major", **d} for d in rows if d["confidence"] is not None]]
+        for (timestamp, pnum), rows in detections.rows_by_key(["timestamp", "pnum"], named=True).items()
+    ]
+    first_days = [r for r in records if r[0] < "20200420"]
+    later_days = [r for r in records if r[0] >= "20200420"]
+    root = tmp_path / "detections"
+    tables = DerivedTables(tmp_path / "tables")
+
+    with DetectionWriter(root) as writer:
+        for record in first_days:
+            writer.add(record)
+    assert tables.update(root, brood)["files"] > 0
+    assert tables.update(root, brood) == {"files": 0, "pnums": 0}
+
+    with DetectionWriter(root) as writer:
+        for record in later_days:
+            writer.add(record)
+    report = tables.update(root, brood)
+    assert report["pnums"] == len({r[1] for r in later_days})
+
+    expected = daily_counts(detections, brood)
+    reloaded = DerivedTables(tmp_path / "tables")
+    assert_frame_equal(reloaded.daily, expected)
+    assert_frame_equal(reloaded.peaks, peak_days(expected))
+    assert len(reloaded.detections()) == len(detections.filter(pl.col("pnum").is_in(brood["pnum"].to_list()))) + 1
+
+    # Changed brood data recomputes every pnum without reading the dataset
+    report = reloaded.update(root, brood.with_columns(pl.col("lay_date").str.to_date() + pl.duration(days=1)))
+    assert report["files"] == 0 and report["pnums"] == len(reloaded.detections()["pnum"].unique())
+    assert (reloaded.daily["days_from_lay"] == expected["days_from_lay"] - 1).all()
+
+    # A regenerated dataset is folded in from scratch
+    write_detections(records, root)
+    assert reloaded.update(root, brood)["files"] > 0
+    assert_frame_equal(reloaded.daily, expected)
+
+    # A recording in two new files is counted once
+    tables = DerivedTables(tmp_path / "fresh")
+    assert tables.detections().is_empty() and tables.detections(["20201EX26"]).is_empty()
+    with DetectionWriter(root) as writer:
+        for record in first_days:
+            writer.add(record)
+    tables.update(root, brood)
+    assert_frame_equal(tables.daily, expected)
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from majorvocal import inference
+from majorvocal.archive import ArchiveWriter, DetectionArchive, is_archive, iter_json_records, pack_json_dir
+from majorvocal.detections import convert_json, read_detections
+from majorvocal.manifest import RunManifest
+
+
+def detection(start):
+    return {"scientific_name": "Parus major", "start_time": start, "end_time": start + 3, "confidence": 0.9}
+
+
+@pytest.fixture
+def records():
+    return [
+        [f"202004{day:02d}_{hour:02d}0000", pnum, [detection(3.0 * i) for i in range(day % 3)]]
+        for pnum in ("20201EX26", "20201B5", "20211C12")
+        for day in range(1, 11)
+        for hour in (4, 5)
+    ]
+
+
+def test_random_access_and_scans(tmp_path, records):
+    with ArchiveWriter(tmp_path, segment_bytes=1000) as writer:
+        for record in records:
+            writer.add(record)
+    with ArchiveWriter(tmp_path) as writer:  # a later run redoes one recording
+        writer.add(["20200402_040000", "20201B5", [detection(99.0)]])
+
+    archive = DetectionArchive(tmp_path)
+
+    assert len(list(tmp_path.glob("*.seg"))) > 5
+    assert len(archive) == len(records)
+    assert archive.keys() == sorted((pnum, timestamp) for timestamp, pnum, _ in records)
+    assert archive.get("20201EX26", "20200405_050000") == [detection(0.0), detection(3.0)]
+    assert archive.get("20201B5", "20200402_040000") == [detection(99.0)]
+    assert archive.get("20201EX26", "20200405_060000") is None and ("20201EX26", "20200401_040000") in archive
+
+    scanned = list(archive.iter_records())
+    assert sorted(map(json.dumps, scanned)) == sorted(
+        json.dumps(r if r[:2] != ["20200402_040000", "20201B5"] else [*r[:2], [detection(99.0)]]) for r in records
+    )
+    assert len(list(archive.iter_records(skip={("20201B5", "20200402_040000")}))) == len(records) - 1
+
+
+def test_unindexed_records_are_ignored(tmp_path, records):
+    with ArchiveWriter(tmp_path) as writer:
+        for record in records[:3]:
+            writer.add(record)
+    index = next(tmp_path.glob("*.idx"))
+    index.write_bytes(index.read_bytes()[:-5])  # killed while writing the last index line
+    writer = ArchiveWriter(tmp_path)
+    writer.add(records[3])  # written but not flushed
+
+    archive = DetectionArchive(tmp_path)
+    assert archive.keys() == [(r[1], r[0]) for r in records[:2]]
+    writer.close()
+    assert len(DetectionArchive(tmp_path)) == 3
+
+
+def test_pack_json_dir_in_place(tmp_path, records):
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    for timestamp, pnum, detections in records:
+        (json_dir / f"{pnum}_{timestamp}.json").write_text(json.dumps(detections))
+
+    assert not is_archive(json_dir)
+    assert pack_json_dir(json_dir, segment_bytes=2000) == len(records)
+    assert is_archive(json_dir) and not list(json_dir.glob("*.json"))
+    assert DetectionArchive(json_dir).get("20211C12", "20200402_050000") == [detection(0.0), detection(3.0)]
+
+    # Readers of the JSON directory see the packed records, and loose ones
+    (json_dir / "20211C12_20210501_050000.json").write_text(json.dumps([detection(6.0)]))
+    assert len(list(iter_json_records(json_dir))) == len(records) + 1
+    assert convert_json(json_dir, tmp_path / "detections") == len(records) + 1
+    rows = sum(max(1, len(r[2])) for r in records if r[1] == "20211C12") + 1  # and the loose recording
+    assert read_detections(tmp_path / "detections", pnums=["20211C12"]).num_rows == rows
+    with RunManifest(tmp_path / "manifest.sqlite") as manifest:
+        assert manifest.import_json_dir(json_dir) == len(records) + 1
+        assert manifest.import_json_dir(json_dir) == 0
+
+    # Inference appends to the archive instead of writing a file per recording
+    file_path = tmp_path / "20201EX26" / "20200501_050000.WAV"
+    assert not inference._saved(json_dir, file_path)
+    segments = len(list(json_dir.glob("*.seg")))
+    inference._save_json(json_dir, file_path, [detection(12.0)])
+    inference._save_json(json_dir, file_path.with_stem("20200501_060000"), [])
+    assert inference._archive_writer(json_dir)._data is None  # closed between recordings
+    assert len(list(json_dir.glob("*.seg"))) == segments + 1 and not list(json_dir.glob("20201EX26_*.json"))
+    assert DetectionArchive(json_dir).get("20201EX26", "20200501_050000") == [detection(12.0)]
+    assert inference._saved(json_dir, file_path) and inference._saved(json_dir, file_path.with_stem("20200501_060000"))
+
+    # and sees what other workers append after its first lookup
+    with ArchiveWriter(json_dir) as other:
+        other.add(["20200502_050000", "20201EX26", []])
+    assert inference._saved(json_dir, file_path.with_stem("20200502_050000"))
+    inference._archive.cache_clear()
+    inference._archive_writer.cache_clear()
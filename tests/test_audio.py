@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from majorvocal.audio import CHUNK_SAMPLES, SAMPLE_RATE, split_chunks
+
+
+def birdnetlib_chunks(signal, rate=SAMPLE_RATE, overlap=0.0):
+    """RecordingBase.process_audio_data from birdnetlib."""
+    chunks = []
+    for i in range(0, len(signal), int((3.0 - overlap) * rate)):
+        split = signal[i : i + int(3.0 * rate)]
+        if len(split) < int(1.5 * rate):
+            break
+        if len(split) < int(rate * 3.0):
+            temp = np.zeros((int(rate * 3.0)))
+            temp[: len(split)] = split
+            split = temp
+        chunks.append(split)
+    return chunks
+
+
+@pytest.mark.parametrize("seconds", [0.5, 1.5, 3.0, 4.4, 4.6, 61.2])
+@pytest.mark.parametrize("overlap", [0.0, 1.0])
+def test_split_chunks_matches_birdnetlib(seconds, overlap):
+    signal = np.random.default_rng(1).uniform(-1, 1, int(seconds * SAMPLE_RATE)).astype(np.float32)
+    expected = birdnetlib_chunks(signal, overlap=overlap)
+
+    chunks = split_chunks(signal, overlap=overlap)
+
+    assert chunks.shape == (len(expected), CHUNK_SAMPLES)
+    assert chunks.dtype == np.float32
+    for chunk, reference in zip(chunks, expected):
+        np.testing.assert_array_equal(chunk, np.asarray(reference, dtype=np.float32))
@@ -0,0 +1,79 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from majorvocal import backends
+from majorvocal.audio import CHUNK_SAMPLES
+
+LABELS = ["Parus major_Great Tit", "Cyanistes caeruleus_Eurasian Blue Tit", "Sitta europaea_Eurasian Nuthatch"]
+
+
+class ScoringAnalyzer:
+    """Scores each chunk with its first samples, rounded to ``decimals`` like a lower precision model."""
+
+    labels = LABELS
+
+    def __init__(self, decimals=None):
+        self.decimals = decimals
+
+    def predict_batch(self, batch):
+        scores = np.clip(batch[:, : len(self.labels)], 0, 1)
+        return scores if self.decimals is None else np.round(scores, self.decimals)
+
+    def return_predicted_species_list(self, lon, lat, week_48, filter_threshold):
+        return []
+
+
+def test_flat_sigmoid_and_quantization():
+    assert backends.flat_sigmoid(np.array([0.0, 100.0]))[0] == 0.5
+    assert backends.flat_sigmoid(np.array([100.0]))[0] == backends.flat_sigmoid(np.array([15.0]))[0]
+
+    details = {"dtype": np.int8, "quantization": (0.01, -3)}
+    x = np.array([-0.5, 0.0, 0.42, 5.0], dtype=np.float32)
+    q = backends._quantize(x, details)
+    assert q.dtype == np.int8 and q[-1] == 127
+    assert np.allclose(backends._dequantize(q, details)[:3], x[:3], atol=0.005)
+    assert backends._quantize(x, {"dtype": np.float32}) is x
+
+
+def test_load_backend_rejects_unknown():
+    with pytest.raises(ValueError, match="Unknown backend"):
+        backends.load_backend("onnx")
+    with pytest.raises(ValueError, match="SavedModel"):
+        backends.load_backend("tf")
+
+
+def test_agreement():
+    def detection(start, label):
+        return {"start_time": start, "label": label}
+
+    reference = {"a": [detection(0.0, LABELS[0]), detection(3.0, LABELS[0])], "b": [detection(0.0, LABELS[1])]}
+    detections = {"a": [detection(0.0, LABELS[0]), detection(6.0, LABELS[0])], "b": [detection(0.0, LABELS[1])]}
+
+    assert backends.agreement(reference, detections) == {"detections": 3, "precision": 2 / 3, "recall": 2 / 3}
+    assert backends.agreement({}, {}) == {"detections": 0, "precision": 1.0, "recall": 1.0}
+
+
+def test_evaluate_compares_with_reference():
+    rng = np.random.default_rng(0)
+    items = []
+    for i in range(4):
+        chunks = rng.uniform(-0.1, 0.1, size=(5, CHUNK_SAMPLES)).astype(np.float32)
+        chunks[:, :3] = rng.uniform(0, 1, size=(5, 3))
+        items.append((Path(f"20201EX{i}", "20200401_043000.WAV"), chunks))
+
+    results = backends.evaluate(
+        {"reference": ScoringAnalyzer, "coarse": lambda: ScoringAnalyzer(decimals=1)},
+        items,
+        reference="reference",
+        min_conf=0.5,
+        batch_size=4,
+    )
+
+    assert results["reference"]["precision"] == results["reference"]["recall"] == 1.0
+    assert results["reference"]["speedup"] == 1.0
+    assert 0.5 < results["coarse"]["recall"] < 1.0  # scores rounded up or down across the threshold
+    assert results["coarse"]["chunks_per_second"] > 0
+    with pytest.raises(ValueError):
+        backends.evaluate({"coarse": ScoringAnalyzer}, items)
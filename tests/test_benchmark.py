@@ -0,0 +1,70 @@
+import json
+import wave
+
+import numpy as np
+import pytest
+
+from majorvocal import benchmark, cli
+from majorvocal.audio import SAMPLE_RATE
+from majorvocal.detections import iter_records
+from majorvocal.inference import predict_batch
+
+
+def test_synthetic_data(tmp_path):
+    paths = benchmark.make_recordings(tmp_path / "raw", 6, seconds=9.0, n_pnums=2)
+    assert len({p.parent.name for p in paths}) == 2 and len(set(paths)) == 6
+    with wave.open(str(paths[0])) as f:
+        assert (f.getframerate(), f.getnframes()) == (SAMPLE_RATE, 9 * SAMPLE_RATE)
+
+    n = benchmark.make_detections(tmp_path / "detections.json", 1000, n_pnums=5)
+    records = list(iter_records(tmp_path / "detections.json"))
+    assert len(records) == n
+    assert sum(len(r[2]) for r in records) == 1000
+    assert any(not r[2] for r in records)
+    assert set(benchmark.make_brood_data(5)["pnum"]) == {r[1] for r in records}
+    # Deterministic
+    benchmark.make_detections(tmp_path / "again.json", 1000, n_pnums=5)
+    assert (tmp_path / "again.json").read_bytes() == (tmp_path / "detections.json").read_bytes()
+
+
+def test_stub_analyzer_is_deterministic():
+    batch = np.random.default_rng(0).uniform(-0.1, 0.1, (4, 144000)).astype(np.float32)
+    batch[2, 10] = 0.95
+    analyzer = benchmark.stub_analyzer()
+    scores = predict_batch(analyzer, batch)
+    assert scores.shape == (4, len(benchmark.LABELS))
+    assert scores[2, 0] == pytest.approx(0.95) and (scores[[0, 1, 3]] < 0.8).all()
+    np.testing.assert_array_equal(predict_batch(analyzer, batch), scores)
+
+
+def test_run_benchmark_and_compare(tmp_path):
+    result = benchmark.run_benchmark(recordings=4, seconds=6.0, detections=1000, isolate=False, workdir=tmp_path)
+    assert list(result["stages"]) == benchmark.STAGES
+    stages = result["stages"]
+    assert stages["discovery"]["items"] == stages["decoding"]["items"] == 4
+    assert stages["inference"]["audio_seconds"] == 4 * 6.0 and stages["inference"]["realtime_factor"] > 0
+    assert stages["extraction"]["items"] == 1000
+    assert all(m["seconds"] > 0 and m["peak_rss_mb"] > 0 for m in stages.values())
+    assert list(tmp_path.iterdir()) == []
+    with pytest.raises(ValueError):
+        benchmark.run_benchmark(stages=["training"])
+
+    results_file = tmp_path / "results.jsonl"
+    benchmark.save_result(results_file, result)
+    slower = json.loads(json.dumps(result))
+    slower["commit"] = "abc1234"
+    slower["stages"]["decoding"]["seconds"] *= 2
+    assert benchmark.compare(slower, benchmark.load_results(results_file)) == [
+        f"decoding: time {stages['decoding']['seconds']:.3g} -> {2 * stages['decoding']['seconds']:.3g} "
+        f"(+100% since {result['commit']})"
+    ]
+    slower["settings"]["detections"] = 10
+    assert benchmark.compare(slower, benchmark.load_results(results_file)) == []
+
+
+def test_benchmark_command(tmp_path, capsys):
+    results_file = tmp_path / "results.jsonl"
+    args = ["benchmark", "--recordings", "2", "--duration", "3", "--detections", "100", "--results", str(results_file)]
+    assert cli.main(args + ["--stages", "discovery", "extraction"]) == 0
+    assert "discovery" in capsys.readouterr().out
+    assert list(benchmark.load_results(results_file)[0]["stages"]) == ["discovery", "extraction"]
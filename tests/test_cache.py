@@ -0,0 +1,99 @@
+import os
+
+import numpy as np
+import pytest
+
+from majorvocal.cache import ChunkCache
+from majorvocal.pipeline import Prefetcher
+
+
+def fake_load(file_path, overlap=0.0):
+    return np.full((2, 8), len(file_path.read_bytes()), dtype=np.float32)
+
+
+def decode_length(data):
+    return np.full((2, 8), len(data), dtype=np.float32)
+
+
+@pytest.fixture
+def recordings(tmp_path):
+    paths = []
+    for i in range(4):
+        path = tmp_path / "raw" / f"2020040{i}_043000.WAV"
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b"x" * (i + 1))
+        paths.append(path)
+    return paths
+
+
+def test_get_or_load_caches_and_memory_maps(tmp_path, recordings):
+    cache = ChunkCache(tmp_path / "cache")
+    calls = []
+
+    def load(file_path, overlap=0.0):
+        calls.append(file_path)
+        return fake_load(file_path)
+
+    first = cache.get_or_load(recordings[1], load=load)
+    second = cache.get_or_load(recordings[1], load=load)
+
+    assert calls == [recordings[1]]
+    assert isinstance(second, np.memmap)
+    assert not second.flags.writeable
+    np.testing.assert_array_equal(first, np.full((2, 8), 2, dtype=np.float32))
+    np.testing.assert_array_equal(second, first)
+
+
+def test_entries_are_invalidated_by_size_and_mtime(tmp_path, recordings):
+    cache = ChunkCache(tmp_path / "cache")
+    cache.put(recordings[0], fake_load(recordings[0]))
+
+    recordings[0].write_bytes(b"yyyy")
+    assert cache.get(recordings[0]) is None
+
+    cache.put(recordings[0], fake_load(recordings[0]))
+    stat = recordings[0].stat()
+    os.utime(recordings[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(recordings[0]) is None
+
+
+def test_entries_are_kept_apart_by_reader(tmp_path, recordings):
+    cache = ChunkCache(tmp_path / "cache")
+    resampled = cache.get_or_load(recordings[0], load=lambda f, overlap=0.0: np.ones((2, 8)), reader="mmap")
+
+    assert cache.get(recordings[0]) is None
+    decoded = cache.get_or_load(recordings[0], load=fake_load, reader="librosa")
+    np.testing.assert_array_equal(decoded, fake_load(recordings[0]))
+    np.testing.assert_array_equal(cache.get(recordings[0], reader="mmap"), resampled)
+    assert cache.entry_path(recordings[0], reader="mmap") != cache.entry_path(recordings[0])
+
+
+def test_evicts_least_recently_used(tmp_path, recordings):
+    cache = ChunkCache(tmp_path / "cache", max_bytes=10**9)
+    cache.put(recordings[0], fake_load(recordings[0]))
+    entry_size = cache.size()
+    cache.max_bytes = 3 * entry_size
+
+    for i, path in enumerate(recordings[1:3], start=1):
+        cache.put(path, fake_load(path))
+        os.utime(cache.entry_path(path), ns=(i * 10**9, i * 10**9))
+    os.utime(cache.entry_path(recordings[0]), ns=(0, 0))
+    assert cache.get(recordings[0]) is not None  # now the most recently used
+
+    cache.put(recordings[3], fake_load(recordings[3]))
+
+    assert cache.size() <= cache.max_bytes
+    assert cache.get(recordings[1]) is None
+    assert all(cache.get(path) is not None for path in (recordings[0], recordings[2], recordings[3]))
+
+
+def test_prefetcher_fills_and_reads_cache(tmp_path, recordings):
+    cache = ChunkCache(tmp_path / "cache")
+
+    first = dict(Prefetcher(recordings, decode=decode_length, cache=cache))
+    second = dict(Prefetcher(recordings, decode=None, cache=cache))  # would fail if called
+
+    assert set(second) == set(recordings)
+    for path in recordings:
+        assert isinstance(second[path], np.memmap)
+        np.testing.assert_array_equal(second[path], first[path])
@@ -0,0 +1,135 @@
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from majorvocal import cli
+from majorvocal.activity import ActivityCube
+from majorvocal.config import config
+from majorvocal.detections import read_detections, write_detections
+from majorvocal.manifest import RunManifest, file_record
+from majorvocal.scores import ScoreWriter
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """
+    A project folder with brood data and a detections dataset of two pnums.
+    """
+    monkeypatch.setenv("MAJORVOCAL_PROJECT_PATH", str(tmp_path))
+    monkeypatch.setattr(config, "settings", config.Settings())
+    brood = pd.DataFrame(
+        {
+            "pnum": ["20201EX25", "20201B5"],
+            "year": [2020, 2020],
+            "lay_date": ["2020-04-17", "2020-04-20"],
+            "n_vocalisations": [20, 0],
+        }
+    )
+    config.output(tmp_path / "data" / "metadata" / "main.csv")
+    brood.to_csv(tmp_path / "data" / "metadata" / "main.csv", index=False)
+    song = {"scientific_name": "Parus major", "common_name": "Great Tit", "confidence": 0.9}
+    records = [
+        [f"202004{day}_050000", pnum, [{**song, "start_time": 3.0 * i, "end_time": 3.0 * i + 3} for i in range(n)]]
+        for pnum in brood["pnum"]
+        for day, n in [("14", 1), ("15", 4), ("16", 0), ("21", 2)]
+    ]
+    write_detections(records, tmp_path / "data" / "derived" / "detections")
+    return tmp_path
+
+
+def test_parser():
+    args = cli.build_parser().parse_args(
+        ["infer", "--workers", "4", "--batch-size", "128", "--pnum", "20201EX25", "--pnum", "20201B5"]
+        + ["--start-date", "2020-04-15"]
+    )
+    assert (args.command, args.workers, args.batch_size) == ("infer", 4, 128)
+    assert args.pnums == ["20201EX25", "20201B5"] and args.start_date == date(2020, 4, 15)
+    with pytest.raises(SystemExit):
+        cli.build_parser().parse_args(["infer", "--start-date", "15/04/2020"])
+    args = cli.build_parser().parse_args(["work", "--queue", "/shared/queue.sqlite", "--lease", "600"])
+    assert args.queue == Path("/shared/queue.sqlite") and args.lease == 600
+
+
+def test_extract_and_aggregate(project, capsys):
+    derived = project / "data" / "derived"
+    assert cli.main(["extract", "--only"]) == 0
+    assert (derived / "tables" / "daily_counts.parquet").exists()
+
+    cli.main(["aggregate", "--only", "--pnum", "20201EX25", "--start-date", "2020-04-15"])
+    daily = pd.read_csv(derived / "daily_counts.csv")
+    assert daily["pnum"].unique().tolist() == ["20201EX25"]
+    assert daily["date"].tolist() == ["2020-04-15", "2020-04-16", "2020-04-21"]
+    assert daily["count"].tolist() == [4, 0, 2]
+    assert pd.read_csv(derived / "peak_days.csv")["date"].tolist() == ["2020-04-15"]
+
+    # Unchanged inputs and filters: the stage is skipped
+    capsys.readouterr()
+    cli.main(["aggregate", "--only", "--pnum", "20201EX25", "--start-date", "2020-04-15"])
+    assert capsys.readouterr().out == "aggregate: up to date\n"
+    cli.main(["aggregate", "--only"])
+    assert capsys.readouterr().out.startswith("aggregate: {")
+    assert len(pd.read_csv(derived / "daily_counts.csv")) == 8
+
+    # Peaks are those of the filtered days
+    cli.main(["aggregate", "--only", "--pnum", "20201EX25", "--start-date", "2020-04-16"])
+    assert pd.read_csv(derived / "peak_days.csv")["date"].tolist() == ["2020-04-21"]
+
+
+def test_merge_reads_shard_outputs_next_to_the_queue(project):
+    shared = project / "shared"
+    recording = Path("/data", "20201EX25", "20200422_050000.WAV")
+    song = {"scientific_name": "Parus major", "common_name": "Great Tit", "confidence": 0.9}
+    with RunManifest(shared / "shards" / "20201EX25_20200422.sqlite") as manifest:
+        manifest.record([file_record(recording, "done", detections=[{**song, "start_time": 0.0, "end_time": 3.0}])])
+    with ScoreWriter(shared / "scores", ["Parus major_Great Tit"]) as writer:
+        writer.add(recording, [[0.9]])
+
+    assert cli.main(["merge", "--queue", str(shared / "queue.sqlite")]) == 0
+    derived = project / "data" / "derived"
+    assert not list((shared / "shards").iterdir()) and not list((shared / "scores").rglob("*.parquet"))
+    assert len(list((derived / "scores").rglob("*.parquet"))) == 1
+    assert "20200422_050000" in read_detections(derived / "detections", pnums=["20201EX25"])["timestamp"].to_pylist()
+
+
+def test_infer_always_runs_without_touching_later_stages(project, monkeypatch, capsys):
+    monkeypatch.setenv("MAJORVOCAL_DATA_PATH", str(project / "raw"))
+    raw = project / "raw" / "GRETI_2020" / "20201EX25"
+    raw.mkdir(parents=True)
+    (raw / "20200415_050000.WAV").write_bytes(b"\0" * 2000)
+    with cli._manifest() as manifest:
+        manifest.record([file_record(raw / "20200415_050000.WAV", "done", detections=[])])
+    cli.main(["extract"])
+
+    # Nothing pending: infer starts no model and leaves the detections as they are
+    capsys.readouterr()
+    assert cli.main(["extract"]) == 0
+    out = capsys.readouterr().out
+    assert 'infer: {"done": 1}' in out and out.endswith("extract: up to date\n")
+
+
+def test_activity(project):
+    cli.main(["extract", "--only"])
+    assert cli.main(["activity", "--only"]) == 0
+    cube = ActivityCube(project / "data" / "derived" / "activity")
+    assert cube.pnums(2020) == ["20201B5", "20201EX25"]
+    assert cube.time_of_day(pnums=["20201EX25"])[10] == 7  # every song at 05:00
+
+
+def test_correlate(project):
+    nestboxes = pd.DataFrame({"nestbox": ["EX25", "B5", "C1"], "x": [0.0, 30.0, 40.0], "y": [0.0, 40.0, 500.0]})
+    nestboxes.to_csv(project / "data" / "metadata" / "nestboxes.csv", index=False)
+    cli.main(["extract", "--only"])
+    assert cli.main(["correlate", "--only", "--radius", "60", "--min-days", "3"]) == 0
+    pairs = pd.read_csv(project / "data" / "derived" / "neighbour_correlations.csv")
+    assert pairs[["pnum_a", "pnum_b", "distance", "days"]].values.tolist() == [["20201B5", "20201EX25", 50.0, 4]]
+    assert pairs["r"].iloc[0] == pytest.approx(1.0)  # both boxes have the same songs
+
+
+def test_plot(project):
+    pytest.importorskip("seaborn")
+    cli.main(["extract", "--only"])
+    cli.main(["plot", "--only"])
+    figures = sorted(p.name for p in (project / "output" / "figures").iterdir())
+    assert "seasonal_activity.png" in figures and len(figures) == 8
@@ -0,0 +1,70 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from majorvocal.config import config
+from majorvocal.config.config import Settings
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+
+# Seconds allowed to import the package modules used by workers and the
+# settings, in a fresh interpreter
+COLD_START_BUDGET = 1.5
+
+COLD_START = """
+import json, sys, time
+start = time.perf_counter()
+from majorvocal.config import config
+import majorvocal.graphical, majorvocal.inference, majorvocal.pipeline
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(m for m in ("matplotlib", "pyarrow", "pandas") if m in sys.modules)}))
+"""
+
+
+def test_cold_start(tmp_path):
+    env = {**os.environ, "PYTHONPATH": str(SRC), "MAJORVOCAL_PROJECT_PATH": str(tmp_path)}
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", COLD_START], env=env, capture_output=True, text=True, check=True)
+    total = time.perf_counter() - start
+    result = json.loads(out.stdout)
+
+    assert result["modules"] == []  # no plotting or columnar stack in workers
+    assert list(tmp_path.iterdir()) == []  # nothing created on import
+    assert result["elapsed"] < COLD_START_BUDGET, f"imports took {result['elapsed']:.2f} s ({total:.2f} s in total)"
+
+
+def test_settings_overrides(tmp_path, monkeypatch):
+    monkeypatch.setenv("MAJORVOCAL_PROJECT_PATH", str(tmp_path))
+    monkeypatch.delenv("MAJORVOCAL_DATA_PATH", raising=False)
+    monkeypatch.delenv("MAJORVOCAL_SETTINGS", raising=False)
+    assert Settings().data_path == config.DEFAULT_DATA_PATH
+
+    (tmp_path / "majorvocal.toml").write_text('[paths]\ndata_path = "raw"\n')
+    settings = Settings()
+    assert settings.data_path == tmp_path / "raw"
+    assert settings.project_structure["derived_data"] == tmp_path / "data" / "derived"
+
+    monkeypatch.setenv("MAJORVOCAL_DATA_PATH", "/mnt/songs")
+    assert Settings().data_path == Path("/mnt/songs")
+    assert not (tmp_path / "data").exists()
+
+    out = config.output(tmp_path / "data" / "derived" / "daily_counts.csv")
+    assert out.parent.is_dir() and not out.exists()
+
+
+def test_module_attributes_are_lazy():
+    assert config.PROJECT_STRUCTURE["metadata"].parts[-2:] == ("data", "metadata")
+    assert config.DATA_PATH == config.settings.data_path
+
+
+def test_set_style():
+    from majorvocal import graphical
+
+    graphical.set_style()
+    from matplotlib import pyplot as plt
+
+    assert plt.rcParams["axes.facecolor"] == "#1d1d1d"
+    assert len(graphical.site_palette) == 7
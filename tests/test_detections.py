@@ -0,0 +1,146 @@
+import json
+from datetime import date
+
+import pytest
+
+from majorvocal.detections import (
+    convert_json,
+    iter_batches,
+    iter_records,
+    read_batches,
+    read_detections,
+    sync_detections,
+    write_detections,
+)
+from majorvocal.manifest import RunManifest
+from majorvocal.utils import extract_parus_major, load_parus_major
+
+
+def make_records(n):
+    return [
+        [
+            f"202004{i % 28 + 1:02d}_043000",
+            f"20201EX{i}",
+            [
+                {
+                    "common_name": "Great Tit",
+                    "scientific_name": "Parus major",
+                    "start_time": 3.0 * j,
+                    "end_time": 3.0 * j + 3.0,
+                    "confidence": 0.875,
+                    "label": "Parus major_Great Tit",
+                }
+                for j in range(i % 3)
+            ],
+        ]
+        for i in range(n)
+    ]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 2**20])
+def test_iter_records_json_array(tmp_path, chunk_size):
+    records = make_records(20)
+    path = tmp_path / "detections.json"
+    path.write_text(json.dumps(records))
+    assert list(iter_records(path, chunk_size=chunk_size)) == records
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 2**20])
+def test_iter_records_ndjson(tmp_path, chunk_size):
+    records = make_records(20)
+    path = tmp_path / "detections.ndjson"
+    path.write_text("".join(json.dumps(r) + "\n" for r in records))
+    assert list(iter_records(path, chunk_size=chunk_size)) == records
+
+
+@pytest.mark.parametrize("text", ["", "[]", " [ \n] \n"])
+def test_iter_records_empty(tmp_path, text):
+    path = tmp_path / "detections.json"
+    path.write_text(text)
+    assert list(iter_records(path)) == []
+
+
+def test_iter_records_truncated(tmp_path):
+    path = tmp_path / "detections.json"
+    path.write_text(json.dumps(make_records(5))[:-10])
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_records(path, chunk_size=16))
+
+
+def test_read_batches(tmp_path):
+    records = make_records(25)
+    path = tmp_path / "detections.json"
+    path.write_text(json.dumps(records))
+    batches = list(read_batches(path, batch_size=10, chunk_size=100))
+    assert [len(b) for b in batches] == [10, 10, 5]
+    assert [r for b in batches for r in b] == records
+    assert list(iter_batches([], 10)) == []
+
+
+def test_write_and_read_detections(tmp_path):
+    records = make_records(30)
+    root = tmp_path / "detections"
+    assert write_detections(records, root, rows_per_file=7) == 30
+    assert (root / "year=2020" / "pnum=20201EX3").is_dir()
+
+    table = read_detections(root)
+    # One row per detection plus one per recording without detections
+    assert table.num_rows == sum(max(len(r[2]), 1) for r in records)
+    assert table.schema.field("confidence").type == "float"
+
+    one = read_detections(root, pnums=["20201EX4"]).to_pylist()
+    assert [(d["timestamp"], d["start_time"], d["confidence"]) for d in one] == [
+        ("20200405_043000", 0.0, 0.875),
+    ]
+    in_range = read_detections(root, start_date=date(2020, 4, 2), end_date=date(2020, 4, 3), columns=["pnum"])
+    assert sorted(set(in_range["pnum"].to_pylist())) == ["20201EX1", "20201EX2", "20201EX29"]
+    assert read_detections(root, species=["Parus major"]).num_rows == sum(len(r[2]) for r in records)
+
+    # Writing again replaces the dataset
+    write_detections(records[:2], root)
+    assert read_detections(root).num_rows == 2
+
+
+def test_convert_json_and_load_parus_major(tmp_path):
+    records = make_records(12)
+    records[5][2].append({"scientific_name": "Cyanistes caeruleus", "start_time": 9.0, "end_time": 12.0, "confidence": 0.5})
+    (tmp_path / "detections.json").write_text(json.dumps(records))
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    for timestamp, pnum, detections in records:
+        (json_dir / f"{pnum}_{timestamp}.json").write_text(json.dumps(detections))
+
+    expected = extract_parus_major(records).sort("pnum", "timestamp", "start_time", nulls_last=True)
+    for source in (tmp_path / "detections.json", json_dir):
+        root = tmp_path / f"parquet_{source.name}"
+        assert convert_json(source, root) == 12
+        assert load_parus_major(root).to_dicts() == expected.to_dicts()
+
+    subset = load_parus_major(root, pnums=["20201EX5"], start_date=date(2020, 4, 6))
+    assert subset.to_dicts() == [
+        {"timestamp": "20200406_043000", "pnum": "20201EX5", "start_time": s, "end_time": s + 3, "confidence": 0.875}
+        for s in (0.0, 3.0)
+    ]
+
+
+def test_sync_after_convert_skips_converted_recordings(tmp_path):
+    records = make_records(6)
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    for timestamp, pnum, detections in records[:4]:
+        (json_dir / f"{pnum}_{timestamp}.json").write_text(json.dumps(detections))
+    root = tmp_path / "parquet"
+    assert convert_json(json_dir, root) == 4
+
+    with RunManifest(tmp_path / "manifest.sqlite") as manifest:
+        manifest.import_json_dir(json_dir)
+        for timestamp, pnum, detections in records[4:]:
+            (json_dir / f"{pnum}_{timestamp}.json").write_text(json.dumps(detections))
+        manifest.import_json_dir(json_dir)
+        assert sync_detections(manifest, root) == 2
+        synced = (root / "_synced.json").stat().st_mtime_ns
+        assert sync_detections(manifest, root) == 0
+        assert (root / "_synced.json").stat().st_mtime_ns == synced
+
+    table = read_detections(root, columns=["pnum", "timestamp"])
+    assert table.num_rows == sum(max(1, len(r[2])) for r in records)
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import polars as pl
+
+from majorvocal import prefilter
+from majorvocal.audio import CHUNK_SAMPLES, SAMPLE_RATE, load_chunks
+from majorvocal.benchmark import make_recordings
+from majorvocal.features import FEATURES, FeatureIndex, chunk_features
+from majorvocal.index import RecordingIndex
+
+
+def test_chunk_features():
+    rng = np.random.default_rng(0)
+    t = np.arange(CHUNK_SAMPLES) / SAMPLE_RATE
+    chunks = np.stack(
+        [
+            rng.normal(0, 0.1, CHUNK_SAMPLES),  # rain
+            0.1 * np.sin(2 * np.pi * 4000 * t),  # song
+            0.1 * np.sin(2 * np.pi * 300 * t),  # hum, below the band
+            np.zeros(CHUNK_SAMPLES),
+        ]
+    ).astype(np.float32)
+
+    features = chunk_features(chunks)
+
+    assert np.allclose(features["rms"], [0.1, 0.1 / np.sqrt(2), 0.1 / np.sqrt(2), 0], rtol=0.01)
+    assert features["flatness"][0] > 0.5 > 0.01 > features["flatness"][1]
+    assert features["band_db"][1] > features["band_db"][0] > features["band_db"][2] + 20
+    assert np.all(features["peak_db"] >= features["band_db"])
+    assert features["floor_db"] == np.percentile(prefilter.band_levels(chunks), prefilter.FLOOR_PERCENTILE)
+
+
+def test_feature_index_is_incremental(tmp_path):
+    paths = make_recordings(tmp_path / "raw", 6, seconds=12.0, n_pnums=2)
+    recordings = RecordingIndex(tmp_path / "index")
+    recordings.refresh(tmp_path / "raw")
+    index = FeatureIndex(tmp_path / "index" / "features")
+
+    assert index.refresh(recordings.files, n_workers=2) == {"computed": 6, "failed": 0, "removed": 0, "recordings": 6}
+    assert index.refresh(recordings.files, n_workers=2) == {"computed": 0, "failed": 0, "removed": 0, "recordings": 6}
+    assert len(index.pnums()) == 2
+
+    os.utime(paths[0], ns=(1, 1))
+    paths[1].unlink()
+    paths[2].write_bytes(b"RIFF")
+    os.utime(paths[0].parent, ns=(2, 2))  # so the recording index rescans it
+    recordings.refresh(tmp_path / "raw")
+    assert index.refresh(recordings.files, n_workers=2) == {"computed": 1, "failed": 1, "removed": 1, "recordings": 4}
+
+    chunks = index.chunks()
+    assert chunks.columns == ["path", "pnum", "date", "time", "chunk", "start", *FEATURES]
+    assert len(chunks) == 4 * 4
+    assert chunks.filter(pl.col("path") == str(paths[0]))["start"].to_list() == [0.0, 3.0, 6.0, 9.0]
+
+    # The prefilter reads the stored levels instead of measuring the chunks again
+    decoded = load_chunks(paths[0])
+    stored = prefilter.Prefilter(levels=index.levels)
+    assert np.array_equal(stored(paths[0], np.zeros_like(decoded)), prefilter.select_chunks(decoded))
+    assert index.levels(tmp_path / "raw" / "GRETI_2020" / "unknown" / "20200401_040000.WAV") is None
@@ -0,0 +1,72 @@
+import os
+from datetime import date
+
+import pytest
+
+from majorvocal.index import RecordingIndex
+
+
+def touch(path, size=2000):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"\0" * size)
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    root = tmp_path / "raw"
+    for pnum, stems in {
+        "GRETI_2020/20201EX26": ["20200401_033000", "20200401_043000", "20200402_050000"],
+        "GRETI_2020/20201B5": ["20200415_040000", "20200415_070000"],
+        "GRETI_2021/20211EX26": ["20210410_043000"],
+        "OTHER_2020/20201C1": ["20200401_043000"],
+    }.items():
+        for stem in stems:
+            touch(root / pnum / f"{stem}.WAV")
+    touch(root / "GRETI_2020/20201EX26/notes.txt")
+    touch(root / "GRETI_2020/20201B5/20200415_050000.WAV", size=10)
+    return root
+
+
+def test_refresh_builds_index(tmp_path, data_path):
+    index = RecordingIndex(tmp_path / "index")
+    assert index.refresh(data_path) == {"rescanned": 3, "removed": 0, "recordings": 7}
+
+    reloaded = RecordingIndex(tmp_path / "index")
+    assert reloaded.files.equals(index.files)
+    row = reloaded.files.filter(reloaded.files["path"].str.ends_with("20200402_050000.WAV")).row(0, named=True)
+    assert row["site"] == "GRETI_2020"
+    assert row["date"] == date(2020, 4, 2)
+    assert row["size"] == 2000
+
+
+def test_select(tmp_path, data_path):
+    index = RecordingIndex(tmp_path / "index")
+    index.refresh(data_path)
+
+    selected = index.paths(pnums=["20201EX26", "20201B5"], time_window=("033000", "063000"), min_size=1000)
+    assert sorted(p.stem for p in selected) == ["20200401_043000", "20200402_050000", "20200415_040000"]
+
+    selected = index.select(start_date=date(2020, 4, 2), end_date=date(2020, 4, 15))
+    assert sorted(selected["time"]) == ["040000", "050000", "050000", "070000"]
+
+
+def test_refresh_only_rescans_changed_directories(tmp_path, data_path):
+    index = RecordingIndex(tmp_path / "index")
+    index.refresh(data_path)
+
+    assert index.refresh(data_path)["rescanned"] == 0
+
+    new = data_path / "GRETI_2020/20201EX26/20200403_043000.WAV"
+    touch(new)
+    os.utime(new.parent, ns=(0, 10**18))
+    for path in (data_path / "GRETI_2021/20211EX26").iterdir():
+        path.unlink()
+    (data_path / "GRETI_2021/20211EX26").rmdir()
+    touch(data_path / "GRETI_2021/20211C2/20210412_043000.WAV")
+
+    result = RecordingIndex(tmp_path / "index").refresh(data_path)
+
+    assert result == {"rescanned": 2, "removed": 1, "recordings": 8}
+    files = RecordingIndex(tmp_path / "index").files
+    assert "20211EX26" not in files["pnum"].to_list()
+    assert str(new) in files["path"].to_list()
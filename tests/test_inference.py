@@ -0,0 +1,182 @@
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from majorvocal import inference
+from majorvocal.audio import CHUNK_SAMPLES
+
+
+class StubAnalyzer:
+    def __init__(self, version, n_threads):
+        self.version = version
+        self.n_threads = n_threads
+        self.pid = os.getpid()
+
+
+def stub_factory(version, n_threads):
+    print("loading model")
+    return StubAnalyzer(version, n_threads)
+
+
+def stub_task(file_path, suffix=""):
+    analyzer = inference.get_analyzer()
+    return os.getpid(), id(analyzer), analyzer.n_threads, os.environ["OMP_NUM_THREADS"], f"{file_path}{suffix}"
+
+
+@pytest.mark.parametrize("start_method", ["spawn", "forkserver"])
+def test_run_inference_loads_model_once_per_worker(start_method, tmp_path):
+    log_file = tmp_path / "workers.log"
+    results = list(
+        inference.run_inference(
+            range(20),
+            task=stub_task,
+            n_workers=2,
+            n_threads=3,
+            start_method=start_method,
+            analyzer_factory=stub_factory,
+            log_file=log_file,
+            suffix="!",
+        )
+    )
+
+    assert sorted(r[4] for r in results) == sorted(f"{i}!" for i in range(20))
+    analyzers_per_pid = {}
+    for pid, analyzer_id, n_threads, omp_threads, _ in results:
+        analyzers_per_pid.setdefault(pid, set()).add(analyzer_id)
+        assert n_threads == 3
+        assert omp_threads == "3"
+    assert len(analyzers_per_pid) <= 2
+    assert all(len(ids) == 1 for ids in analyzers_per_pid.values())
+    assert log_file.read_text().count("loading model") == 2  # once per worker, busy or idle
+
+
+def test_get_analyzer_outside_worker():
+    with pytest.raises(RuntimeError):
+        inference.get_analyzer()
+
+
+def test_process_file_skips_small_and_existing(tmp_path):
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    folder = tmp_path / "20201EX26"
+    folder.mkdir()
+    small = folder / "20200401_040000.WAV"
+    small.write_bytes(b"\0" * 10)
+    done = folder / "20200401_050000.WAV"
+    done.write_bytes(b"\0" * 2000)
+    Path(json_dir, "20201EX26_20200401_050000.json").write_text("[]")
+
+    assert inference.process_file(small, json_dir) is None
+    assert inference.process_file(done, json_dir) is None
+
+
+LABELS = ["Parus major_Great Tit", "Cyanistes caeruleus_Eurasian Blue Tit", "Erithacus rubecula_European Robin"]
+
+
+class ScoringAnalyzer:
+    """Scores each chunk with its first three samples."""
+
+    labels = LABELS
+
+    def __init__(self, allowed=()):
+        self.allowed = list(allowed)
+        self.calls = []
+
+    def predict_batch(self, batch):
+        self.calls.append(batch.shape)
+        return np.clip(batch[:, : len(self.labels)], 0, 1)
+
+    def return_predicted_species_list(self, lon, lat, week_48, filter_threshold):
+        return self.allowed
+
+
+def reference_detections(analyzer, chunks, min_conf):
+    """Per-file, per-chunk detections as birdnetlib builds them."""
+    detections = []
+    for i, chunk in enumerate(chunks):
+        pred = analyzer.predict_batch(chunk[None])[0]
+        p_sorted = sorted(zip(analyzer.labels, pred), key=lambda x: x[1], reverse=True)
+        for label, score in p_sorted:
+            if score > min_conf and (not analyzer.allowed or label in analyzer.allowed):
+                detections.append(
+                    {
+                        "common_name": label.split("_")[1],
+                        "scientific_name": label.split("_")[0],
+                        "start_time": float(i * 3.0),
+                        "end_time": float(i * 3.0 + 3.0),
+                        "confidence": float(score),
+                        "label": label,
+                    }
+                )
+    return detections
+
+
+def make_chunks(rng, n_chunks):
+    chunks = rng.uniform(-0.1, 0.1, size=(n_chunks, CHUNK_SAMPLES)).astype(np.float32)
+    chunks[:, :3] = rng.uniform(0, 1, size=(n_chunks, 3))
+    return chunks
+
+
+@pytest.mark.parametrize("allowed", [(), LABELS[:2]])
+def test_predict_files_matches_per_file_inference(allowed):
+    rng = np.random.default_rng(0)
+    analyzer = ScoringAnalyzer(allowed)
+    items = [
+        (Path(f"20201EX{i}", f"2020040{i}_043000.WAV"), make_chunks(rng, n))
+        for i, n in enumerate([5, 0, 1, 12, 7], start=1)
+    ]
+
+    results = list(inference.predict_files(analyzer, items, batch_size=4, min_conf=0.5))
+    calls = list(analyzer.calls)
+
+    assert calls == [(4, CHUNK_SAMPLES)] * 7  # 25 chunks in fixed batches of 4
+    assert [file_path for file_path, _ in results] == [file_path for file_path, _ in items]
+    for (_, detections), (_, chunks) in zip(results, items):
+        assert detections == reference_detections(analyzer, chunks, 0.5)
+
+
+def test_iter_batches_spans_files_and_pads():
+    items = [("a", np.ones((3, CHUNK_SAMPLES))), ("b", np.full((2, CHUNK_SAMPLES), 2.0))]
+    batches = [(batch.copy(), owners) for batch, owners in inference.iter_batches(items, batch_size=4)]
+
+    assert [owners for _, owners in batches] == [[("a", 0), ("a", 1), ("a", 2), ("b", 0)], [("b", 1)]]
+    assert batches[0][0][3, 0] == 2.0
+    assert batches[1][0].shape == (4, CHUNK_SAMPLES)
+    assert not batches[1][0][1:].any()
+
+
+def test_week_48():
+    assert inference.week_48(datetime(2021, 1, 1)) == 1
+    assert inference.week_48(datetime(2021, 4, 15)) == 14
+    assert inference.week_48(datetime(2020, 12, 31)) == 48
+
+
+def test_process_files_reports_every_file(tmp_path, monkeypatch):
+    folder = tmp_path / "20201EX26"
+    folder.mkdir()
+    paths = [folder / f"20200401_04{i}000.WAV" for i in range(4)]
+    for path in paths:
+        path.write_bytes(b"\0" * 2000)
+    paths[1].write_bytes(b"\0" * 10)
+    chunks = {paths[0]: make_chunks(np.random.default_rng(0), 3), paths[3]: make_chunks(np.random.default_rng(1), 2)}
+
+    def load(file_path, stopwatch=None):
+        if file_path not in chunks:
+            raise ValueError("bad header")
+        return chunks[file_path]
+
+    monkeypatch.setattr(inference, "load_chunks", load)
+    monkeypatch.setattr(inference, "_analyzer", ScoringAnalyzer())
+
+    records = inference.process_files(paths, json_dir=tmp_path, batch_size=4, min_conf=0.5)
+
+    assert [r["status"] for r in records] == ["done", "skipped", "failed", "done"]
+    assert records[2]["error"] == "ValueError: bad header"
+    assert [r["duration"] for r in records] == [9.0, None, None, 6.0]
+    assert all(r["elapsed"] > 0 for r in records if r["status"] == "done")
+    assert records[0]["detections"] == reference_detections(ScoringAnalyzer(), chunks[paths[0]], 0.5)
+    assert json.loads((tmp_path / "20201EX26_20200401_043000.json").read_text()) == records[3]["detections"]
@@ -0,0 +1,76 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from majorvocal.manifest import RunManifest, file_record
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    with RunManifest(tmp_path / "run" / "manifest.sqlite") as manifest:
+        yield manifest
+
+
+def detection(start):
+    return {"scientific_name": "Parus major", "start_time": start, "end_time": start + 3.0, "confidence": 0.9}
+
+
+def test_records_survive_reopening_and_resume_skips_finished(tmp_path, manifest):
+    done = Path("/data/20201EX26/20200401_043000.WAV")
+    small = Path("/data/20201EX26/20200401_044000.WAV")
+    failed = Path("/data/20201EX26/20200401_045000.WAV")
+    todo = Path("/data/20201EX26/20200401_050000.WAV")
+    manifest.record([file_record(done, "done", duration=60.0, elapsed=1.5, detections=[detection(0.0)])])
+    manifest.record([file_record(small, "skipped"), file_record(failed, "failed", error="ValueError: bad header")])
+
+    with RunManifest(tmp_path / "run" / "manifest.sqlite") as reopened:
+        assert reopened.summary() == {"done": 1, "skipped": 1, "failed": 1}
+        assert reopened.failures() == [(str(failed), "ValueError: bad header")]
+        # Same recordings on a different mount point are still recognised
+        moved = [Path("/mnt", *f.parts[2:]) for f in (done, small, failed, todo)]
+        assert reopened.pending(moved) == moved[2:]
+
+
+def test_retry_replaces_failed_record(manifest):
+    file_path = Path("20201EX26", "20200401_043000.WAV")
+    manifest.record([file_record(file_path, "failed", error="OSError")])
+    manifest.record([file_record(file_path, "done", detections=[])])
+
+    assert manifest.summary() == {"done": 1}
+    assert list(manifest.iter_detections()) == [["20200401_043000", "20201EX26", []]]
+
+
+def test_export_json_matches_detections_format(tmp_path, manifest):
+    records = [
+        file_record(Path("20201EX26", "20200401_043000.WAV"), "done", detections=[detection(0.0), detection(6.0)]),
+        file_record(Path("20201EX26", "20200401_044000.WAV"), "skipped"),
+        file_record(Path("20211B5", "20210415_050000.WAV"), "done", detections=[]),
+    ]
+    manifest.record(records)
+
+    assert manifest.export_json(tmp_path / "detections.json") == 2
+    with open(tmp_path / "detections.json") as f:
+        assert json.load(f) == [
+            ["20200401_043000", "20201EX26", [detection(0.0), detection(6.0)]],
+            ["20210415_050000", "20211B5", []],
+        ]
+
+    assert manifest.export_json(tmp_path / "detections.ndjson", lines=True) == 2
+    lines = (tmp_path / "detections.ndjson").read_text().splitlines()
+    assert [json.loads(line) for line in lines] == [
+        ["20200401_043000", "20201EX26", [detection(0.0), detection(6.0)]],
+        ["20210415_050000", "20211B5", []],
+    ]
+
+
+def test_import_json_dir(tmp_path, manifest):
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    (json_dir / "20201EX26_20200401_043000.json").write_text(json.dumps([detection(3.0)]))
+    (json_dir / "20211B5_20210415_050000.json").write_text("[]")
+
+    assert manifest.import_json_dir(json_dir) == 2
+    assert manifest.import_json_dir(json_dir) == 0
+    assert manifest.pending([Path("x", "20201EX26", "20200401_043000.WAV")]) == []
+    assert ["20200401_043000", "20201EX26", [detection(3.0)]] in list(manifest.iter_detections())
@@ -0,0 +1,111 @@
+import json
+import pstats
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from majorvocal import inference
+from majorvocal.benchmark import make_recordings, stub_analyzer
+from majorvocal.metrics import STAGES, MetricsSink, Stopwatch, rss_bytes, start_profiler
+
+
+def test_stopwatch():
+    stopwatch = Stopwatch()
+    with stopwatch("decode"):
+        time.sleep(0.01)
+    stopwatch.add("decode", 1.0)
+    with pytest.raises(ValueError), stopwatch("write"):
+        raise ValueError
+    assert 1.01 <= stopwatch.timings["decode"] < 1.5 and "write" in stopwatch.timings
+    assert rss_bytes() > 2**20
+
+
+def record(path, status="done", pid=1, elapsed=2.0):
+    return {
+        "path": path,
+        "status": status,
+        "duration": 60.0,
+        "elapsed": elapsed,
+        "pid": pid,
+        "rss": 2**30,
+        "timings": {"decode": 0.5, "inference": 1.5},
+    }
+
+
+def test_metrics_sink(tmp_path):
+    textfile = tmp_path / "textfile" / "majorvocal.prom"
+    with MetricsSink(tmp_path / "metrics.jsonl", textfile, interval=3600) as sink:
+        sink.record([record("a"), record("b", pid=2), record("c", status="failed", elapsed=None)])
+        sink.gauge("queue_depth", 7, queue="decoded")
+        assert set(sink.utilization()) == {"1", "2"}
+        assert sink.skip_ratio() == 0.0
+        sink.record([{**record("d"), "chunks": 20, "analysed": 5}])
+        assert sink.skip_ratio() == 0.75
+
+    events = [json.loads(line) for line in (tmp_path / "metrics.jsonl").read_text().splitlines()]
+    assert [e["event"] for e in events] == ["file", "file", "file", "gauge", "file", "utilization"]
+    assert events[0]["timings"] == {"decode": 0.5, "inference": 1.5}
+    lines = textfile.read_text().splitlines()
+    assert "# TYPE majorvocal_files_total counter" in lines
+    assert 'majorvocal_files_total{status="done"} 3' in lines
+    assert 'majorvocal_stage_seconds_total{stage="inference"} 6.0' in lines
+    assert "majorvocal_audio_seconds_total 240.0" in lines
+    assert "majorvocal_chunks_analysed_total 5" in lines
+    assert 'majorvocal_queue_depth{queue="decoded"} 7' in lines
+    assert any(line.startswith('majorvocal_worker_utilization{worker="1"}') for line in lines)
+
+
+def test_metrics_log_rolls_over(tmp_path):
+    with MetricsSink(tmp_path / "metrics.jsonl", max_bytes=2000, backups=2) as sink:
+        for i in range(100):
+            sink.record([record(f"recording-{i}")])
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["metrics.jsonl", "metrics.jsonl.1", "metrics.jsonl.2"]
+
+
+@pytest.mark.parametrize("kind", ["cprofile", "sample"])
+def test_profilers(tmp_path, kind):
+    def before_dump():
+        return sum(np.random.default_rng(0).random(10) for _ in range(20000))
+
+    def after_dump():
+        return sum(np.random.default_rng(0).random(10) for _ in range(20000))
+
+    profiler = start_profiler(kind, tmp_path, interval=0.001)
+    before_dump()
+    profiler.dump()
+    after_dump()  # still recorded after a periodic dump
+    profiler.stop()
+    (profile,) = tmp_path.iterdir()
+    if kind == "cprofile":
+        functions = {f[2] for f in pstats.Stats(str(profile)).stats}
+        assert profile.suffix == ".prof" and {"before_dump", "after_dump"} <= functions
+    else:
+        stacks = profile.read_text()
+        assert profile.suffix == ".folded" and "before_dump" in stacks and "after_dump" in stacks
+    with pytest.raises(ValueError):
+        start_profiler("py-spy", tmp_path)
+
+
+def test_process_files_times_each_stage(tmp_path):
+    paths = sorted(make_recordings(tmp_path / "raw", 3, seconds=6.0))
+    results = list(
+        inference.run_inference(
+            [paths],
+            task=inference.process_files,
+            n_workers=1,
+            analyzer_factory=stub_analyzer,
+            profile="cprofile",
+            profile_dir=tmp_path / "profiles",
+            scores_dir=tmp_path / "scores",
+        )
+    )
+    (records,) = results
+    for r in records:
+        assert set(r["timings"]) == set(STAGES)
+        assert r["elapsed"] == pytest.approx(sum(r["timings"].values()))
+        assert r["pid"] > 0 and r["rss"] > 0
+    (profile,) = Path(tmp_path / "profiles").iterdir()
+    functions = {f[2] for f in pstats.Stats(str(profile)).stats}
+    assert "process_files" in functions
@@ -0,0 +1,79 @@
+import time
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from majorvocal.audio import load_chunks
+from majorvocal.pipeline import Prefetcher
+
+
+def slow_decode(data):
+    time.sleep(0.01)
+    if data == b"bad":
+        raise ValueError("cannot decode")
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i in range(30):
+        path = tmp_path / f"{i:02d}.bin"
+        path.write_bytes(bytes([i]) * 10)
+        paths.append(path)
+    return paths
+
+
+def test_prefetcher_yields_every_file_with_bounded_queues(files):
+    prefetcher = Prefetcher(files, n_readers=3, n_decoders=2, depth=4, decode=slow_decode)
+
+    seen = {}
+    for file_path, chunks in prefetcher:
+        seen[file_path] = chunks
+        assert sum(prefetcher.queue_depths().values()) <= 4
+        time.sleep(0.005)
+
+    assert len(prefetcher) == len(files)
+    assert set(seen) == set(files)
+    for i, path in enumerate(files):
+        np.testing.assert_array_equal(seen[path], np.full(10, i, dtype=np.uint8))
+
+
+def test_prefetcher_raises_decode_and_read_errors(files, tmp_path):
+    bad = tmp_path / "bad.bin"
+    bad.write_bytes(b"bad")
+    with pytest.raises(ValueError, match="cannot decode"):
+        list(Prefetcher(files[:3] + [bad], decode=slow_decode))
+    with pytest.raises(FileNotFoundError):
+        list(Prefetcher([tmp_path / "missing.bin"], decode=slow_decode))
+
+
+class BrokenCache:
+    def get(self, file_path):
+        if file_path.name == "05.bin":
+            raise MemoryError("cannot map the entry")
+        return None
+
+    def put(self, file_path, chunks):
+        return chunks
+
+
+def test_prefetcher_forwards_any_reader_error(files):
+    with pytest.raises(MemoryError):
+        list(Prefetcher(files[:10], n_readers=1, decode=slow_decode, cache=BrokenCache()))
+
+    results = dict(Prefetcher(files[:10], n_readers=1, decode=slow_decode, cache=BrokenCache(), return_exceptions=True))
+    assert isinstance(results.pop(files[5]), MemoryError)
+    assert len(results) == 9 and not any(isinstance(r, Exception) for r in results.values())
+
+
+def test_prefetcher_default_decoder_matches_load_chunks(tmp_path):
+    path = tmp_path / "20200401_043000.WAV"
+    signal = np.random.default_rng(0).uniform(-0.5, 0.5, 7 * 32000).astype(np.float32)
+    sf.write(path, signal, 32000, subtype="PCM_16")
+
+    [(file_path, chunks)] = list(Prefetcher([path], n_readers=1, n_decoders=1))
+
+    assert file_path == path
+    np.testing.assert_array_equal(chunks, load_chunks(path))
@@ -0,0 +1,115 @@
+from pathlib import Path
+
+import numpy as np
+
+from majorvocal import inference, prefilter
+from majorvocal.audio import CHUNK_SAMPLES, SAMPLE_RATE
+
+LABELS = ["Parus major_Great Tit", "Erithacus rubecula_European Robin"]
+
+
+def rainy_recording(rng, n_chunks, songs, hum=()):
+    """Broadband noise, with a 4 kHz song in ``songs`` and a loud 300 Hz hum in ``hum``."""
+    chunks = rng.normal(0, 0.05, size=(n_chunks, CHUNK_SAMPLES)).astype(np.float32)
+    t = np.arange(SAMPLE_RATE // 2) / SAMPLE_RATE
+    for i in songs:
+        chunks[i, 48000:72000] += 0.2 * np.sin(2 * np.pi * 4000 * t)
+    for i in hum:
+        chunks[i] += 0.5 * np.sin(2 * np.pi * 300 * np.arange(CHUNK_SAMPLES) / SAMPLE_RATE)
+    return chunks
+
+
+class ToneAnalyzer:
+    """Great tit wherever a chunk has most of its energy around 4 kHz."""
+
+    labels = LABELS
+
+    def __init__(self):
+        self.n_chunks = 0
+
+    def predict_batch(self, batch):
+        self.n_chunks += len(batch)
+        power = np.abs(np.fft.rfft(batch, axis=1)) ** 2
+        freqs = np.fft.rfftfreq(CHUNK_SAMPLES, 1 / SAMPLE_RATE)
+        band = power[:, (freqs > 3900) & (freqs < 4100)].sum(axis=1) / np.maximum(power.sum(axis=1), 1e-12)
+        return np.stack([np.clip(10 * band, 0, 1), np.zeros(len(batch))], axis=1)
+
+    def return_predicted_species_list(self, lon, lat, week_48, filter_threshold):
+        return []
+
+
+def test_select_chunks_keeps_songs_over_rain():
+    chunks = rainy_recording(np.random.default_rng(0), 20, songs=[3, 4, 15], hum=[8])
+
+    assert np.flatnonzero(prefilter.select_chunks(chunks)).tolist() == [3, 4, 15]
+    assert np.flatnonzero(prefilter.select_chunks(chunks, pad=1)).tolist() == [2, 3, 4, 5, 14, 15, 16]
+    assert not prefilter.select_chunks(rainy_recording(np.random.default_rng(1), 10, songs=[])).any()
+    assert prefilter.select_chunks(np.zeros((0, CHUNK_SAMPLES))).shape == (0,)
+
+
+def test_keep_mask_pads_each_side_by_pad_chunks():
+    peaks = np.zeros(11)
+    peaks[5] = 30.0
+    for pad in range(5):
+        keep = prefilter.keep_mask(peaks, floor=0.0, margin_db=10.0, pad=pad)
+        assert np.flatnonzero(keep).tolist() == list(range(5 - pad, 6 + pad))
+    assert np.flatnonzero(prefilter.keep_mask(peaks, 0.0, 10.0, pad=7)).tolist() == list(range(11))
+    assert prefilter.keep_mask(np.zeros(2), 0.0, 10.0, pad=3).tolist() == [False, False]
+    assert prefilter.keep_mask(np.array([30.0, 0, 0, 0, 0]), 0.0, 10.0, pad=3).tolist() == [True] * 4 + [False]
+
+
+def test_prefiltered_scores_map_back_to_chunks():
+    rng = np.random.default_rng(2)
+    items = [
+        (Path("20201EX1", "20200401_043000.WAV"), rainy_recording(rng, 6, songs=[1, 5])),
+        (Path("20201EX2", "20200401_043000.WAV"), rainy_recording(rng, 3, songs=[])),
+        (Path("20201EX3", "20200401_043000.WAV"), rainy_recording(rng, 5, songs=[0])),
+    ]
+    analyzer, skipper = ToneAnalyzer(), prefilter.Prefilter()
+
+    full = list(inference.predict_scores(analyzer, items, batch_size=2))
+    filtered = list(inference.predict_scores(analyzer, items, batch_size=2, prefilter=skipper))
+
+    assert [f for f, _ in filtered] == [f for f, _ in items]
+    for (_, full_scores), (_, scores) in zip(full, filtered):
+        kept = scores.any(axis=1)
+        assert np.array_equal(scores[kept], full_scores[kept])
+        assert (full_scores[~kept] < 0.8).all()
+    assert skipper.skip_ratio() == 1 - 3 / 14
+
+
+def test_validate_reports_skip_ratio_and_recall():
+    rng = np.random.default_rng(3)
+    items = [
+        (Path(f"20201EX{i}", "20200401_043000.WAV"), rainy_recording(rng, 10, songs=songs))
+        for i, songs in enumerate([[2], [], [0, 9], [4, 5, 6]])
+    ]
+    analyzer = ToneAnalyzer()
+
+    result = prefilter.validate(analyzer, items, batch_size=4)
+
+    assert result["detections"] == result["detections_prefiltered"] == 6
+    assert result["recall"] == 1.0
+    assert (result["chunks"], result["analysed"]) == (40, 6)
+    assert result["skip_ratio"] > 0.5
+    assert result["files"][str(items[2][0])] == (2, 2)
+    assert analyzer.n_chunks == 4 * 12 + 3 * 4  # three batches of 4 per file, then one per file with songs
+
+
+def test_process_files_counts_analysed_chunks(tmp_path, monkeypatch):
+    folder = tmp_path / "20201EX26"
+    folder.mkdir()
+    paths = [folder / f"20200401_04{i}000.WAV" for i in range(2)]
+    for path in paths:
+        path.write_bytes(b"\0" * 2000)
+    rng = np.random.default_rng(4)
+    chunks = {paths[0]: rainy_recording(rng, 8, songs=[1]), paths[1]: rainy_recording(rng, 4, songs=[])}
+    monkeypatch.setattr(inference, "load_chunks", lambda file_path, stopwatch=None: chunks[file_path])
+    monkeypatch.setattr(inference, "_analyzer", ToneAnalyzer())
+
+    records = inference.process_files(paths, batch_size=4, prefilter_db=prefilter.MARGIN_DB)
+    full = inference.process_files(paths, batch_size=4)
+
+    assert [(r["chunks"], r["analysed"]) for r in records] == [(8, 1), (4, 0)]
+    assert [(r["chunks"], r["analysed"]) for r in full] == [(8, 8), (4, 4)]
+    assert [len(r["detections"]) for r in records] == [len(r["detections"]) for r in full] == [1, 0]
@@ -0,0 +1,100 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from majorvocal import inference
+from majorvocal.scores import ScoreWriter, load_detections, read_scores
+
+LABELS = [
+    "Parus major_Great Tit",
+    "Cyanistes caeruleus_Eurasian Blue Tit",
+    "Erithacus rubecula_European Robin",
+    "Sitta europaea_Eurasian Nuthatch",
+]
+
+
+@pytest.fixture
+def recordings():
+    rng = np.random.default_rng(3)
+    scores = {
+        Path("20201EX26", "20200401_043000.WAV"): rng.uniform(0, 1, (6, 4)).astype(np.float16).astype(np.float32),
+        Path("20201EX26", "20200402_043000.WAV"): np.zeros((3, 4), dtype=np.float32),
+        Path("20211B5", "20210415_050000.WAV"): rng.uniform(0, 1, (4, 4)).astype(np.float16).astype(np.float32),
+    }
+    return scores
+
+
+def expected(recordings, min_conf, species=None, allowed=frozenset()):
+    out = []
+    for file_path, scores in sorted(recordings.items(), key=lambda x: (x[0].parent.name, x[0].stem)):
+        detections = [
+            d
+            for i, row in enumerate(scores)
+            for d in inference.scores_to_detections(row, LABELS, i * 3.0, allowed, min_conf)
+            if species is None or d["scientific_name"] in species
+        ]
+        out.append([file_path.stem, file_path.parent.name, detections])
+    return out
+
+
+@pytest.mark.parametrize("min_conf", [0.2, 0.5, 0.8])
+def test_load_detections_matches_inference_at_any_threshold(tmp_path, recordings, min_conf):
+    with ScoreWriter(tmp_path, LABELS, rows_per_file=10) as writer:
+        for file_path, scores in recordings.items():
+            writer.add(file_path, scores)
+
+    assert load_detections(tmp_path, min_conf=min_conf) == expected(recordings, min_conf)
+
+
+def test_species_partition_and_location_filters(tmp_path, recordings):
+    allowed = frozenset(LABELS[:3])
+    with ScoreWriter(tmp_path, LABELS, top_k=2) as writer:
+        for file_path, scores in recordings.items():
+            writer.add(file_path, scores, allowed)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["year=2020", "year=2021"]
+    assert read_scores(tmp_path, pnums=["20211B5"])["pnum"].unique().to_pylist() == ["20211B5"]
+    assert "Sitta europaea_Eurasian Nuthatch" not in read_scores(tmp_path)["label"].to_pylist()
+
+    result = load_detections(tmp_path, min_conf=0.3, species={"Parus major"}, years=[2020])
+    assert [r[:2] for r in result] == [["20200401_043000", "20201EX26"], ["20200402_043000", "20201EX26"]]
+    assert result[1][2] == []
+    for timestamp, _, detections in result:
+        assert all(d["scientific_name"] == "Parus major" and d["confidence"] > 0.3 for d in detections)
+
+
+def test_only_top_k_scores_per_chunk_are_kept(tmp_path):
+    scores = np.array([[0.9, 0.7, 0.5, 0.05], [0.6, 0, 0, 0]]).astype(np.float16).astype(np.float32)
+    recordings = {Path("20201EX26", "20200401_043000.WAV"): scores}
+    with ScoreWriter(tmp_path, LABELS, top_k=2) as writer:
+        writer.add(*next(iter(recordings.items())))
+
+    # Exact while a chunk has at most top_k species above the threshold
+    assert load_detections(tmp_path, min_conf=0.6) == expected(recordings, 0.6)
+    # but the robin, third in the first chunk, was not stored
+    [[timestamp, pnum, full]] = expected(recordings, 0.4)
+    assert load_detections(tmp_path, min_conf=0.4) == [
+        [timestamp, pnum, [d for d in full if d["scientific_name"] != "Erithacus rubecula"]]
+    ]
+
+
+def test_predict_files_writes_scores(tmp_path):
+    class Analyzer:
+        labels = LABELS
+
+        def predict_batch(self, batch):
+            return np.clip(batch[:, :4], 0, 1)
+
+        def return_predicted_species_list(self, **kwargs):
+            return []
+
+    chunks = np.zeros((3, 144000), dtype=np.float32)
+    chunks[:, :4] = [[0.875, 0.0625, 0.5, 0.0], [0.0, 0.0, 0.0, 0.0], [0.25, 0.75, 0.5, 0.125]]
+    file_path = Path("20201EX26", "20200401_043000.WAV")
+
+    with ScoreWriter(tmp_path, LABELS) as writer:
+        [(_, detections)] = inference.predict_files(Analyzer(), [(file_path, chunks)], min_conf=0.8, score_writer=writer)
+
+    assert [d["label"] for d in detections] == ["Parus major_Great Tit"]
+    assert load_detections(tmp_path, min_conf=0.4)[0][2] == expected({file_path: chunks[:, :4]}, 0.4)[0][2]
@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+import pyarrow.dataset as ds
+
+from majorvocal.detections import sync_detections
+from majorvocal.manifest import RunManifest, file_record
+from majorvocal.shards import ShardQueue, make_shards, merge_shards, work
+
+FILE_PATHS = [
+    Path("/data", pnum, f"202004{day:02d}_0{hour}0000.WAV")
+    for pnum in ["20201EX25", "20201B5", "20201C47"]
+    for day in range(10, 14)
+    for hour in (4, 5)
+]
+
+
+def stub_process(file_paths):
+    time.sleep(0.05)
+    song = {"scientific_name": "Parus major", "common_name": "Great Tit", "confidence": 0.9}
+    return [file_record(f, "done", detections=[{**song, "start_time": 0.0, "end_time": 3.0}]) for f in file_paths]
+
+
+def run_worker(queue_path, out_dir, lease):
+    with ShardQueue(queue_path, lease_seconds=lease) as queue:
+        work(queue, out_dir, stub_process)
+
+
+def die_holding_lease(queue_path, lease):
+    # A node that crashes in the middle of a shard
+    ShardQueue(queue_path, lease_seconds=lease).claim("dead-node")
+    os._exit(1)
+
+
+def test_make_shards():
+    shards = make_shards(reversed(FILE_PATHS))
+    assert len(shards) == 12
+    assert shards["20201B5_20200410"] == [str(FILE_PATHS[8]), str(FILE_PATHS[9])]
+    assert make_shards(FILE_PATHS) == shards
+
+
+def test_leases(tmp_path):
+    with ShardQueue(tmp_path / "queue.sqlite", lease_seconds=0.5, max_attempts=2) as queue:
+        assert queue.add(make_shards(FILE_PATHS[:4])) == 2
+        assert queue.add(make_shards(FILE_PATHS[:6])) == 1
+        assert queue.add(make_shards(FILE_PATHS[:6])) == 0
+
+        first = queue.claim("a")
+        assert first[0] == "20201EX25_20200410" and len(first[1]) == 2
+        assert queue.claim("b")[0] == "20201EX25_20200411"
+        assert queue.renew(first[0], "a")
+        queue.fail("20201EX25_20200411", "b", "OSError")
+        assert queue.claim("b")[0] == "20201EX25_20200411"
+        queue.fail("20201EX25_20200411", "b", "OSError")
+        assert queue.claim("c")[0] == "20201EX25_20200412"
+        assert queue.claim("c") is None
+
+        # Expired leases are claimed again; the old owner can no longer renew
+        time.sleep(0.6)
+        assert queue.claim("d")[0] == first[0]
+        assert not queue.renew(first[0], "a")
+        assert queue.complete(first[0], "d")
+        assert queue.summary() == {"done": 1, "failed": 1, "leased": 1}
+        assert queue.failures() == [("20201EX25_20200411", "OSError")]
+
+
+def test_workers_share_the_queue(tmp_path):
+    queue_path, out_dir = tmp_path / "shared" / "queue.sqlite", tmp_path / "shared" / "shards"
+    lease = 1.0
+    with ShardQueue(queue_path, lease_seconds=lease) as queue:
+        queue.add(make_shards(FILE_PATHS))
+
+    ctx = multiprocessing.get_context("spawn")
+    dead = ctx.Process(target=die_holding_lease, args=(queue_path, lease))
+    dead.start()
+    dead.join()
+    workers = [ctx.Process(target=run_worker, args=(queue_path, out_dir, lease)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert all(worker.exitcode == 0 for worker in workers)
+
+    with ShardQueue(queue_path) as queue:
+        assert queue.summary() == {"done": 12}
+    with RunManifest(tmp_path / "manifest.sqlite") as manifest:
+        assert merge_shards(out_dir, manifest) == 12
+        assert manifest.summary() == {"done": len(FILE_PATHS)}
+        assert manifest.pending(FILE_PATHS) == []
+        assert sync_detections(manifest, tmp_path / "detections") == len(FILE_PATHS)
+    assert list(out_dir.iterdir()) == []
+    table = ds.dataset(tmp_path / "detections", partitioning="hive").to_table()
+    assert table.num_rows == len(FILE_PATHS)
+
+
+def test_late_recordings_and_failed_shards(tmp_path):
+    late = Path("/data", "20201EX25", "20200410_060000.WAV")
+    with ShardQueue(tmp_path / "queue.sqlite", max_attempts=1) as queue:
+        queue.add(make_shards(FILE_PATHS[:2]))
+        assert work(queue, tmp_path / "shards", stub_process) == 1
+
+        # A recording copied later for a day already processed
+        assert queue.add(make_shards([*FILE_PATHS[:2], late])) == 1
+        assert queue.add(make_shards([*FILE_PATHS[:2], late])) == 0
+        shard_id, paths = queue.claim("a")
+        assert shard_id.startswith("20201EX25_20200410-") and paths == [str(late)]
+        queue.fail(shard_id, "a", "OSError")
+
+        queue.add(make_shards(FILE_PATHS[2:4]))
+
+        def broken(file_paths):
+            raise OSError("disk gone")
+
+        assert work(queue, tmp_path / "shards", broken) == 1
+        assert queue.summary() == {"done": 1, "failed": 2}
+    assert sorted(p.name for p in (tmp_path / "shards").iterdir()) == ["20201EX25_20200410.sqlite"]
@@ -0,0 +1,78 @@
+from datetime import date, timedelta
+
+import numpy as np
+import polars as pl
+import pytest
+from polars.testing import assert_frame_equal
+
+from majorvocal.spatial import NestboxIndex, correlate_pairs, daily_matrix, neighbour_correlations
+
+
+@pytest.fixture
+def index():
+    rng = np.random.default_rng(0)
+    return NestboxIndex([f"B{i}" for i in range(200)], rng.uniform(0, 1000, size=(200, 2)))
+
+
+def test_neighbour_queries_match_brute_force(index):
+    distances = np.hypot(*(index.coords[:, None] - index.coords[None]).T)
+
+    near = index.within("B7", 120)
+    expected = sorted((d, f"B{i}") for i, d in enumerate(distances[7]) if d <= 120 and i != 7)
+    assert [name for name, _ in near] == [name for _, name in expected]
+    assert np.allclose([d for _, d in near], [d for d, _ in expected])
+
+    nearest = index.nearest("B7", 3)
+    assert [name for name, _ in nearest] == [name for _, name in expected[:3]]
+    assert index.nearest("B7", 500)[-1][1] == distances[7].max()
+
+    pairs, pair_distances = index.pairs(80)
+    i, j = np.nonzero(np.triu(distances <= 80, k=1))
+    assert np.array_equal(pairs, np.column_stack([i, j]))
+    assert np.allclose(pair_distances, distances[i, j])
+    with pytest.raises(ValueError):
+        NestboxIndex(["B1", "B1"], [[0, 0], [1, 1]])
+
+
+def test_correlate_pairs_in_blocks():
+    rng = np.random.default_rng(1)
+    matrix = rng.poisson(20, size=(30, 40)).astype(float)
+    matrix[rng.uniform(size=matrix.shape) < 0.2] = np.nan
+    matrix[3] = 5.0  # constant
+    matrix[4, 6:] = np.nan  # recorded on 6 days only
+    pairs = np.array([(a, b) for a in range(30) for b in range(a + 1, 30)])
+
+    r, n = correlate_pairs(matrix, pairs, min_days=10, block=7)
+
+    for (a, b), value, days in zip(pairs, r, n):
+        shared = ~np.isnan(matrix[a]) & ~np.isnan(matrix[b])
+        assert days == shared.sum()
+        if 3 in (a, b) or days < 10:
+            assert np.isnan(value)
+        else:
+            assert value == pytest.approx(np.corrcoef(matrix[a, shared], matrix[b, shared])[0, 1])
+
+
+def test_neighbour_correlations_by_year():
+    index = NestboxIndex(["EX1", "EX2", "EX3", "C4"], [[0, 0], [50, 0], [0, 60], [900, 900]])
+    rng = np.random.default_rng(2)
+    rows = []
+    for year, pnums in [(2020, ["20201EX1", "20201EX2", "20201C4", "20201Z9"]), (2021, ["20211EX1", "20211EX3"])]:
+        start = date(year, 4, 1)
+        shared = rng.poisson(30, 20)
+        for k, pnum in enumerate(pnums):
+            for day in range(k, 20):  # boxes start recording on different days
+                rows.append((pnum, start + timedelta(days=day), int(shared[day] + rng.poisson(3))))
+    daily = pl.DataFrame(rows, schema={"pnum": pl.String, "date": pl.Date, "count": pl.Int64}, orient="row")
+
+    matrix, pnums, days = daily_matrix(daily.filter(pl.col("date").dt.year() == 2021))
+    assert pnums == ["20211EX1", "20211EX3"] and len(days) == 20 and np.isnan(matrix[1, 0])
+
+    pairs = neighbour_correlations(daily, index, radius=70, n_workers=1)
+    expected = [(2020, "20201EX1", "20201EX2"), (2021, "20211EX1", "20211EX3")]
+    assert pairs.select("year", "pnum_a", "pnum_b").rows() == expected
+    assert pairs["distance"].to_list() == [50.0, 60.0] and pairs["days"].to_list() == [19, 19]
+    assert (pairs["r"] > 0.8).all()  # driven by the same daily pattern
+
+    assert_frame_equal(neighbour_correlations(daily, index, radius=70, n_workers=2), pairs)
+    assert neighbour_correlations(daily, index, radius=70, min_days=20, n_workers=1)["r"].null_count() == 2
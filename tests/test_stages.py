@@ -0,0 +1,86 @@
+import pytest
+
+from majorvocal.stages import Pipeline, Stage, fingerprint
+
+
+def test_fingerprint(tmp_path):
+    a = tmp_path / "a.txt"
+    a.write_text("one")
+    folder = tmp_path / "folder"
+    folder.mkdir()
+    key = fingerprint([a, folder], {"pnums": ["20201EX25"]})
+    assert fingerprint([a, folder], {"pnums": ["20201EX25"]}) == key
+    assert fingerprint([a, folder], {"pnums": None}) != key
+    a.write_text("two")
+    assert fingerprint([a, folder], {"pnums": ["20201EX25"]}) != key
+    key = fingerprint([folder])
+    (folder / "part-0.parquet").write_bytes(b"0")
+    assert fingerprint([folder]) != key
+    assert fingerprint([tmp_path / "missing"]) != fingerprint([folder])
+
+
+def make_pipeline(tmp_path, calls):
+    source = tmp_path / "source.txt"
+    middle = tmp_path / "middle.txt"
+    final = tmp_path / "final.txt"
+
+    def first(params):
+        calls.append("first")
+        middle.write_text(source.read_text().upper())
+
+    def second(params):
+        calls.append("second")
+        final.write_text(middle.read_text() * params["repeat"])
+
+    stages = [
+        Stage("first", first, inputs=lambda p: [source], outputs=lambda p: [middle]),
+        Stage("second", second, inputs=lambda p: [middle], outputs=lambda p: [final], deps=["first"], params=["repeat"]),
+    ]
+    return Pipeline(stages, tmp_path / "state.json")
+
+
+def test_pipeline_skips_unchanged_stages(tmp_path):
+    calls = []
+    pipeline = make_pipeline(tmp_path, calls)
+    (tmp_path / "source.txt").write_text("a")
+
+    report = pipeline.run(["second"], {"repeat": 2, "workers": 4})
+    assert calls == ["first", "second"] and report["second"]["ran"]
+    assert (tmp_path / "final.txt").read_text() == "AA"
+
+    # Nothing changed; parameters the stages do not declare are ignored
+    report = pipeline.run(["second"], {"repeat": 2, "workers": 8})
+    assert calls == ["first", "second"] and not report["first"]["ran"]
+
+    # A changed parameter reruns only its stage
+    pipeline.run(["second"], {"repeat": 3})
+    assert calls[2:] == ["second"]
+
+    # A changed input reruns the stage and everything downstream of it
+    (tmp_path / "source.txt").write_text("b")
+    pipeline.run(["second"], {"repeat": 3})
+    assert calls[3:] == ["first", "second"]
+    assert (tmp_path / "final.txt").read_text() == "BBB"
+
+    # Missing outputs, --force and --only
+    (tmp_path / "final.txt").unlink()
+    pipeline.run(["second"], {"repeat": 3})
+    assert calls[5:] == ["second"]
+    pipeline.run(["second"], {"repeat": 3}, with_deps=False, force=True)
+    assert calls[6:] == ["second"]
+
+    # The state survives a new Pipeline
+    make_pipeline(tmp_path, calls).run(["second"], {"repeat": 3})
+    assert len(calls) == 7
+
+
+def test_pipeline_plan():
+    stages = [Stage("a", print), Stage("b", print, deps=["a"]), Stage("c", print, deps=["a", "b"])]
+    pipeline = Pipeline(stages, "state.json")
+    assert pipeline.plan(["c"]) == ["a", "b", "c"]
+    assert pipeline.plan(["c", "b"], with_deps=False) == ["c", "b"]
+    with pytest.raises(KeyError):
+        pipeline.plan(["d"])
+    cyclic = Pipeline([Stage("a", print, deps=["b"]), Stage("b", print, deps=["a"])], "state.json")
+    with pytest.raises(ValueError):
+        cyclic.plan(["a"])
@@ -1,7 +1,12 @@
 import pandas as pd
+import polars as pl
 import pytest
 
-from majorvocal.utils import extract_parus_major, to_df
+from majorvocal.detections import write_detections
+from majorvocal.utils import extract_parus_major, extract_species, load_parus_major, load_species, split_species, to_df
+
+
+PMAJOR_COLUMNS = ["timestamp", "pnum", "start_time", "end_time", "confidence"]
 
 
 @pytest.fixture
@@ -24,7 +29,8 @@ def sample_data():
                 {"scientific_name": "Parus minor", "start_time": 45, "end_time": 55, "confidence": 0.5},
             ],
         ],
-        # Add more sample data as needed
+        ["20220103_000000", "recording3", [{"scientific_name": "Parus minor", "start_time": 0, "end_time": 3, "confidence": 0.9}]],
+        ["20220104_000000", "recording4", []],
     ]
 
 
@@ -33,10 +39,55 @@ def test_extract_parus_major(sample_data):
         {"timestamp": "20220101_000000", "pnum": "recording1", "start_time": 10, "end_time": 20, "confidence": 0.9},
         {"timestamp": "20220102_000000", "pnum": "recording2", "start_time": 5, "end_time": 15, "confidence": 0.7},
         {"timestamp": "20220102_000000", "pnum": "recording2", "start_time": 25, "end_time": 35, "confidence": 0.6},
+        {"timestamp": "20220103_000000", "pnum": "recording3", "start_time": None, "end_time": None, "confidence": None},
+        {"timestamp": "20220104_000000", "pnum": "recording4", "start_time": None, "end_time": None, "confidence": None},
     ]
 
     result = extract_parus_major(sample_data)
-    assert result == expected_output
+    assert isinstance(result, pl.DataFrame)
+    assert result.to_dicts() == expected_output
+    # Batching does not change the output
+    assert extract_parus_major(iter(sample_data), batch_size=1).to_dicts() == expected_output
+    assert extract_parus_major([]).columns == ["timestamp", "pnum", "start_time", "end_time", "confidence"]
+
+
+def test_extract_species_in_one_pass(sample_data):
+    both = extract_species(sample_data, {"Parus major": 0.65, "Parus minor": 0.0}, batch_size=3)
+
+    assert both.schema["species"] == pl.Enum(["Parus major", "Parus minor"])
+    assert both.select("pnum", "species").rows() == [
+        ("recording1", "Parus major"),
+        ("recording1", "Parus minor"),
+        ("recording2", "Parus major"),  # the other one is below 0.65
+        ("recording2", "Parus minor"),
+        ("recording3", "Parus minor"),
+        ("recording4", None),
+    ]
+    tables = split_species(both)
+    assert list(tables) == ["Parus major", "Parus minor"]
+    assert tables["Parus major"].to_dicts() == extract_parus_major(sample_data).filter(
+        pl.col("confidence").is_null() | (pl.col("confidence") >= 0.65)
+    ).to_dicts()
+    assert tables["Parus minor"].to_dicts() == extract_parus_major(sample_data, species="Parus minor").to_dicts()
+
+    # Requested species without detections still get a table, of null rows
+    tables = split_species(extract_species(sample_data, ["Parus major", "Sitta europaea"]))
+    assert tables["Sitta europaea"]["confidence"].null_count() == 4
+    assert split_species(extract_species(sample_data))["Parus minor"].height == 4
+    assert extract_species([], ["Parus major"]).columns == ["timestamp", "pnum", "species", *PMAJOR_COLUMNS[2:]]
+
+
+def test_load_species_matches_extraction(tmp_path, sample_data):
+    write_detections(sample_data, tmp_path / "detections")
+
+    def stored(df):  # the dataset keeps float32 confidences
+        return sorted(df.with_columns(pl.col("confidence").cast(pl.Float32)).rows(), key=str)
+
+    loaded = load_species(tmp_path / "detections", ["Parus minor", "Parus major"])
+    extracted = extract_species(sample_data, ["Parus minor", "Parus major"])
+    assert loaded.schema == extracted.schema
+    assert stored(loaded) == stored(extracted)
+    assert stored(load_parus_major(tmp_path / "detections")) == stored(extract_parus_major(sample_data))
 
 
 def test_to_df():
@@ -49,6 +100,7 @@ def test_to_df():
         {
             "timestamp": ["20220101_000000", "20220102_000000", "20220102_000000"],
             "pnum": ["20201EX26", "20201EX66", "20201EX268"],
+            "date": pd.to_datetime(["20220101", "20220102", "20220102"], format="%Y%m%d"),
             "start_time": [10, 5, 25],
             "end_time": [20, 15, 35],
             "confidence": [0.9, 0.7, 0.6],
@@ -70,3 +122,12 @@ def test_to_df():
 
     result = to_df(pmajor)
     pd.testing.assert_frame_equal(result, expected_output)
+
+
+def test_to_df_keeps_placeholders(sample_data):
+    result = to_df(extract_parus_major(sample_data))
+    assert len(result) == 5
+    placeholder = result[result["pnum"] == "recording4"].iloc[0]
+    assert placeholder["date"] == pd.Timestamp("2022-01-04")
+    assert pd.isna(placeholder["start_datetime"]) and pd.isna(placeholder["confidence"])
+    assert result["start_datetime"].iloc[2] == pd.Timestamp("2022-01-02 00:00:25")
@@ -0,0 +1,105 @@
+import math
+import tracemalloc
+
+import numpy as np
+import pytest
+import soundfile as sf
+from scipy.signal import resample_poly
+
+from majorvocal import inference
+from majorvocal.audio import SAMPLE_RATE, load_chunks, split_chunks
+from majorvocal.cache import ChunkCache
+from majorvocal.metrics import Stopwatch
+from majorvocal.prefilter import Prefilter
+from majorvocal.wav import WavChunks, WavReader, open_chunks
+
+
+@pytest.mark.parametrize(
+    "sr, subtype, channels",
+    [(48000, "PCM_16", 1), (250000, "PCM_16", 1), (96000, "PCM_24", 2), (44100, "FLOAT", 1), (8000, "PCM_U8", 1)],
+)
+def test_windows_match_whole_recording_resampled(tmp_path, sr, subtype, channels):
+    path = tmp_path / "20200401_043000.WAV"
+    signal = np.random.default_rng(0).uniform(-0.5, 0.5, size=(int(sr * 10.7), channels)).astype(np.float32)
+    sf.write(path, signal, sr, subtype=subtype)
+    decoded = sf.read(path, dtype="float32", always_2d=True)[0].mean(axis=1)
+    g = math.gcd(sr, SAMPLE_RATE)
+    expected = split_chunks(resample_poly(decoded, SAMPLE_RATE // g, sr // g).astype(np.float32), overlap=0.5)
+
+    stopwatch = Stopwatch()
+    chunks = WavChunks(path, overlap=0.5, block=2, stopwatch=stopwatch)
+
+    assert chunks.shape == expected.shape == (4, 144000)
+    assert np.array_equal(np.stack(list(chunks)), expected)
+    assert np.array_equal(chunks[[3, 1]], expected[[3, 1]])
+    assert np.array_equal(chunks[np.array([True, False, False, True])], expected[[0, 3]])
+    assert np.array_equal(chunks[1:3, :100], expected[1:3, :100])
+    assert np.array_equal(chunks[2], expected[2])
+    assert stopwatch.timings["decode"] > 0 and ("resample" in stopwatch.timings) == (sr != SAMPLE_RATE)
+
+
+def test_same_chunks_as_librosa_at_48_khz(tmp_path):
+    path = tmp_path / "20200401_043000.WAV"
+    sf.write(path, np.random.default_rng(1).uniform(-0.5, 0.5, SAMPLE_RATE * 7), SAMPLE_RATE, subtype="PCM_16")
+
+    assert np.array_equal(np.asarray(open_chunks(path)), load_chunks(path))
+
+
+def test_truncated_and_invalid_files(tmp_path):
+    path = tmp_path / "20200401_043000.WAV"
+    sf.write(path, np.zeros(SAMPLE_RATE * 6, dtype=np.float32), SAMPLE_RATE, subtype="PCM_16")
+    data, offset = path.read_bytes(), WavReader(path).offset
+    path.write_bytes(data[: offset + SAMPLE_RATE * 3 * 2 + 1])  # the header still claims 6 s
+    assert WavReader(path).n_frames == SAMPLE_RATE * 3
+    assert len(WavChunks(path)) == 1
+
+    path.write_bytes(data[:offset])
+    assert len(WavChunks(path)) == 0 and list(WavChunks(path)) == []
+    path.write_bytes(b"not a wav file at all")
+    with pytest.raises(ValueError, match="not a WAV file"):
+        WavReader(path)
+
+
+def test_memory_does_not_grow_with_recording(tmp_path):
+    path = tmp_path / "20200401_043000.WAV"
+    sr = 96000
+    with sf.SoundFile(path, "w", sr, 1, "PCM_16") as f:
+        for _ in range(120):
+            f.write(np.random.default_rng(2).uniform(-0.5, 0.5, sr).astype(np.float32))
+
+    tracemalloc.start()
+    n = sum(1 for _ in WavChunks(path, block=1))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert n == 40
+    # The whole recording at 96 kHz as float32 alone would be 46 MB
+    assert peak < 16 * 2**20
+
+
+class SilentAnalyzer:
+    labels = ["Parus major_Great Tit"]
+
+    def predict_batch(self, batch):
+        return np.zeros((len(batch), 1), dtype=np.float32)
+
+
+def test_prefilter_and_cache_memory_does_not_grow_with_recording(tmp_path):
+    def peak_memory(seconds):
+        path = tmp_path / f"{seconds}" / "20200401_043000.WAV"
+        path.parent.mkdir()
+        with sf.SoundFile(path, "w", SAMPLE_RATE, 1, "PCM_16") as f:
+            for _ in range(seconds):
+                f.write(np.random.default_rng(3).uniform(-0.5, 0.5, SAMPLE_RATE).astype(np.float32))
+        tracemalloc.start()
+        items = [(path, WavChunks(path, block=2))]
+        [(_, scores)] = inference.predict_scores(SilentAnalyzer(), items, 4, prefilter=Prefilter(margin_db=-200))
+        cached = ChunkCache(tmp_path / "cache").put(path, WavChunks(path, block=2))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert len(scores) == len(cached) == seconds // 3 and np.array_equal(cached[5], items[0][1][5])
+        return peak
+
+    peak_memory(60)  # imports and first-call allocations
+    # The whole 360 s recording as float32 alone would be 69 MB
+    assert peak_memory(360) < peak_memory(120) + 8 * 2**20